@@ -2,14 +2,14 @@
 from .runners import BuildRunner, RunnerBuilder
 from .parallel import BuildDistributedDataloader, BuildDistributedModel
 from .datasets import (
-    SegmentationEvaluator, BuildDataTransform, DataTransformBuilder, BuildDataset, DatasetBuilder
+    SegmentationEvaluator, ConfusionStore, BuildDataTransform, DataTransformBuilder, BuildDataset, DatasetBuilder
 )
 from .utils import (
     setrandomseed, saveckpts, loadckpts, touchdir, saveaspickle, loadpicklefile, symlink, loadpretrainedweights,
-    BaseModuleBuilder, EnvironmentCollector, ConfigParser, LoggerHandleBuilder, BuildLoggerHandle
+    BaseModuleBuilder, EnvironmentCollector, ConfigParser, LoggerHandleBuilder, BuildLoggerHandle, MetricsAccumulator
 )
 from .models import (
     BuildLoss, LossBuilder, BuildDecoder, DecoderBuilder, BuildOptimizer, OptimizerBuilder, BuildParamsConstructor, ParamsConstructorBuilder,
     BuildEncoder, EncoderBuilder, BuildActivation, ActivationBuilder, BuildNormalization, NormalizationBuilder, BuildScheduler, SchedulerBuilder,
-    BuildSegmentor, SegmentorBuilder
+    BuildSegmentor, SegmentorBuilder, BuildInferencer, InferencerBuilder
 )
\ No newline at end of file
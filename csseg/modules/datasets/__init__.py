@@ -1,3 +1,3 @@
 '''initialize'''
 from .builder import DatasetBuilder, BuildDataset
-from .pipelines import SegmentationEvaluator, BuildDataTransform, DataTransformBuilder
\ No newline at end of file
+from .pipelines import SegmentationEvaluator, ConfusionStore, BuildDataTransform, DataTransformBuilder
\ No newline at end of file
@@ -6,6 +6,8 @@ Author:
 '''
 import os
 import pandas as pd
+from .shards import _ShardDataset
+from .manifest import SampleManifest
 from .base import _BaseDataset, BaseDataset
 
 
@@ -45,8 +47,15 @@ class _ADE20kDataset(_BaseDataset):
         self.ann_dir = os.path.join(rootdir, 'ADEChallengeData2016/annotations', setmap_dict[dataset_cfg['set']])
         # obatin imageids
         df = pd.read_csv(os.path.join(rootdir, 'ADEChallengeData2016', dataset_cfg['set']+'.txt'), names=['imageids'])
-        self.imageids = df['imageids'].values
-        self.imageids = [str(_id) for _id in self.imageids]
+        self.manifest = SampleManifest.fromdirs(df['imageids'].values, self.image_dir, self.ann_dir)
+
+
+'''_ADE20kShardDataset'''
+class _ADE20kShardDataset(_ShardDataset):
+    num_classes = _ADE20kDataset.num_classes
+    classnames = _ADE20kDataset.classnames
+    def __init__(self, mode, dataset_cfg):
+        super(_ADE20kShardDataset, self).__init__(mode=mode, dataset_cfg=dataset_cfg)
 
 
 '''ADE20kDataset'''
@@ -79,4 +88,16 @@ class ADE20kDataset(BaseDataset):
     '''builddatagenerator'''
     def builddatagenerator(self, mode, dataset_cfg):
         data_generator = _ADE20kDataset(mode, dataset_cfg)
+        return data_generator
+
+
+'''ADE20kShardDataset'''
+class ADE20kShardDataset(ADE20kDataset):
+    def __init__(self, mode, task_name, task_id, dataset_cfg):
+        super(ADE20kShardDataset, self).__init__(
+            mode=mode, task_name=task_name, task_id=task_id, dataset_cfg=dataset_cfg
+        )
+    '''builddatagenerator'''
+    def builddatagenerator(self, mode, dataset_cfg):
+        data_generator = _ADE20kShardDataset(mode, dataset_cfg)
         return data_generator
\ No newline at end of file
@@ -7,12 +7,19 @@ Author:
 import os
 import copy
 import torch
+import hashlib
 import collections
 import torchvision
 import numpy as np
 from PIL import Image
 from tqdm import tqdm
-from .pipelines import SegmentationEvaluator, Compose, BuildDataTransform, DataTransformBuilder
+import torch.distributed as dist
+from concurrent.futures import ThreadPoolExecutor
+from .classindex import ClassPresenceIndex
+from .manifest import SampleManifest
+from .evalcache import EvalCacheDataset
+from .sharedcache import SharedMemoryCache
+from .pipelines import SegmentationEvaluator, Compose, Normalize, BuildDataTransform, DataTransformBuilder, BatchCompose, BatchNormalize, BuildBatchTransform, collatepadded
 
 
 '''Subset'''
@@ -20,7 +27,7 @@ class Subset(torch.utils.data.Dataset):
     def __init__(self, dataset, indices, transforms=None, seg_target_transforms=None):
         # set attributes
         self.dataset = dataset
-        self.indices = indices
+        self.indices = np.asarray(indices, dtype=np.int64)
         self.transforms = transforms
         self.seg_target_transforms = seg_target_transforms
     '''getitem'''
@@ -35,6 +42,47 @@ class Subset(torch.utils.data.Dataset):
         return len(self.indices)
 
 
+'''MultiViewSubset'''
+class MultiViewSubset(Subset):
+    def __init__(self, dataset, indices, transforms=None, seg_target_transforms=None, num_views=2):
+        super(MultiViewSubset, self).__init__(dataset, indices, transforms, seg_target_transforms)
+        self.num_views = num_views
+    '''getitem'''
+    def __getitem__(self, index):
+        # decode once and augment num_views times
+        raw_data_meta, views = self.dataset[self.indices[index]], []
+        for _ in range(self.num_views):
+            data_meta = self.transforms(dict(raw_data_meta)) if self.transforms is not None else dict(raw_data_meta)
+            if 'seg_target' in data_meta and data_meta['seg_target'] is not None:
+                data_meta['seg_target'] = self.seg_target_transforms(data_meta['seg_target']) if self.seg_target_transforms is not None else data_meta['seg_target']
+            views.append(data_meta)
+        return views
+
+
+'''collatemultiview'''
+def collatemultiview(batch):
+    # flatten the views of each image into the batch dimension
+    return torch.utils.data.default_collate([view for views in batch for view in views])
+
+
+'''LabelLookupTable'''
+class LabelLookupTable(object):
+    def __init__(self, labels_to_trainlabels_map, valid_labels, masking_value):
+        # build a 256-entry table, labels not in valid_labels are mapped to masking_value
+        lut = torch.full((256,), masking_value, dtype=torch.uint8)
+        for label in valid_labels:
+            lut[label] = labels_to_trainlabels_map[label]
+        # set attributes
+        self.lut = lut
+        self.device_luts = {}
+    '''call'''
+    def __call__(self, seg_target):
+        if seg_target.device != self.lut.device and seg_target.device not in self.device_luts:
+            self.device_luts[seg_target.device] = self.lut.to(seg_target.device)
+        lut = self.device_luts.get(seg_target.device, self.lut)
+        return lut[seg_target.long()]
+
+
 '''_BaseDataset'''
 class _BaseDataset(torch.utils.data.Dataset):
     def __init__(self, mode, dataset_cfg):
@@ -44,33 +92,133 @@ class _BaseDataset(torch.utils.data.Dataset):
         self.mode = mode
         self.dataset_cfg = dataset_cfg
         self.transforms = self.constructtransforms(dataset_cfg.get('transforms'))
-        self.imageids, self.image_dir, self.ann_dir = [], '', ''
+        self.manifest, self.image_dir, self.ann_dir = SampleManifest(imageids=[]), '', ''
+        self.shm_cache_cfg, self.shm_cache = dataset_cfg.get('shm_cache_cfg'), None
+        self.draft_transforms = None
+        self.image_sizes = None
     '''getitem'''
     def __getitem__(self, index):
-        # prepare
-        imageid = self.imageids[index]
-        imagepath = os.path.join(self.image_dir, f'{imageid}.jpg')
-        annpath = os.path.join(self.ann_dir, f'{imageid}.png')
         # read image and seg_target
-        image, seg_target = Image.open(imagepath).convert('RGB'), None
-        if self.mode == 'TRAIN': assert os.path.exists(annpath)
-        if os.path.exists(annpath):
-            seg_target = Image.open(annpath)
+        imageid, image, seg_target = self.read(index) if self.shm_cache_cfg is None else self.readwithcache(index)
         # perform transforms
         data_meta = {
             'image': image, 'seg_target': seg_target, 'imageid': imageid,
-            'width': image.size[0], 'height': image.size[1],
+            'width': image.info.get('original_size', image.size)[0], 'height': image.info.get('original_size', image.size)[1],
         }
+        # 1-based flat pixel indices of seg_target, carried through the geometric transforms to replay stored teacher outputs
+        if self.mode == 'TRAIN' and self.dataset_cfg.get('with_source_index', False):
+            data_meta['source_index'] = self.buildsourceindex(*seg_target.size)
         data_meta = self.transforms(data_meta) if self.transforms is not None else data_meta
         # return
         return data_meta
+    '''buildsourceindex'''
+    @staticmethod
+    def buildsourceindex(width, height):
+        # float32 holds the indices exactly below 2**24, 0 is left for the padded pixels
+        assert width * height < 2 ** 24
+        return Image.fromarray(np.arange(1, width * height + 1, dtype=np.float32).reshape(height, width), mode='F')
+    '''read'''
+    def read(self, index, draft=True):
+        # prepare
+        imageid = self.manifest.getimageid(index)
+        # read image and seg_target
+        image, seg_target = self.decodeimage(self.manifest.getimagepath(index), draft), None
+        if self.mode == 'TRAIN': assert self.manifest.hasann(index)
+        if self.manifest.hasann(index):
+            seg_target = Image.open(self.manifest.getannpath(index))
+        # return
+        return imageid, image, seg_target
+    '''decodeimage'''
+    def decodeimage(self, fp, draft=True):
+        image = Image.open(fp)
+        original_size = image.size
+        # let libjpeg downscale by 1/2, 1/4 or 1/8 while the first transform still gets the resolution it needs
+        if draft and self.draft_transforms is not None and image.format == 'JPEG':
+            minimum_size = self.draft_transforms.minimuminputsize(*original_size)
+            if minimum_size is not None and minimum_size[0] < original_size[0] and minimum_size[1] < original_size[1]:
+                image.draft('RGB', minimum_size)
+        image = image.convert('RGB')
+        image.info['original_size'] = original_size
+        return image
+    '''setdrafttransforms'''
+    def setdrafttransforms(self, transforms):
+        if self.dataset_cfg.get('jpeg_draft', False): self.draft_transforms = transforms
+    '''readwithcache'''
+    def readwithcache(self, index):
+        shm_cache = self.getshmcache()
+        imageid = self.manifest.getimageid(index)
+        cached = shm_cache.get(imageid)
+        if cached is not None:
+            image, seg_target = cached
+            return imageid, Image.fromarray(image), (Image.fromarray(seg_target) if seg_target is not None else None)
+        imageid, image, seg_target = self.read(index, draft=False)
+        shm_cache.put(imageid, np.array(image), np.array(seg_target) if seg_target is not None else None)
+        return imageid, image, seg_target
+    '''getshmcache'''
+    def getshmcache(self):
+        if self.shm_cache is None:
+            namespace = hashlib.sha1(
+                f'{type(self).__name__}:{os.path.abspath(self.dataset_cfg["rootdir"])}:{self.dataset_cfg["set"]}'.encode('utf-8')
+            ).hexdigest()
+            self.shm_cache = SharedMemoryCache(
+                cache_dir=self.shm_cache_cfg.get('cache_dir', '/dev/shm/csseg'), namespace=namespace, max_bytes=self.shm_cache_cfg.get('max_bytes', 8 << 30),
+            )
+        return self.shm_cache
+    '''warmupcache'''
+    def warmupcache(self, indices=None, num_threads=8):
+        is_distributed = dist.is_available() and dist.is_initialized()
+        rank, world_size = (dist.get_rank(), dist.get_world_size()) if is_distributed else (0, 1)
+        # each rank decodes its own slice, the results are visible to the whole node
+        indices = list(range(len(self)) if indices is None else indices)[rank::world_size]
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            pbar = executor.map(self.readwithcache, indices)
+            if rank == 0:
+                pbar = tqdm(pbar, total=len(indices))
+                pbar.set_description('Warming Up Cache')
+            for _ in pbar: pass
+        if is_distributed:
+            dist.barrier()
+    '''classpresenceindex'''
+    def classpresenceindex(self):
+        return ClassPresenceIndex.loadorbuild(self, cache_dir=self.getcachedir(), num_workers=self.dataset_cfg.get('num_indexing_workers', 8))
+    '''getcachedir'''
+    def getcachedir(self):
+        return self.dataset_cfg.get('cache_dir', os.path.join(self.dataset_cfg['rootdir'], '.cache'))
     '''len'''
     def __len__(self):
-        return len(self.imageids)
+        return len(self.manifest)
+    '''getimagesizes'''
+    def getimagesizes(self, num_threads=8):
+        if self.image_sizes is not None: return self.image_sizes[:, 0], self.image_sizes[:, 1]
+        is_distributed = dist.is_available() and dist.is_initialized()
+        rank = dist.get_rank() if is_distributed else 0
+        # the headers are parsed once on rank 0 and cached like the class presence index, the other ranks and later builds load the sizes
+        fingerprint = ClassPresenceIndex.fingerprint(self.image_dir, self.imageids, self.dataset_cfg)
+        sizespath = os.path.join(self.getcachedir(), f'imagesizes_{fingerprint}.npy')
+        if rank == 0 and not os.path.exists(sizespath):
+            os.makedirs(self.getcachedir(), exist_ok=True)
+            def readsize(index):
+                with Image.open(self.manifest.getimagepath(index)) as image:
+                    return image.size
+            with ThreadPoolExecutor(max_workers=num_threads) as executor:
+                sizes = np.array(list(executor.map(readsize, range(len(self)))), dtype=np.int64).reshape(-1, 2)
+            tmppath = f'{sizespath}.{os.getpid()}.tmp'
+            with open(tmppath, 'wb') as fp:
+                np.save(fp, sizes)
+            os.replace(tmppath, sizespath)
+        if is_distributed:
+            dist.barrier()
+        self.image_sizes = np.load(sizespath)
+        return self.image_sizes[:, 0], self.image_sizes[:, 1]
+    '''imageids'''
+    @property
+    def imageids(self):
+        return self.manifest.imageidsasstr()
     '''constructtransforms'''
     @staticmethod
-    def constructtransforms(transform_settings):
+    def constructtransforms(transform_settings, backend='pil'):
         if transform_settings is None: return None
+        assert backend in ['pil', 'cv2']
         transforms = []
         for transform_setting in transform_settings:
             assert isinstance(transform_setting, (dict, collections.abc.Sequence))
@@ -80,6 +228,10 @@ class _BaseDataset(torch.utils.data.Dataset):
                 assert len(transform_setting) == 2
                 transform_type, transform_cfg = transform_setting
                 transform_cfg['type'] = transform_type
+            # the cv2 backend swaps in the numpy implementation of a transform if there is one
+            if backend == 'cv2' and f"CV{transform_cfg['type']}" in DataTransformBuilder.REGISTERED_MODULES:
+                transform_cfg = copy.deepcopy(transform_cfg)
+                transform_cfg['type'] = f"CV{transform_cfg['type']}"
             transform = BuildDataTransform(transform_cfg)
             transforms.append(transform)
         return Compose(transforms)
@@ -99,9 +251,32 @@ class BaseDataset(torch.utils.data.Dataset):
         dataset_cfg_g.pop('transforms')
         self.data_generator = self.builddatagenerator(mode, dataset_cfg_g)
         self.num_classes = self.data_generator.num_classes
-        self.transforms = self.data_generator.constructtransforms(dataset_cfg['transforms'])
+        self.transform_backend = dataset_cfg.get('transform_backend', 'pil')
+        self.transforms = self.data_generator.constructtransforms(dataset_cfg['transforms'], self.transform_backend)
+        self.data_generator.setdrafttransforms(self.transforms)
+        # serve the deterministic part of the test transforms from a precomputed memory-mapped cache
+        if mode == 'TEST' and dataset_cfg.get('eval_cache_cfg') is not None:
+            self.data_generator, self.transforms = EvalCacheDataset.fromdatagenerator(
+                self.data_generator, dataset_cfg['transforms'], backend=self.transform_backend, **dataset_cfg['eval_cache_cfg']
+            )
+        # batch_transforms run after collation on the runner device, the workers then only decode
+        self.batch_transforms = self.constructbatchtransforms(dataset_cfg.get('batch_transforms'))
+        self.collate_fn = collatepadded if self.batch_transforms is not None else None
+        # decode each training image once and emit num_views augmented views of it
+        self.num_views = dataset_cfg.get('num_views', 1) if mode == 'TRAIN' else 1
+        if self.num_views > 1:
+            assert self.batch_transforms is None, 'num_views > 1 can not be combined with batch_transforms'
+            self.collate_fn = collatemultiview
+        # Normalize entries with on_device are applied by the runner after the host-to-device copy
+        self.device_normalize = None
+        self.subset_imageids = None
+        if self.transforms is not None:
+            self.device_normalize = next((t for t in self.transforms.transforms if isinstance(t, Normalize) and t.on_device), None)
         # prepare for training
         self.prepare(dataset_cfg, self.transforms, self.data_generator)
+        # fill the shared-memory cache with the selected images in advance
+        if dataset_cfg.get('shm_cache_cfg') is not None and dataset_cfg['shm_cache_cfg'].get('warmup', False):
+            self.data_generator.dataset.warmupcache(self.data_generator.indices)
     '''getitem'''
     def __getitem__(self, index):
         return self.data_generator[index]
@@ -111,16 +286,9 @@ class BaseDataset(torch.utils.data.Dataset):
     '''prepare'''
     def prepare(self, dataset_cfg, transforms, data_generator):
         # parse
-        labels, history_labels = self.gettasklabels(task_name=self.task_name, tasks=self.tasks, task_id=self.task_id)
-        if self.mode == 'TEST': 
-            labels = history_labels + labels
-            history_labels = None
+        labels, history_labels = self.parsetasklabels(self.task_id)
         overlap, masking_value = dataset_cfg['overlap'], dataset_cfg['masking_value']
         # filter images
-        history_labels = history_labels if history_labels is not None else []
-        self.stripzero(labels)
-        self.stripzero(history_labels)
-        assert not any(l in history_labels for l in labels)
         self.labels = [0] + labels
         self.history_labels = [0] + history_labels
         self.all_labels = [0] + history_labels + labels
@@ -128,11 +296,95 @@ class BaseDataset(torch.utils.data.Dataset):
         # remap the labels
         self.labels_to_trainlabels_map = {label: self.all_labels.index(label) for label in self.all_labels}
         self.labels_to_trainlabels_map[255] = 255
-        seg_target_transforms = torchvision.transforms.Lambda(
-            lambda t: t.apply_(lambda x: self.labels_to_trainlabels_map[x] if x in self.labels + [255] else masking_value)
-        )
+        self.seg_target_lut = LabelLookupTable(self.labels_to_trainlabels_map, self.labels + [255], masking_value)
+        # remap in the dataloader workers or, if remap_on_device, after collation through remapsegtargets
+        self.remap_on_device = dataset_cfg.get('remap_on_device', False) or self.batch_transforms is not None
+        seg_target_transforms = None if self.remap_on_device else self.seg_target_lut
         # obtain subset
-        self.data_generator = Subset(data_generator, selected_indices, transforms, seg_target_transforms)
+        if self.num_views > 1:
+            self.data_generator = MultiViewSubset(data_generator, selected_indices, transforms, seg_target_transforms, self.num_views)
+        else:
+            self.data_generator = Subset(data_generator, selected_indices, transforms, seg_target_transforms)
+    '''parsetasklabels'''
+    def parsetasklabels(self, task_id):
+        labels, history_labels = self.gettasklabels(task_name=self.task_name, tasks=self.tasks, task_id=task_id)
+        if self.mode == 'TEST': 
+            labels = history_labels + labels
+            history_labels = None
+        history_labels = history_labels if history_labels is not None else []
+        self.stripzero(labels)
+        self.stripzero(history_labels)
+        assert not any(l in history_labels for l in labels)
+        return labels, history_labels
+    '''buildsegtargetlut'''
+    def buildsegtargetlut(self, task_id):
+        # the same remapping as the dataset built for task_id
+        labels, history_labels = self.parsetasklabels(task_id)
+        all_labels = [0] + history_labels + labels
+        labels_to_trainlabels_map = {label: all_labels.index(label) for label in all_labels}
+        labels_to_trainlabels_map[255] = 255
+        return LabelLookupTable(labels_to_trainlabels_map, [0] + labels + [255], self.dataset_cfg['masking_value'])
+    '''selectimageids'''
+    def selectimageids(self, task_id):
+        # the imageids of this subset that the dataset built for task_id would select
+        labels, history_labels = self.parsetasklabels(task_id)
+        selected_indices = set(self.filterimages(self.data_generator.dataset, labels, history_labels, self.dataset_cfg['overlap']))
+        imageids = self.getimageids(range(len(self.data_generator.indices)))
+        return [imageid for index, imageid in zip(self.data_generator.indices, imageids) if index in selected_indices]
+    '''keeprawsegtargets'''
+    def keeprawsegtargets(self, keep=True):
+        # neither the workers nor remapsegtargets touch the labels then, e.g., to remap them for checkpoints of other tasks
+        self.remap_on_device = False if keep else (self.dataset_cfg.get('remap_on_device', False) or self.batch_transforms is not None)
+        self.data_generator.seg_target_transforms = None if (keep or self.remap_on_device) else self.seg_target_lut
+    '''constructbatchtransforms'''
+    @staticmethod
+    def constructbatchtransforms(transform_settings):
+        if transform_settings is None: return None
+        transforms = []
+        for transform_setting in transform_settings:
+            assert isinstance(transform_setting, (dict, collections.abc.Sequence))
+            if isinstance(transform_setting, dict):
+                transform_cfg = transform_setting
+            else:
+                assert len(transform_setting) == 2
+                transform_type, transform_cfg = transform_setting
+                transform_cfg['type'] = transform_type
+            transforms.append(BuildBatchTransform(transform_cfg))
+        # the images leave the batch transforms in the 0-255 range of the decoded pixels, only BatchNormalize brings them to the input range
+        assert isinstance(transforms[-1], BatchNormalize), 'batch_transforms should end with BatchNormalize'
+        return BatchCompose(transforms)
+    '''applybatchtransforms'''
+    def applybatchtransforms(self, data_meta):
+        if self.batch_transforms is None: return data_meta
+        return self.batch_transforms(data_meta)
+    '''normalizeimages'''
+    def normalizeimages(self, images):
+        # the batch transforms end with BatchNormalize
+        if self.batch_transforms is not None: return images.float()
+        if self.device_normalize is not None: return self.device_normalize.normalizebatch(images)
+        if images.dtype == torch.uint8: return images.float().div_(255.)
+        return images.float()
+    '''normalizerawimages'''
+    def normalizerawimages(self, images):
+        # uint8 images decoded outside the transforms go through the same Normalize, wherever it is configured to run
+        normalize = next((t for t in self.transforms.transforms if isinstance(t, Normalize)), None) if self.transforms is not None else None
+        if normalize is not None: return normalize.normalizebatch(images)
+        return images.float().div_(255.)
+    '''getimageids'''
+    def getimageids(self, indices):
+        # decoded once, the manifest decodes all the imageids on every access
+        if self.subset_imageids is None:
+            imageids = self.data_generator.dataset.imageids
+            self.subset_imageids = [str(imageids[index]) for index in self.data_generator.indices]
+        return [self.subset_imageids[index] for index in indices]
+    '''getimagesizes'''
+    def getimagesizes(self):
+        widths, heights = self.data_generator.dataset.getimagesizes()
+        return widths[self.data_generator.indices], heights[self.data_generator.indices]
+    '''remapsegtargets'''
+    def remapsegtargets(self, seg_targets):
+        if not self.remap_on_device: return seg_targets
+        return self.seg_target_lut(seg_targets)
     '''gettasklabels'''
     @staticmethod
     def gettasklabels(task_name, tasks, task_id):
@@ -147,23 +399,10 @@ class BaseDataset(torch.utils.data.Dataset):
     '''filterimages'''
     @staticmethod
     def filterimages(dataset, labels, history_labels=None, overlap=True):
-        selected_indices = []
         if 0 in labels: labels.remove(0)
         if history_labels is None: history_labels = []
-        all_labels = labels + history_labels + [0, 255]
-        if overlap:
-            filter_func = lambda c: any(x in labels for x in cls)
-        else:
-            filter_func = lambda c: any(x in labels for x in cls) and all(x in all_labels for x in c)
-        if torch.distributed.get_rank() == 0:
-            pbar = tqdm(dataset)
-            pbar.set_description('Filtering Images')
-        else:
-            pbar = dataset
-        for idx, data_meta in enumerate(pbar):
-            cls = np.unique(np.array(data_meta['seg_target']))
-            if filter_func(cls):
-                selected_indices.append(idx)
+        # resolve the selected indices from the class presence index instead of scanning the dataset
+        selected_indices = dataset.classpresenceindex().query(labels, history_labels, overlap)
         return selected_indices
     '''stripzero'''
     @staticmethod
@@ -5,15 +5,15 @@ Author:
     Zhenchao Jin
 '''
 import copy
-from .voc import VOCDataset
-from .ade20k import ADE20kDataset
+from .voc import VOCDataset, VOCShardDataset
+from .ade20k import ADE20kDataset, ADE20kShardDataset
 from ..utils import BaseModuleBuilder
 
 
 '''DatasetBuilder'''
 class DatasetBuilder(BaseModuleBuilder):
     REGISTERED_MODULES = {
-        'VOCDataset': VOCDataset, 'ADE20kDataset': ADE20kDataset,
+        'VOCDataset': VOCDataset, 'ADE20kDataset': ADE20kDataset, 'VOCShardDataset': VOCShardDataset, 'ADE20kShardDataset': ADE20kShardDataset,
     }
     '''build'''
     def build(self, mode, task_name, task_id, dataset_cfg):
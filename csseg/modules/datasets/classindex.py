@@ -0,0 +1,104 @@
+'''
+Function:
+    Implementation of ClassPresenceIndex
+Author:
+    Zhenchao Jin
+'''
+import os
+import json
+import hashlib
+import numpy as np
+import multiprocessing
+import torch.distributed as dist
+from PIL import Image
+from tqdm import tqdm
+
+
+'''countannotationpixels'''
+def countannotationpixels(annpath, num_bins=256):
+    if not os.path.exists(annpath):
+        return np.zeros((num_bins,), dtype=np.int64)
+    seg_target = np.array(Image.open(annpath), dtype=np.uint8)
+    return np.bincount(seg_target.reshape(-1), minlength=num_bins)
+
+
+'''ClassPresenceIndex'''
+class ClassPresenceIndex():
+    NUM_BINS = 256
+    def __init__(self, imageids, pixel_counts):
+        # assert
+        assert len(imageids) == pixel_counts.shape[0] and pixel_counts.shape[1] == self.NUM_BINS
+        # set attributes
+        self.imageids = imageids
+        self.pixel_counts = pixel_counts
+        self.presence = pixel_counts > 0
+    '''query'''
+    def query(self, labels, history_labels=None, overlap=True):
+        labels = [l for l in labels if l != 0]
+        history_labels = history_labels if history_labels is not None else []
+        # images containing at least one of the labels
+        selected_mask = self.presence[:, labels].any(axis=1)
+        # disjoint setting also excludes the images containing any future labels
+        if not overlap:
+            allowed_mask = np.zeros((self.NUM_BINS,), dtype=bool)
+            allowed_mask[labels + history_labels + [0, 255]] = True
+            selected_mask &= ~self.presence[:, ~allowed_mask].any(axis=1)
+        return np.flatnonzero(selected_mask).tolist()
+    '''fingerprint'''
+    @staticmethod
+    def fingerprint(data_dir, imageids, dataset_cfg):
+        # the id list and the directory mtime, which changes whenever files are added, removed or replaced by renaming
+        # a stat of every file would be the full-directory scan the cached index avoids
+        try:
+            mtime_ns = os.stat(data_dir).st_mtime_ns
+        except FileNotFoundError:
+            mtime_ns = -1
+        hasher = hashlib.sha1()
+        hasher.update(json.dumps({
+            'rootdir': os.path.abspath(dataset_cfg['rootdir']), 'set': dataset_cfg['set'], 'data_dir': os.path.abspath(data_dir), 'mtime_ns': mtime_ns,
+        }, sort_keys=True).encode('utf-8'))
+        hasher.update('\n'.join([str(imageid) for imageid in imageids]).encode('utf-8'))
+        return hasher.hexdigest()
+    '''build'''
+    @classmethod
+    def build(cls, ann_dir, imageids, num_workers=8, verbose=True):
+        annpaths = [os.path.join(ann_dir, f'{imageid}.png') for imageid in imageids]
+        pixel_counts = np.zeros((len(annpaths), cls.NUM_BINS), dtype=np.int32)
+        pool = multiprocessing.Pool(num_workers) if num_workers > 1 else None
+        iterator = pool.imap(countannotationpixels, annpaths, chunksize=32) if pool is not None else map(countannotationpixels, annpaths)
+        if verbose:
+            iterator = tqdm(iterator, total=len(annpaths))
+            iterator.set_description('Building Class Presence Index')
+        for idx, counts in enumerate(iterator):
+            pixel_counts[idx] = counts
+        if pool is not None:
+            pool.close()
+            pool.join()
+        return cls(imageids=list(imageids), pixel_counts=pixel_counts)
+    '''save'''
+    def save(self, savepath):
+        tmppath = f'{savepath}.{os.getpid()}.tmp'
+        with open(tmppath, 'wb') as fp:
+            np.savez(fp, imageids=np.array(self.imageids, dtype=str), pixel_counts=self.pixel_counts)
+        os.replace(tmppath, savepath)
+        return True
+    '''load'''
+    @classmethod
+    def load(cls, loadpath):
+        data = np.load(loadpath)
+        return cls(imageids=data['imageids'].tolist(), pixel_counts=data['pixel_counts'])
+    '''loadorbuild'''
+    @classmethod
+    def loadorbuild(cls, dataset, cache_dir, num_workers=8):
+        is_distributed = dist.is_available() and dist.is_initialized()
+        rank = dist.get_rank() if is_distributed else 0
+        # locate the index file by dataset root, split, sample ids and annotation directory mtime
+        fingerprint = cls.fingerprint(dataset.ann_dir, dataset.imageids, dataset.dataset_cfg)
+        indexpath = os.path.join(cache_dir, f'classindex_{fingerprint}.npz')
+        # build on rank 0 only, the other ranks wait and load the saved file
+        if rank == 0 and not os.path.exists(indexpath):
+            os.makedirs(cache_dir, exist_ok=True)
+            cls.build(dataset.ann_dir, dataset.imageids, num_workers=num_workers, verbose=True).save(indexpath)
+        if is_distributed:
+            dist.barrier()
+        return cls.load(indexpath)
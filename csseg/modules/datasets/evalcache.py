@@ -0,0 +1,121 @@
+'''
+Function:
+    Implementation of EvalCacheDataset
+Author:
+    Zhenchao Jin
+'''
+import os
+import json
+import torch
+import hashlib
+import numpy as np
+import torch.distributed as dist
+from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
+
+
+'''EvalCacheDataset'''
+class EvalCacheDataset(torch.utils.data.Dataset):
+    DETERMINISTIC_TRANSFORMS = ['Resize', 'CenterCrop', 'Pad']
+    def __init__(self, data_generator, cachepath_prefix):
+        # set attributes
+        self.data_generator = data_generator
+        self.num_classes = data_generator.num_classes
+        self.imageids = data_generator.imageids
+        self.cachepath_prefix = cachepath_prefix
+        meta = np.load(f'{cachepath_prefix}_meta.npz')
+        self.widths, self.heights, self.has_seg_targets = meta['widths'], meta['heights'], meta['has_seg_targets']
+        # memory maps are opened lazily in each process
+        self.images, self.seg_targets = None, None
+    '''getitem'''
+    def __getitem__(self, index):
+        if self.images is None:
+            self.images = np.load(f'{self.cachepath_prefix}_images.npy', mmap_mode='r')
+            self.seg_targets = np.load(f'{self.cachepath_prefix}_seg_targets.npy', mmap_mode='r')
+        data_meta = {
+            'image': np.array(self.images[index]), 'seg_target': np.array(self.seg_targets[index]) if self.has_seg_targets[index] else None,
+            'imageid': self.imageids[index], 'width': int(self.widths[index]), 'height': int(self.heights[index]),
+        }
+        return data_meta
+    '''len'''
+    def __len__(self):
+        return len(self.imageids)
+    '''getimagesizes'''
+    def getimagesizes(self):
+        return self.widths, self.heights
+    '''classpresenceindex'''
+    def classpresenceindex(self):
+        return self.data_generator.classpresenceindex()
+    '''getstate'''
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['images'], state['seg_targets'] = None, None
+        return state
+    '''splittransforms'''
+    @staticmethod
+    def splittransforms(transform_settings):
+        transform_settings = [
+            (s['type'], {k: v for k, v in s.items() if k != 'type'}) if isinstance(s, dict) else tuple(s) for s in transform_settings
+        ]
+        types = [transform_type for transform_type, _ in transform_settings]
+        assert 'ToTensor' in types, 'EvalCacheDataset requires ToTensor in the test transforms'
+        prefix, suffix = transform_settings[:types.index('ToTensor')], transform_settings[types.index('ToTensor'):]
+        for transform_type, _ in prefix:
+            assert transform_type in EvalCacheDataset.DETERMINISTIC_TRANSFORMS, f'{transform_type} before ToTensor can not be cached'
+        return prefix, suffix
+    '''fromdatagenerator'''
+    @classmethod
+    def fromdatagenerator(cls, data_generator, transform_settings, cache_dir, num_threads=8, backend='pil'):
+        prefix, suffix = cls.splittransforms(transform_settings)
+        # key the cache by the dataset split and the deterministic transforms
+        key = hashlib.sha1(json.dumps({
+            'type': type(data_generator).__name__, 'rootdir': os.path.abspath(data_generator.dataset_cfg['rootdir']), 'set': data_generator.dataset_cfg['set'],
+            'imageids': list(data_generator.imageids), 'transforms': prefix, 'backend': backend,
+            'jpeg_draft': data_generator.dataset_cfg.get('jpeg_draft', False),
+        }, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        cachepath_prefix = os.path.join(cache_dir, f'evalcache_{key}')
+        # materialize on rank 0 only, the other ranks wait and map the saved arrays
+        is_distributed = dist.is_available() and dist.is_initialized()
+        if (not is_distributed or dist.get_rank() == 0) and not os.path.exists(f'{cachepath_prefix}_meta.npz'):
+            os.makedirs(cache_dir, exist_ok=True)
+            cls.materialize(data_generator, data_generator.constructtransforms(prefix, backend), cachepath_prefix, num_threads)
+        if is_distributed:
+            dist.barrier()
+        return cls(data_generator, cachepath_prefix), data_generator.constructtransforms(suffix, backend)
+    '''materialize'''
+    @staticmethod
+    def materialize(data_generator, transforms, cachepath_prefix, num_threads=8):
+        num_samples = len(data_generator)
+        widths, heights = np.zeros((num_samples,), dtype=np.int64), np.zeros((num_samples,), dtype=np.int64)
+        has_seg_targets = np.zeros((num_samples,), dtype=bool)
+        images, seg_targets = None, None
+        # decode and transform with a thread pool, then write into the memory maps
+        def process(index):
+            data_meta = data_generator[index]
+            width, height = data_meta['width'], data_meta['height']
+            data_meta = transforms(data_meta) if transforms is not None else data_meta
+            image = np.array(data_meta['image'], dtype=np.uint8)
+            seg_target = np.array(data_meta['seg_target'], dtype=np.uint8) if data_meta['seg_target'] is not None else None
+            return width, height, image, seg_target
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            pbar = tqdm(enumerate(executor.map(process, range(num_samples))), total=num_samples)
+            pbar.set_description('Materializing Evaluation Cache')
+            for index, (width, height, image, seg_target) in pbar:
+                if images is None:
+                    images = np.lib.format.open_memmap(f'{cachepath_prefix}_images.npy.tmp', mode='w+', dtype=np.uint8, shape=(num_samples,) + image.shape)
+                    seg_targets = np.lib.format.open_memmap(f'{cachepath_prefix}_seg_targets.npy.tmp', mode='w+', dtype=np.uint8, shape=(num_samples,) + image.shape[:2])
+                assert image.shape == images.shape[1:], 'test transforms should produce images of a fixed size to be cached'
+                images[index], widths[index], heights[index] = image, width, height
+                if seg_target is not None:
+                    seg_targets[index], has_seg_targets[index] = seg_target, True
+                else:
+                    seg_targets[index] = 255
+        images.flush()
+        seg_targets.flush()
+        del images, seg_targets
+        os.replace(f'{cachepath_prefix}_images.npy.tmp', f'{cachepath_prefix}_images.npy')
+        os.replace(f'{cachepath_prefix}_seg_targets.npy.tmp', f'{cachepath_prefix}_seg_targets.npy')
+        with open(f'{cachepath_prefix}_meta.npz.tmp', 'wb') as fp:
+            np.savez(fp, widths=widths, heights=heights, has_seg_targets=has_seg_targets)
+        os.replace(f'{cachepath_prefix}_meta.npz.tmp', f'{cachepath_prefix}_meta.npz')
+        return True
@@ -0,0 +1,49 @@
+'''
+Function:
+    Implementation of SampleManifest
+Author:
+    Zhenchao Jin
+'''
+import os
+import numpy as np
+
+
+'''SampleManifest'''
+class SampleManifest():
+    def __init__(self, imageids, imagepaths=None, annpaths=None, has_anns=None):
+        # ids and paths live in fixed-width byte arrays, so forked workers never touch per-sample python objects
+        self.imageids = np.asarray(imageids, dtype=np.bytes_)
+        self.imagepaths = np.asarray(imagepaths if imagepaths is not None else [b''] * len(self.imageids), dtype=np.bytes_)
+        self.annpaths = np.asarray(annpaths if annpaths is not None else [b''] * len(self.imageids), dtype=np.bytes_)
+        self.has_anns = np.asarray(has_anns if has_anns is not None else np.zeros((len(self.imageids),), dtype=bool), dtype=bool)
+        assert len(self.imageids) == len(self.imagepaths) == len(self.annpaths) == len(self.has_anns)
+    '''len'''
+    def __len__(self):
+        return len(self.imageids)
+    '''getimageid'''
+    def getimageid(self, index):
+        return self.imageids[index].decode('utf-8')
+    '''getimagepath'''
+    def getimagepath(self, index):
+        return self.imagepaths[index].decode('utf-8')
+    '''getannpath'''
+    def getannpath(self, index):
+        return self.annpaths[index].decode('utf-8')
+    '''hasann'''
+    def hasann(self, index):
+        return bool(self.has_anns[index])
+    '''imageidsasstr'''
+    def imageidsasstr(self):
+        return np.char.decode(self.imageids, 'utf-8')
+    '''fromdirs'''
+    @classmethod
+    def fromdirs(cls, imageids, image_dir, ann_dir, image_ext='.jpg', ann_ext='.png'):
+        imageids = [str(imageid) for imageid in imageids]
+        # one directory listing instead of an os.path.exists call per sample
+        ann_names = set(os.listdir(ann_dir)) if os.path.isdir(ann_dir) else set()
+        return cls(
+            imageids=[imageid.encode('utf-8') for imageid in imageids],
+            imagepaths=[os.path.join(image_dir, f'{imageid}{image_ext}').encode('utf-8') for imageid in imageids],
+            annpaths=[os.path.join(ann_dir, f'{imageid}{ann_ext}').encode('utf-8') for imageid in imageids],
+            has_anns=np.array([f'{imageid}{ann_ext}' in ann_names for imageid in imageids], dtype=bool),
+        )
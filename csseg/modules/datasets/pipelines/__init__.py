@@ -1,3 +1,4 @@
 '''initialize'''
-from .evaluators import SegmentationEvaluator
-from .transforms import DataTransformBuilder, BuildDataTransform, Compose
\ No newline at end of file
+from .evaluators import SegmentationEvaluator, ConfusionStore
+from .transforms import DataTransformBuilder, BuildDataTransform, Compose, Normalize
+from .batchtransforms import BatchTransformBuilder, BuildBatchTransform, BatchCompose, BatchNormalize, collatepadded
\ No newline at end of file
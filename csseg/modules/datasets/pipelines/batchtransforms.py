@@ -0,0 +1,229 @@
+'''
+Function:
+    Implementation of batched data transforms applied after collation
+Author:
+    Zhenchao Jin
+'''
+import math
+import torch
+import random
+import numbers
+import numpy as np
+import collections
+import torch.nn.functional as F
+from ...utils import BaseModuleBuilder
+
+
+'''collatepadded'''
+def collatepadded(batch):
+    # decoded samples may differ in size, pad them to the largest one and record the valid region
+    images = [torch.from_numpy(np.array(s['image'], dtype=np.uint8)).permute(2, 0, 1) for s in batch]
+    seg_targets = [torch.from_numpy(np.array(s['seg_target'], dtype=np.uint8)) if s['seg_target'] is not None else None for s in batch]
+    max_height, max_width = max([image.shape[1] for image in images]), max([image.shape[2] for image in images])
+    data_meta = {
+        'image': torch.zeros((len(batch), 3, max_height, max_width), dtype=torch.uint8),
+        'seg_target': torch.full((len(batch), max_height, max_width), 255, dtype=torch.uint8),
+        'valid_size': torch.tensor([[image.shape[1], image.shape[2]] for image in images], dtype=torch.int64),
+        'imageid': [s['imageid'] for s in batch], 'width': torch.tensor([s['width'] for s in batch]), 'height': torch.tensor([s['height'] for s in batch]),
+    }
+    for idx, (image, seg_target) in enumerate(zip(images, seg_targets)):
+        data_meta['image'][idx, :, :image.shape[1], :image.shape[2]] = image
+        if seg_target is not None:
+            data_meta['seg_target'][idx, :seg_target.shape[0], :seg_target.shape[1]] = seg_target
+    return data_meta
+
+
+'''BatchRandomResizedCrop'''
+class BatchRandomResizedCrop(object):
+    def __init__(self, output_size, scale=(0.08, 1.0), ratio=(3. / 4., 4. / 3.), image_interpolation='BILINEAR', seg_target_interpolation='NEAREST', **kwargs):
+        # assert
+        assert isinstance(output_size, int) or \
+               (isinstance(output_size, collections.abc.Sequence) and len(output_size) == 2)
+        if isinstance(output_size, int):
+            output_size = (output_size, output_size)
+        assert isinstance(scale, collections.abc.Sequence) and len(scale) == 2
+        assert scale[1] > scale[0]
+        assert isinstance(ratio, collections.abc.Sequence) and len(ratio) == 2
+        assert ratio[1] > ratio[0]
+        assert image_interpolation in ['NEAREST', 'BILINEAR', 'BICUBIC'] and seg_target_interpolation in ['NEAREST']
+        # set attributes
+        self.output_size = output_size
+        self.scale = scale
+        self.ratio = ratio
+        self.image_interpolation = image_interpolation.lower()
+    '''call'''
+    def __call__(self, data_meta):
+        images, valid_sizes = data_meta['image'], data_meta['valid_size'].tolist()
+        batch_size, _, padded_height, padded_width = images.shape
+        # sample the crop of each image on the host and express it as an affine transform of the output grid
+        thetas = torch.zeros((batch_size, 2, 3), dtype=torch.float32)
+        for idx, (image_height, image_width) in enumerate(valid_sizes):
+            top, left, height, width = self.getparams(image_width, image_height)
+            thetas[idx, 0, 0], thetas[idx, 0, 2] = width / padded_width, (2 * left + width) / padded_width - 1
+            thetas[idx, 1, 1], thetas[idx, 1, 2] = height / padded_height, (2 * top + height) / padded_height - 1
+        grid = F.affine_grid(thetas.to(images.device), (batch_size, 1) + tuple(self.output_size), align_corners=False)
+        # resample images and seg_targets in one call each
+        data_meta['image'] = F.grid_sample(images.float(), grid, mode=self.image_interpolation, padding_mode='border', align_corners=False)
+        if data_meta.get('seg_target') is not None:
+            seg_targets = F.grid_sample(data_meta['seg_target'].unsqueeze(1).float(), grid, mode='nearest', padding_mode='border', align_corners=False)
+            data_meta['seg_target'] = seg_targets.squeeze(1).to(torch.uint8)
+        data_meta['valid_size'] = torch.tensor([self.output_size] * batch_size, dtype=torch.int64)
+        return data_meta
+    '''getparams'''
+    def getparams(self, image_width, image_height):
+        top, left, height, width = None, None, None, None
+        area = image_width * image_height
+        for _ in range(10):
+            output_area = random.uniform(*self.scale) * area
+            log_ratio = (math.log(self.ratio[0]), math.log(self.ratio[1]))
+            aspect_ratio = math.exp(random.uniform(*log_ratio))
+            width = int(round(math.sqrt(output_area * aspect_ratio)))
+            height = int(round(math.sqrt(output_area / aspect_ratio)))
+            if width <= image_width and height <= image_height:
+                top = random.randint(0, image_height - height)
+                left = random.randint(0, image_width - width)
+                break
+        if top is None or left is None:
+            in_ratio = image_width / image_height
+            if (in_ratio < min(self.ratio)):
+                width = image_width
+                height = int(round(width / min(self.ratio)))
+            elif (in_ratio > max(self.ratio)):
+                height = image_height
+                width = int(round(height * max(self.ratio)))
+            else:
+                width = image_width
+                height = image_height
+            top = (image_height - height) // 2
+            left = (image_width - width) // 2
+        return top, left, height, width
+
+
+'''BatchRandomHorizontalFlip'''
+class BatchRandomHorizontalFlip(object):
+    def __init__(self, prob=0.5, **kwargs):
+        # assert
+        assert isinstance(prob, numbers.Number)
+        # set attributes
+        self.prob = prob
+    '''call'''
+    def __call__(self, data_meta):
+        images = data_meta['image']
+        batch_size, width, device = images.shape[0], images.shape[-1], images.device
+        flip_mask = torch.rand(batch_size, device=device) < self.prob
+        # each image is flipped within its valid width, so that the padding stays at the right
+        valid_widths = data_meta['valid_size'][:, 1].to(device).view(-1, 1) if 'valid_size' in data_meta else torch.full((batch_size, 1), width, device=device)
+        columns = torch.arange(width, device=device).view(1, -1)
+        flipped_columns = torch.where(columns < valid_widths, valid_widths - 1 - columns, columns)
+        columns = torch.where(flip_mask.view(-1, 1), flipped_columns, columns.expand(batch_size, -1))
+        data_meta['image'] = images.gather(-1, columns.view(batch_size, 1, 1, width).expand_as(images))
+        if data_meta.get('seg_target') is not None:
+            data_meta['seg_target'] = data_meta['seg_target'].gather(-1, columns.view(batch_size, 1, width).expand_as(data_meta['seg_target']))
+        return data_meta
+
+
+'''BatchColorJitter'''
+class BatchColorJitter(object):
+    def __init__(self, brightness=None, contrast=None, saturation=None, hue=None, **kwargs):
+        # set attributes after checking
+        self.brightness = self.check(brightness)
+        self.contrast = self.check(contrast)
+        self.saturation = self.check(saturation)
+        self.hue = self.check(hue, center=0, bound=(-0.5, 0.5), clip_first_on_zero=False)
+    '''call'''
+    def __call__(self, data_meta):
+        images = data_meta['image'].float()
+        batch_size, device = images.shape[0], images.device
+        # per-sample factors, the order of the adjustments is shuffled per batch
+        adjustments = [(name, getattr(self, name)) for name in ['brightness', 'contrast', 'saturation', 'hue'] if getattr(self, name) is not None]
+        random.shuffle(adjustments)
+        for name, value in adjustments:
+            factors = torch.empty((batch_size, 1, 1, 1), device=device).uniform_(value[0], value[1])
+            if name == 'brightness':
+                images = images * factors
+            elif name == 'contrast':
+                images = images * factors + self.rgbtogray(images).mean(dim=(1, 2, 3), keepdim=True) * (1 - factors)
+            elif name == 'saturation':
+                images = images * factors + self.rgbtogray(images) * (1 - factors)
+            elif name == 'hue':
+                images = self.adjusthue(images, factors)
+            images = images.clamp(0, 255)
+        data_meta['image'] = images
+        return data_meta
+    '''rgbtogray'''
+    @staticmethod
+    def rgbtogray(images):
+        return (0.299 * images[:, 0: 1] + 0.587 * images[:, 1: 2] + 0.114 * images[:, 2: 3])
+    '''adjusthue'''
+    @staticmethod
+    def adjusthue(images, factors):
+        images = images / 255.
+        # rgb to hsv
+        maxc, maxc_idx = images.max(dim=1)
+        minc = images.min(dim=1)[0]
+        delta = maxc - minc
+        safe_delta = torch.where(delta > 0, delta, torch.ones_like(delta))
+        r, g, b = images[:, 0], images[:, 1], images[:, 2]
+        hue = torch.where(maxc_idx == 0, ((g - b) / safe_delta) % 6, torch.where(maxc_idx == 1, (b - r) / safe_delta + 2, (r - g) / safe_delta + 4))
+        hue = torch.where(delta > 0, hue / 6., torch.zeros_like(hue))
+        saturation = torch.where(maxc > 0, delta / torch.where(maxc > 0, maxc, torch.ones_like(maxc)), torch.zeros_like(maxc))
+        # shift hue and convert back to rgb
+        hue = (hue + factors.view(-1, 1, 1)) % 1.0
+        k = (torch.tensor([5., 3., 1.], device=images.device).view(1, 3, 1, 1) + hue.unsqueeze(1) * 6) % 6
+        images = maxc.unsqueeze(1) - maxc.unsqueeze(1) * saturation.unsqueeze(1) * torch.clamp(torch.minimum(k, 4 - k), 0, 1)
+        return images * 255.
+    '''check'''
+    def check(self, value, center=1, bound=(0, float('inf')), clip_first_on_zero=True):
+        if value is None: return value
+        # assert
+        assert isinstance(value, (numbers.Number, collections.abc.Sequence))
+        if isinstance(value, numbers.Number):
+            assert value >= 0
+            value = [center - value, center + value]
+            if clip_first_on_zero:
+                value[0] = max(value[0], 0)
+        else:
+            assert bound[0] <= value[0] <= value[1] <= bound[1]
+        # set
+        return value
+
+
+'''BatchNormalize'''
+class BatchNormalize(object):
+    def __init__(self, mean, std, **kwargs):
+        # set attributes, mean and std are given for images scaled to [0, 1] as in Normalize
+        self.mean = mean
+        self.std = std
+    '''call'''
+    def __call__(self, data_meta):
+        images = data_meta['image'].float()
+        mean = torch.tensor(self.mean, dtype=images.dtype, device=images.device).view(1, -1, 1, 1) * 255.
+        std = torch.tensor(self.std, dtype=images.dtype, device=images.device).view(1, -1, 1, 1) * 255.
+        data_meta['image'] = (images - mean) / std
+        return data_meta
+
+
+'''BatchCompose'''
+class BatchCompose(object):
+    def __init__(self, transforms):
+        self.transforms = transforms
+    '''call'''
+    def __call__(self, data_meta):
+        for transform in self.transforms:
+            data_meta = transform(data_meta)
+        return data_meta
+
+
+'''BatchTransformBuilder'''
+class BatchTransformBuilder(BaseModuleBuilder):
+    REGISTERED_MODULES = {
+        'BatchRandomResizedCrop': BatchRandomResizedCrop, 'BatchRandomHorizontalFlip': BatchRandomHorizontalFlip, 'BatchColorJitter': BatchColorJitter,
+        'BatchNormalize': BatchNormalize,
+    }
+    '''build'''
+    def build(self, transform_cfg):
+        return super().build(transform_cfg)
+
+
+'''BuildBatchTransform'''
+BuildBatchTransform = BatchTransformBuilder().build
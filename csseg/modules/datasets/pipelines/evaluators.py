@@ -4,6 +4,7 @@ Function:
 Author:
     Zhenchao Jin
 '''
+import os
 import torch
 import numpy as np
 import torch.distributed as dist
@@ -11,30 +12,81 @@ import torch.distributed as dist
 
 '''SegmentationEvaluator'''
 class SegmentationEvaluator():
-    def __init__(self, num_classes, eps=1e-6):
+    def __init__(self, num_classes, eps=1e-6, device=None, per_image=False):
         self.eps = eps
         self.num_classes = num_classes
+        # per_image also keeps the sparse confusion entries of every image for ConfusionStore
+        self.per_image = per_image
+        # with a device the confusion matrix stays there until evaluate, otherwise it is accumulated with numpy
+        self.device = torch.device(device) if device is not None else None
         self.reset()
     '''reset'''
     def reset(self):
-        self.confusion_matrix = np.zeros((self.num_classes, self.num_classes))
+        if self.device is not None:
+            self.confusion_matrix = torch.zeros((self.num_classes, self.num_classes), dtype=torch.int64, device=self.device)
+        else:
+            self.confusion_matrix = np.zeros((self.num_classes, self.num_classes), dtype=np.int64)
         self.total_samples = 0
+        self.per_image_entries = {'imageids': [], 'num_entries': [], 'cells': [], 'counts': []}
     '''synchronize'''
     def synchronize(self, device=None):
-        confusion_matrix = torch.tensor(self.confusion_matrix).to(device)
-        total_samples = torch.tensor(self.total_samples).to(device)
-        dist.reduce(confusion_matrix, dst=0)
-        dist.reduce(total_samples, dst=0)
-        self.confusion_matrix = confusion_matrix.cpu().numpy()
-        self.total_samples = total_samples.cpu().numpy()
+        if not (dist.is_available() and dist.is_initialized()): return
+        # pack the confusion matrix and the sample count to reduce them with a single all-reduce
+        device = self.device if self.device is not None else device
+        packed = torch.cat([
+            torch.as_tensor(self.confusion_matrix, dtype=torch.int64).to(device).flatten(), torch.tensor([self.total_samples], dtype=torch.int64, device=device)
+        ])
+        dist.all_reduce(packed)
+        confusion_matrix, self.total_samples = packed[:-1].view(self.num_classes, self.num_classes), int(packed[-1].item())
+        self.confusion_matrix = confusion_matrix if self.device is not None else confusion_matrix.cpu().numpy()
+        # the sparse per-image entries are small enough to be gathered as objects
+        if self.per_image:
+            gathered = [None] * dist.get_world_size()
+            dist.all_gather_object(gathered, self.per_image_entries)
+            self.per_image_entries = {key: [v for entries in gathered for v in entries[key]] for key in self.per_image_entries}
     '''update'''
-    def update(self, seg_targets, seg_preds):
-        for st, sp in zip(seg_targets, seg_preds):
-            self.confusion_matrix += self.fasthist(st.flatten(), sp.flatten())
+    def update(self, seg_targets, seg_preds, imageids=None):
+        if self.device is not None:
+            seg_targets = torch.as_tensor(seg_targets).to(self.device, non_blocking=True)
+            seg_preds = torch.as_tensor(seg_preds).to(self.device, non_blocking=True)
+        elif torch.is_tensor(seg_targets):
+            seg_targets, seg_preds = seg_targets.cpu().numpy(), seg_preds.cpu().numpy()
+        if self.per_image:
+            assert imageids is not None and len(imageids) == len(seg_targets)
+            self.confusion_matrix += self.updateperimage(seg_targets, seg_preds, imageids)
+        else:
+            self.confusion_matrix += self.fasthist(seg_targets.reshape(-1), seg_preds.reshape(-1))
         self.total_samples += len(seg_targets)
+    '''updateperimage'''
+    def updateperimage(self, seg_targets, seg_preds, imageids):
+        num_images, num_cells = len(seg_targets), self.num_classes**2
+        seg_targets, seg_preds = seg_targets.reshape(num_images, -1), seg_preds.reshape(num_images, -1)
+        mask = (seg_targets >= 0) & (seg_targets < self.num_classes)
+        # one bincount over (image, target, prediction) gives the per-image histograms of the whole batch
+        if torch.is_tensor(seg_targets):
+            offsets = torch.arange(num_images, device=seg_targets.device).view(-1, 1) * num_cells
+            hist = torch.bincount((offsets + self.num_classes * seg_targets.long() + seg_preds.long())[mask], minlength=num_images * num_cells).view(num_images, num_cells)
+            rows, cells = [x.cpu().numpy() for x in hist.nonzero(as_tuple=True)]
+            counts, hist = hist[rows, cells].cpu().numpy(), hist.sum(dim=0).view(self.num_classes, self.num_classes)
+        else:
+            offsets = np.arange(num_images).reshape(-1, 1) * num_cells
+            hist = np.bincount((offsets + self.num_classes * seg_targets.astype(np.int64) + seg_preds)[mask], minlength=num_images * num_cells).reshape(num_images, num_cells)
+            rows, cells = np.nonzero(hist)
+            counts, hist = hist[rows, cells], hist.sum(axis=0).reshape(self.num_classes, self.num_classes)
+        num_entries = np.bincount(rows, minlength=num_images)
+        self.per_image_entries['imageids'].extend([str(imageid) for imageid in imageids])
+        self.per_image_entries['num_entries'].extend(num_entries.tolist())
+        self.per_image_entries['cells'].append(cells.astype(np.int32))
+        self.per_image_entries['counts'].append(counts.astype(np.int64))
+        return hist
     '''fasthist'''
     def fasthist(self, seg_target, seg_pred):
         mask = (seg_target >= 0) & (seg_target < self.num_classes)
+        if torch.is_tensor(seg_target):
+            hist = torch.bincount(
+                self.num_classes * seg_target[mask].long() + seg_pred[mask].long(), minlength=self.num_classes**2
+            ).view(self.num_classes, self.num_classes)
+            return hist
         hist = np.bincount(
             self.num_classes * seg_target[mask].astype(int) + seg_pred[mask], minlength=self.num_classes**2
         ).reshape(self.num_classes, self.num_classes)
@@ -43,7 +95,7 @@ class SegmentationEvaluator():
     def evaluate(self):
         # obtain variables
         eps = self.eps
-        hist = self.confusion_matrix
+        hist = self.confusion_matrix.cpu().numpy() if torch.is_tensor(self.confusion_matrix) else self.confusion_matrix
         # evaluate
         all_accuracy = np.diag(hist).sum() / hist.sum()
         mean_accuracy = np.mean((np.diag(hist) / (hist.sum(axis=1) + eps))[hist.sum(axis=1) != 0])
@@ -57,4 +109,73 @@ class SegmentationEvaluator():
             'class_iou': class_iou, 'class_accuracy': class_accuracy
         }
         # return
-        return results
\ No newline at end of file
+        return results
+
+
+'''ConfusionStore'''
+class ConfusionStore():
+    def __init__(self, num_classes, imageids, row_ptr, cells, counts):
+        # compressed rows of per-image confusion entries, cell = num_classes * target + prediction
+        self.num_classes = int(num_classes)
+        self.imageids = np.asarray(imageids, dtype=str)
+        self.row_ptr = np.asarray(row_ptr, dtype=np.int64)
+        self.cells = np.asarray(cells, dtype=np.int32)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.entry_rows = np.repeat(np.arange(len(self.imageids)), np.diff(self.row_ptr))
+    '''fromevaluator'''
+    @classmethod
+    def fromevaluator(cls, evaluator):
+        assert evaluator.per_image, 'the evaluator should be built with per_image=True'
+        entries = evaluator.per_image_entries
+        return cls(
+            num_classes=evaluator.num_classes, imageids=entries['imageids'], row_ptr=np.concatenate([[0], np.cumsum(entries['num_entries'], dtype=np.int64)]),
+            cells=np.concatenate(entries['cells']) if entries['cells'] else np.zeros((0,), dtype=np.int32),
+            counts=np.concatenate(entries['counts']) if entries['counts'] else np.zeros((0,), dtype=np.int64),
+        )
+    '''save'''
+    def save(self, savepath):
+        tmppath = f'{savepath}.{os.getpid()}.tmp'
+        with open(tmppath, 'wb') as fp:
+            np.savez(fp, num_classes=self.num_classes, imageids=self.imageids, row_ptr=self.row_ptr, cells=self.cells, counts=self.counts)
+        os.replace(tmppath, savepath)
+        return True
+    '''load'''
+    @classmethod
+    def load(cls, loadpath):
+        data = np.load(loadpath)
+        return cls(num_classes=data['num_classes'], imageids=data['imageids'], row_ptr=data['row_ptr'], cells=data['cells'], counts=data['counts'])
+    '''confusionmatrix'''
+    def confusionmatrix(self, imageids=None, class_map=None):
+        # select the entries of the requested images
+        cells, counts = self.cells, self.counts
+        if imageids is not None:
+            selected_mask = np.isin(self.entry_rows, np.flatnonzero(np.isin(self.imageids, np.asarray(imageids, dtype=str))))
+            cells, counts = cells[selected_mask], counts[selected_mask]
+        seg_targets, seg_preds, num_classes = cells // self.num_classes, cells % self.num_classes, self.num_classes
+        # merge classes, entries mapped to a negative id are dropped
+        if class_map is not None:
+            class_map = np.asarray(class_map, dtype=np.int64)
+            assert len(class_map) == self.num_classes
+            seg_targets, seg_preds, num_classes = class_map[seg_targets], class_map[seg_preds], int(class_map.max()) + 1
+            valid_mask = (seg_targets >= 0) & (seg_preds >= 0)
+            seg_targets, seg_preds, counts = seg_targets[valid_mask], seg_preds[valid_mask], counts[valid_mask]
+        confusion_matrix = np.zeros((num_classes * num_classes,), dtype=np.int64)
+        np.add.at(confusion_matrix, num_classes * seg_targets + seg_preds, counts)
+        return confusion_matrix.reshape(num_classes, num_classes)
+    '''evaluate'''
+    def evaluate(self, imageids=None, classes=None, class_map=None, eps=1e-6):
+        confusion_matrix = self.confusionmatrix(imageids=imageids, class_map=class_map)
+        evaluator = SegmentationEvaluator(num_classes=confusion_matrix.shape[0], eps=eps)
+        evaluator.confusion_matrix = confusion_matrix
+        evaluator.total_samples = len(self.imageids) if imageids is None else int(np.isin(self.imageids, np.asarray(imageids, dtype=str)).sum())
+        results = evaluator.evaluate()
+        # restrict the mean metrics to a subset of classes, e.g., the old or the new classes of a task
+        if classes is not None:
+            class_iou = [results['class_iou'][c] for c in classes if results['class_iou'][c] != 'INVALID']
+            class_accuracy = [results['class_accuracy'][c] for c in classes if results['class_accuracy'][c] != 'INVALID']
+            results['mean_iou'] = np.mean(class_iou) if class_iou else float('nan')
+            results['mean_accuracy'] = np.mean(class_accuracy) if class_accuracy else float('nan')
+        return results
+    '''len'''
+    def __len__(self):
+        return len(self.imageids)
\ No newline at end of file
@@ -4,6 +4,7 @@ Function:
 Author:
     Zhenchao Jin
 '''
+import cv2
 import math
 import torch
 import random
@@ -15,6 +16,18 @@ from PIL import Image
 from ...utils import BaseModuleBuilder
 
 
+'''getimagesize'''
+def getimagesize(x):
+    return (x.shape[1], x.shape[0]) if isinstance(x, np.ndarray) else x.size
+
+
+'''getreferencesize'''
+def getreferencesize(data_meta):
+    # images may be decoded at a reduced resolution, the annotation then keeps the full-resolution coordinates
+    if data_meta.get('seg_target') is not None: return getimagesize(data_meta['seg_target'])
+    return getimagesize(data_meta['image'])
+
+
 '''Resize'''
 class Resize(object):
     def __init__(self, output_size, image_interpolation='BILINEAR', seg_target_interpolation='NEAREST', **kwargs):
@@ -29,9 +42,22 @@ class Resize(object):
         self.seg_target_interpolation = getattr(Image, seg_target_interpolation)
     '''call'''
     def __call__(self, data_meta):
-        data_meta = self.resize('image', data_meta, self.output_size, self.image_interpolation, **self.extra_kwargs)
-        data_meta = self.resize('seg_target', data_meta, self.output_size, self.seg_target_interpolation, **self.extra_kwargs)
+        output_size = self.getoutputsize(*getreferencesize(data_meta))
+        data_meta = self.resize('image', data_meta, output_size, self.image_interpolation, **self.extra_kwargs)
+        data_meta = self.resize('seg_target', data_meta, output_size, self.seg_target_interpolation, **self.extra_kwargs)
+        data_meta = self.resize('source_index', data_meta, output_size, self.seg_target_interpolation, **self.extra_kwargs)
         return data_meta
+    '''getoutputsize'''
+    def getoutputsize(self, image_width, image_height):
+        if not isinstance(self.output_size, int): return tuple(self.output_size)
+        # same rule as torchvision, resolved once so that image and seg_target always agree
+        short, long = min(image_width, image_height), max(image_width, image_height)
+        new_short, new_long = self.output_size, int(self.output_size * long / short)
+        return (new_long, new_short) if image_width <= image_height else (new_short, new_long)
+    '''minimuminputsize'''
+    def minimuminputsize(self, image_width, image_height):
+        output_height, output_width = self.getoutputsize(image_width, image_height)
+        return output_width, output_height
     '''resize'''
     @staticmethod
     def resize(key, data_meta, output_size, interpolation, **kwargs):
@@ -52,6 +78,7 @@ class CenterCrop(object):
     def __call__(self, data_meta):
         data_meta = self.centercrop('image', data_meta, self.output_size, **self.extra_kwargs)
         data_meta = self.centercrop('seg_target', data_meta, self.output_size, **self.extra_kwargs)
+        data_meta = self.centercrop('source_index', data_meta, self.output_size, **self.extra_kwargs)
         return data_meta
     '''centercrop'''
     @staticmethod
@@ -81,6 +108,7 @@ class Pad(object):
     def __call__(self, data_meta):
         data_meta = self.pad('image', data_meta, self.padding, self.image_fill, self.padding_mode, **self.extra_kwargs)
         data_meta = self.pad('seg_target', data_meta, self.padding, self.seg_target_fill, self.padding_mode, **self.extra_kwargs)
+        data_meta = self.pad('source_index', data_meta, self.padding, 0, self.padding_mode, **self.extra_kwargs)
         return data_meta
     '''pad'''
     @staticmethod
@@ -102,6 +130,7 @@ class Lambda(object):
     def __call__(self, data_meta):
         data_meta = self.lambd('image', data_meta, self.lambd, **self.extra_kwargs)
         data_meta = self.lambd('seg_target', data_meta, self.lambd, **self.extra_kwargs)
+        data_meta = self.lambd('source_index', data_meta, self.lambd, **self.extra_kwargs)
         return data_meta
     '''lambd'''
     @staticmethod
@@ -132,6 +161,7 @@ class RandomRotation(object):
         angle = random.uniform(self.degrees[0], self.degrees[1])
         data_meta = self.randomrotate('image', data_meta, angle, self.resample, self.expand, self.center, **self.extra_kwargs)
         data_meta = self.randomrotate('seg_target', data_meta, angle, self.resample, self.expand, self.center, **self.extra_kwargs)
+        data_meta = self.randomrotate('source_index', data_meta, angle, self.resample, self.expand, self.center, **self.extra_kwargs)
         return data_meta
     '''randomrotate'''
     @staticmethod
@@ -154,6 +184,7 @@ class RandomHorizontalFlip(object):
         if random.random() < self.prob:
             data_meta = self.hflip('image', data_meta, **self.extra_kwargs)
             data_meta = self.hflip('seg_target', data_meta, **self.extra_kwargs)
+            data_meta = self.hflip('source_index', data_meta, **self.extra_kwargs)
         return data_meta
     '''hflip'''
     @staticmethod
@@ -176,6 +207,7 @@ class RandomVerticalFlip(object):
         if random.random() < self.prob:
             data_meta = self.vflip('image', data_meta, **self.extra_kwargs)
             data_meta = self.vflip('seg_target', data_meta, **self.extra_kwargs)
+            data_meta = self.vflip('source_index', data_meta, **self.extra_kwargs)
         return data_meta
     '''vflip'''
     @staticmethod
@@ -204,6 +236,7 @@ class RandomCrop(object):
         top, left, height, width = random.randint(0, image_height - output_height), random.randint(0, image_width - output_width), output_height, output_width
         data_meta = self.crop('image', data_meta, top, left, height, width, **self.extra_kwargs)
         data_meta = self.crop('seg_target', data_meta, top, left, height, width, **self.extra_kwargs)
+        data_meta = self.crop('source_index', data_meta, top, left, height, width, **self.extra_kwargs)
         return data_meta
     '''crop'''
     @staticmethod
@@ -235,35 +268,58 @@ class RandomResizedCrop(object):
         self.seg_target_interpolation = getattr(Image, seg_target_interpolation)
     '''call'''
     def __call__(self, data_meta):
-        image = data_meta['image']
+        reference_width, reference_height = getreferencesize(data_meta)
+        top, left, height, width = self.getparams(reference_width, reference_height)
+        image_top, image_left, image_height, image_width = self.scaleparams(top, left, height, width, getimagesize(data_meta['image']), (reference_width, reference_height))
+        data_meta = self.resizedcrop('image', data_meta, image_top, image_left, image_height, image_width, self.output_size, self.image_interpolation, **self.extra_kwargs)
+        data_meta = self.resizedcrop('seg_target', data_meta, top, left, height, width, self.output_size, self.seg_target_interpolation, **self.extra_kwargs)
+        data_meta = self.resizedcrop('source_index', data_meta, top, left, height, width, self.output_size, self.seg_target_interpolation, **self.extra_kwargs)
+        return data_meta
+    '''scaleparams'''
+    @staticmethod
+    def scaleparams(top, left, height, width, image_size, reference_size):
+        if tuple(image_size) == tuple(reference_size): return top, left, height, width
+        scale_x, scale_y = image_size[0] / reference_size[0], image_size[1] / reference_size[1]
+        image_top, image_left = int(round(top * scale_y)), int(round(left * scale_x))
+        image_height = max(min(int(round(height * scale_y)), image_size[1] - image_top), 1)
+        image_width = max(min(int(round(width * scale_x)), image_size[0] - image_left), 1)
+        return image_top, image_left, image_height, image_width
+    '''minimuminputsize'''
+    def minimuminputsize(self, image_width, image_height):
+        # the smallest crop that can be sampled should still not be upsampled
+        area = image_width * image_height
+        min_crop_width, min_crop_height = math.sqrt(area * self.scale[0] * self.ratio[0]), math.sqrt(area * self.scale[0] / self.ratio[1])
+        max_factor = min(min_crop_width / self.output_size[1], min_crop_height / self.output_size[0])
+        if max_factor <= 1: return image_width, image_height
+        return int(math.ceil(image_width / max_factor)), int(math.ceil(image_height / max_factor))
+    '''getparams'''
+    def getparams(self, image_width, image_height):
         top, left, height, width = None, None, None, None
-        area = image.size[0] * image.size[1]
+        area = image_width * image_height
         for _ in range(10):
             output_area = random.uniform(*self.scale) * area
             log_ratio = (math.log(self.ratio[0]), math.log(self.ratio[1]))
             aspect_ratio = math.exp(random.uniform(*log_ratio))
             width = int(round(math.sqrt(output_area * aspect_ratio)))
             height = int(round(math.sqrt(output_area / aspect_ratio)))
-            if width <= image.size[0] and height <= image.size[1]:
-                top = random.randint(0, image.size[1] - height)
-                left = random.randint(0, image.size[0] - width)
+            if width <= image_width and height <= image_height:
+                top = random.randint(0, image_height - height)
+                left = random.randint(0, image_width - width)
                 break
         if top is None or left is None:
-            in_ratio = image.size[0] / image.size[1]
+            in_ratio = image_width / image_height
             if (in_ratio < min(self.ratio)):
-                width = image.size[0]
+                width = image_width
                 height = int(round(width / min(self.ratio)))
             elif (in_ratio > max(self.ratio)):
-                height = image.size[1]
+                height = image_height
                 width = int(round(height * max(self.ratio)))
             else:
-                width = image.size[0]
-                height = image.size[1]
-            top = (image.size[1] - height) // 2
-            left = (image.size[0] - width) // 2
-        data_meta = self.resizedcrop('image', data_meta, top, left, height, width, self.output_size, self.image_interpolation, **self.extra_kwargs)
-        data_meta = self.resizedcrop('seg_target', data_meta, top, left, height, width, self.output_size, self.seg_target_interpolation, **self.extra_kwargs)
-        return data_meta
+                width = image_width
+                height = image_height
+            top = (image_height - height) // 2
+            left = (image_width - width) // 2
+        return top, left, height, width
     '''resizecrop'''
     @staticmethod
     def resizedcrop(key, data_meta, top, left, height, width, size, interpolation, **kwargs):
@@ -290,24 +346,24 @@ class ColorJitter(object):
         # adjust brightness
         if self.brightness is not None:
             brightness_factor = random.uniform(self.brightness[0], self.brightness[1])
-            transforms.append(Lambda(lambda image: F.adjust_brightness(image, brightness_factor, **self.brightness_extra_kwargs)))
+            transforms.append(lambda image: F.adjust_brightness(image, brightness_factor, **self.brightness_extra_kwargs))
         # adjust contrast
         if self.contrast is not None:
             contrast_factor = random.uniform(self.contrast[0], self.contrast[1])
-            transforms.append(Lambda(lambda image: F.adjust_contrast(image, contrast_factor, **self.contrast_extra_kwargs)))
+            transforms.append(lambda image: F.adjust_contrast(image, contrast_factor, **self.contrast_extra_kwargs))
         # adjust saturation
         if self.saturation is not None:
             saturation_factor = random.uniform(self.saturation[0], self.saturation[1])
-            transforms.append(Lambda(lambda image: F.adjust_saturation(image, saturation_factor, **self.saturation_extra_kwargs)))
+            transforms.append(lambda image: F.adjust_saturation(image, saturation_factor, **self.saturation_extra_kwargs))
         # adjust hue
         if self.hue is not None:
             hue_factor = random.uniform(self.hue[0], self.hue[1])
-            transforms.append(Lambda(lambda image: F.adjust_hue(image, hue_factor, **self.hue_extra_kwargs)))
+            transforms.append(lambda image: F.adjust_hue(image, hue_factor, **self.hue_extra_kwargs))
         # random and perform
         random.shuffle(transforms)
-        transforms = Compose(transforms)
-        if 'image' in data_meta:
-            data_meta['image'] = transforms(data_meta)
+        if 'image' in data_meta and data_meta['image'] is not None:
+            for transform in transforms:
+                data_meta['image'] = transform(data_meta['image'])
         # return
         return data_meta
     '''check'''
@@ -328,35 +384,298 @@ class ColorJitter(object):
 
 '''ToTensor'''
 class ToTensor(object):
-    def __init__(self):
-        pass
+    def __init__(self, keep_uint8=False):
+        # keep_uint8 yields uint8 CHW images, the runner casts and normalizes them on device
+        self.keep_uint8 = keep_uint8
     '''call'''
     def __call__(self, data_meta):
         if 'image' in data_meta:
-            data_meta['image'] = F.to_tensor(data_meta['image'])
+            if self.keep_uint8:
+                data_meta['image'] = torch.from_numpy(np.array(data_meta['image'], dtype=np.uint8)).permute(2, 0, 1).contiguous()
+            else:
+                data_meta['image'] = F.to_tensor(data_meta['image'])
         if 'seg_target' in data_meta:
             data_meta['seg_target'] = torch.from_numpy(np.array(data_meta['seg_target'], dtype=np.uint8))
+        if 'source_index' in data_meta:
+            data_meta['source_index'] = torch.from_numpy(np.array(data_meta['source_index'], dtype=np.float32))
         return data_meta
 
 
 '''Normalize'''
 class Normalize(object):
-    def __init__(self, mean, std, **kwargs):
+    def __init__(self, mean, std, on_device=False, **kwargs):
         # set attributes
         self.mean = mean
         self.std = std
+        self.on_device = on_device
         self.extra_kwargs = kwargs
+        self.device_params = {}
     '''call'''
     def __call__(self, data_meta):
+        if self.on_device: return data_meta
         if 'image' in data_meta:
             data_meta['image'] = F.normalize(data_meta['image'], self.mean, self.std, **self.extra_kwargs)
         return data_meta
+    '''normalizebatch'''
+    def normalizebatch(self, images):
+        # fold the 1/255 scaling of uint8 images into mean and std so that casting and normalizing take one pass
+        scale = 255. if images.dtype == torch.uint8 else 1.
+        key = (images.device, scale)
+        if key not in self.device_params:
+            mean = torch.tensor(self.mean, dtype=torch.float32, device=images.device).view(1, -1, 1, 1) * scale
+            std = torch.tensor(self.std, dtype=torch.float32, device=images.device).view(1, -1, 1, 1) * scale
+            self.device_params[key] = (mean, 1. / std)
+        mean, inv_std = self.device_params[key]
+        return (images.float() - mean) * inv_std
+    '''getstate'''
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['device_params'] = {}
+        return state
+
+
+'''CV2_INTERPOLATIONS'''
+CV2_INTERPOLATIONS = {
+    'NEAREST': getattr(cv2, 'INTER_NEAREST_EXACT', cv2.INTER_NEAREST), 'BILINEAR': cv2.INTER_LINEAR, 'BICUBIC': cv2.INTER_CUBIC,
+    'LANCZOS': cv2.INTER_LANCZOS4, 'BOX': cv2.INTER_AREA,
+}
+
+
+'''CV2_BORDERMODES'''
+CV2_BORDERMODES = {
+    'constant': cv2.BORDER_CONSTANT, 'edge': cv2.BORDER_REPLICATE, 'reflect': cv2.BORDER_REFLECT_101, 'symmetric': cv2.BORDER_REFLECT,
+}
+
+
+'''toarray'''
+def toarray(x):
+    return x if isinstance(x, np.ndarray) else np.array(x)
+
+
+'''CVResize'''
+class CVResize(Resize):
+    def __init__(self, output_size, image_interpolation='BILINEAR', seg_target_interpolation='NEAREST', **kwargs):
+        super(CVResize, self).__init__(output_size, image_interpolation, seg_target_interpolation, **kwargs)
+        self.extra_kwargs = {}
+        self.image_interpolation = CV2_INTERPOLATIONS[image_interpolation]
+        self.seg_target_interpolation = CV2_INTERPOLATIONS[seg_target_interpolation]
+    '''resize'''
+    @staticmethod
+    def resize(key, data_meta, output_size, interpolation, **kwargs):
+        if key in data_meta and data_meta[key] is not None:
+            x = toarray(data_meta[key])
+            height, width = x.shape[:2]
+            if isinstance(output_size, int):
+                new_short, new_long = output_size, int(output_size * max(height, width) / min(height, width))
+                output_width, output_height = (new_short, new_long) if width <= height else (new_long, new_short)
+            else:
+                output_height, output_width = output_size
+            # INTER_AREA is closer to the antialiased bilinear downsampling of PIL
+            if interpolation == cv2.INTER_LINEAR and output_height < height and output_width < width: interpolation = cv2.INTER_AREA
+            data_meta[key] = cv2.resize(x, (output_width, output_height), interpolation=interpolation)
+        return data_meta
+
+
+'''CVCenterCrop'''
+class CVCenterCrop(CenterCrop):
+    def __init__(self, output_size, **kwargs):
+        super(CVCenterCrop, self).__init__(output_size, **kwargs)
+        self.extra_kwargs = {}
+    '''centercrop'''
+    @staticmethod
+    def centercrop(key, data_meta, output_size, **kwargs):
+        if key in data_meta and data_meta[key] is not None:
+            x = toarray(data_meta[key])
+            height, width = x.shape[:2]
+            output_height, output_width = output_size
+            if output_height > height or output_width > width:
+                x = cv2.copyMakeBorder(
+                    x, max(output_height - height, 0) // 2, max(output_height - height + 1, 0) // 2, max(output_width - width, 0) // 2, 
+                    max(output_width - width + 1, 0) // 2, cv2.BORDER_CONSTANT, value=0,
+                )
+                height, width = x.shape[:2]
+            top, left = int(round((height - output_height) / 2.0)), int(round((width - output_width) / 2.0))
+            data_meta[key] = np.ascontiguousarray(x[top: top + output_height, left: left + output_width])
+        return data_meta
+
+
+'''CVPad'''
+class CVPad(Pad):
+    def __init__(self, padding, image_fill=0, seg_target_fill=255, padding_mode='constant', **kwargs):
+        super(CVPad, self).__init__(padding, image_fill, seg_target_fill, padding_mode, **kwargs)
+        self.extra_kwargs = {}
+    '''pad'''
+    @staticmethod
+    def pad(key, data_meta, padding, fill, padding_mode, **kwargs):
+        if key in data_meta and data_meta[key] is not None:
+            x = toarray(data_meta[key])
+            if isinstance(padding, numbers.Number):
+                left = top = right = bottom = padding
+            elif len(padding) == 2:
+                left, top, right, bottom = padding[0], padding[1], padding[0], padding[1]
+            else:
+                left, top, right, bottom = padding
+            if x.ndim == 3 and isinstance(fill, numbers.Number):
+                fill = (fill,) * x.shape[2]
+            data_meta[key] = cv2.copyMakeBorder(x, top, bottom, left, right, CV2_BORDERMODES[padding_mode], value=fill)
+        return data_meta
+
+
+'''CVRandomRotation'''
+class CVRandomRotation(RandomRotation):
+    def __init__(self, degrees, resample=False, expand=False, center=None, **kwargs):
+        super(CVRandomRotation, self).__init__(degrees, resample, expand, center, **kwargs)
+        self.extra_kwargs = {}
+        # warpAffine does not support INTER_NEAREST_EXACT
+        self.resample = CV2_INTERPOLATIONS[resample] if isinstance(resample, str) and resample != 'NEAREST' else cv2.INTER_NEAREST
+    '''randomrotate'''
+    @staticmethod
+    def randomrotate(key, data_meta, angle, resample, expand, center, **kwargs):
+        if key in data_meta and data_meta[key] is not None:
+            x = toarray(data_meta[key])
+            height, width = x.shape[:2]
+            # PIL measures the center from the pixel corner and cv2 from the pixel center
+            center = (width * 0.5 - 0.5, height * 0.5 - 0.5) if center is None else (center[0] - 0.5, center[1] - 0.5)
+            matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
+            output_width, output_height = width, height
+            if expand:
+                cos, sin = abs(matrix[0, 0]), abs(matrix[0, 1])
+                output_width, output_height = int(math.ceil(height * sin + width * cos)), int(math.ceil(height * cos + width * sin))
+                matrix[0, 2] += output_width * 0.5 - 0.5 - center[0]
+                matrix[1, 2] += output_height * 0.5 - 0.5 - center[1]
+            data_meta[key] = cv2.warpAffine(x, matrix, (output_width, output_height), flags=resample, borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+        return data_meta
+
+
+'''CVRandomHorizontalFlip'''
+class CVRandomHorizontalFlip(RandomHorizontalFlip):
+    def __init__(self, prob=0.5, **kwargs):
+        super(CVRandomHorizontalFlip, self).__init__(prob, **kwargs)
+        self.extra_kwargs = {}
+    '''hflip'''
+    @staticmethod
+    def hflip(key, data_meta, **kwargs):
+        if key in data_meta and data_meta[key] is not None:
+            data_meta[key] = cv2.flip(toarray(data_meta[key]), 1)
+        return data_meta
+
+
+'''CVRandomVerticalFlip'''
+class CVRandomVerticalFlip(RandomVerticalFlip):
+    def __init__(self, prob=0.5, **kwargs):
+        super(CVRandomVerticalFlip, self).__init__(prob, **kwargs)
+        self.extra_kwargs = {}
+    '''vflip'''
+    @staticmethod
+    def vflip(key, data_meta, **kwargs):
+        if key in data_meta and data_meta[key] is not None:
+            data_meta[key] = cv2.flip(toarray(data_meta[key]), 0)
+        return data_meta
+
+
+'''CVRandomCrop'''
+class CVRandomCrop(RandomCrop):
+    def __init__(self, output_size, **kwargs):
+        super(CVRandomCrop, self).__init__(output_size, **kwargs)
+        self.extra_kwargs = {}
+    '''call'''
+    def __call__(self, data_meta):
+        data_meta['image'] = toarray(data_meta['image'])
+        image_height, image_width = data_meta['image'].shape[:2]
+        output_height, output_width = self.output_size
+        output_height = min(image_height, output_height)
+        output_width = min(image_width, output_width)
+        top, left, height, width = random.randint(0, image_height - output_height), random.randint(0, image_width - output_width), output_height, output_width
+        data_meta = self.crop('image', data_meta, top, left, height, width)
+        data_meta = self.crop('seg_target', data_meta, top, left, height, width)
+        data_meta = self.crop('source_index', data_meta, top, left, height, width)
+        return data_meta
+    '''crop'''
+    @staticmethod
+    def crop(key, data_meta, top, left, height, width, **kwargs):
+        if key in data_meta and data_meta[key] is not None:
+            data_meta[key] = np.ascontiguousarray(toarray(data_meta[key])[top: top + height, left: left + width])
+        return data_meta
+
+
+'''CVRandomResizedCrop'''
+class CVRandomResizedCrop(RandomResizedCrop):
+    def __init__(self, output_size, scale=(0.08, 1.0), ratio=(3. / 4., 4. / 3.), image_interpolation='BILINEAR', seg_target_interpolation='NEAREST', **kwargs):
+        super(CVRandomResizedCrop, self).__init__(output_size, scale, ratio, image_interpolation, seg_target_interpolation, **kwargs)
+        self.extra_kwargs = {}
+        self.image_interpolation = CV2_INTERPOLATIONS[image_interpolation]
+        self.seg_target_interpolation = CV2_INTERPOLATIONS[seg_target_interpolation]
+    '''call'''
+    def __call__(self, data_meta):
+        data_meta['image'] = toarray(data_meta['image'])
+        reference_width, reference_height = getreferencesize(data_meta)
+        top, left, height, width = self.getparams(reference_width, reference_height)
+        image_top, image_left, image_height, image_width = self.scaleparams(top, left, height, width, getimagesize(data_meta['image']), (reference_width, reference_height))
+        data_meta = self.resizedcrop('image', data_meta, image_top, image_left, image_height, image_width, self.output_size, self.image_interpolation)
+        data_meta = self.resizedcrop('seg_target', data_meta, top, left, height, width, self.output_size, self.seg_target_interpolation)
+        data_meta = self.resizedcrop('source_index', data_meta, top, left, height, width, self.output_size, self.seg_target_interpolation)
+        return data_meta
+    '''resizedcrop'''
+    @staticmethod
+    def resizedcrop(key, data_meta, top, left, height, width, size, interpolation, **kwargs):
+        if key in data_meta and data_meta[key] is not None:
+            x = toarray(data_meta[key])[top: top + height, left: left + width]
+            if interpolation == cv2.INTER_LINEAR and size[0] < height and size[1] < width: interpolation = cv2.INTER_AREA
+            data_meta[key] = cv2.resize(x, (size[1], size[0]), interpolation=interpolation)
+        return data_meta
+
+
+'''CVColorJitter'''
+class CVColorJitter(ColorJitter):
+    def __init__(self, brightness=None, contrast=None, saturation=None, hue=None, **kwargs):
+        super(CVColorJitter, self).__init__(brightness, contrast, saturation, hue, **kwargs)
+    '''call'''
+    def __call__(self, data_meta):
+        if 'image' not in data_meta or data_meta['image'] is None: return data_meta
+        # sample factors in the same way as ColorJitter
+        adjustments = []
+        if self.brightness is not None:
+            adjustments.append(('brightness', random.uniform(self.brightness[0], self.brightness[1])))
+        if self.contrast is not None:
+            adjustments.append(('contrast', random.uniform(self.contrast[0], self.contrast[1])))
+        if self.saturation is not None:
+            adjustments.append(('saturation', random.uniform(self.saturation[0], self.saturation[1])))
+        if self.hue is not None:
+            adjustments.append(('hue', random.uniform(self.hue[0], self.hue[1])))
+        random.shuffle(adjustments)
+        # apply all adjustments in one float32 pass
+        image = toarray(data_meta['image']).astype(np.float32)
+        for adjustment, factor in adjustments:
+            if adjustment == 'brightness':
+                image = image * factor
+            elif adjustment == 'contrast':
+                image = image * factor + cv2.cvtColor(image, cv2.COLOR_RGB2GRAY).mean() * (1 - factor)
+            elif adjustment == 'saturation':
+                image = image * factor + cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)[..., None] * (1 - factor)
+            elif adjustment == 'hue':
+                hsv = cv2.cvtColor(image / 255., cv2.COLOR_RGB2HSV)
+                hsv[..., 0] = (hsv[..., 0] + factor * 360.) % 360.
+                image = cv2.cvtColor(hsv, cv2.COLOR_HSV2RGB) * 255.
+            image = np.clip(image, 0, 255)
+        data_meta['image'] = (image + 0.5).astype(np.uint8)
+        # return
+        return data_meta
 
 
 '''Compose'''
 class Compose(object):
     def __init__(self, transforms):
+        # uint8 images of ToTensor(keep_uint8=True) can only be normalized by the runner on device
+        for idx, transform in enumerate(transforms):
+            if isinstance(transform, ToTensor) and transform.keep_uint8:
+                assert not any(isinstance(t, Normalize) and not t.on_device for t in transforms[idx + 1:]), \
+                    'ToTensor with keep_uint8=True should be followed by Normalize with on_device=True rather than a Normalize in the workers'
         self.transforms = transforms
+    '''minimuminputsize'''
+    def minimuminputsize(self, image_width, image_height):
+        # only the first transform sees the decoded image, so only it can tell the resolution it needs
+        if not self.transforms or not hasattr(self.transforms[0], 'minimuminputsize'): return None
+        return self.transforms[0].minimuminputsize(image_width, image_height)
     '''call'''
     def __call__(self, data_meta):
         for transform in self.transforms:
@@ -370,6 +689,8 @@ class DataTransformBuilder(BaseModuleBuilder):
         'Resize': Resize, 'CenterCrop': CenterCrop, 'Pad': Pad, 'Lambda': Lambda, 'RandomRotation': RandomRotation, 
         'RandomHorizontalFlip': RandomHorizontalFlip, 'RandomVerticalFlip': RandomVerticalFlip, 'ToTensor': ToTensor,
         'Normalize': Normalize, 'RandomCrop': RandomCrop, 'RandomResizedCrop': RandomResizedCrop, 'ColorJitter': ColorJitter,
+        'CVResize': CVResize, 'CVCenterCrop': CVCenterCrop, 'CVPad': CVPad, 'CVRandomRotation': CVRandomRotation, 'CVRandomHorizontalFlip': CVRandomHorizontalFlip,
+        'CVRandomVerticalFlip': CVRandomVerticalFlip, 'CVRandomCrop': CVRandomCrop, 'CVRandomResizedCrop': CVRandomResizedCrop, 'CVColorJitter': CVColorJitter,
     }
     '''build'''
     def build(self, transform_cfg):
@@ -0,0 +1,109 @@
+'''
+Function:
+    Implementation of packed and memory-mapped dataset shards
+Author:
+    Zhenchao Jin
+'''
+import io
+import os
+import mmap
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+from .base import _BaseDataset
+from .manifest import SampleManifest
+from .classindex import ClassPresenceIndex, countannotationpixels
+
+
+'''packshards'''
+def packshards(data_generator, shard_dir, max_shard_bytes=1 << 30, verbose=True):
+    os.makedirs(shard_dir, exist_ok=True)
+    num_samples = len(data_generator.imageids)
+    # initialize the offset index
+    index = {
+        key: np.full((num_samples,), -1, dtype=np.int64) for key in ['shard_ids', 'image_offsets', 'image_lengths', 'ann_offsets', 'ann_lengths', 'widths', 'heights']
+    }
+    pixel_counts = np.zeros((num_samples, ClassPresenceIndex.NUM_BINS), dtype=np.int32)
+    shard_names, shard_fp, shard_bytes = [], None, 0
+    # iter to append encoded images and annotations to the shards
+    pbar = tqdm(enumerate(data_generator.imageids), total=num_samples) if verbose else enumerate(data_generator.imageids)
+    if verbose: pbar.set_description('Packing Shards')
+    for idx, imageid in pbar:
+        imagepath, annpath = data_generator.manifest.getimagepath(idx), data_generator.manifest.getannpath(idx)
+        with open(imagepath, 'rb') as fp:
+            image_bytes = fp.read()
+        ann_bytes = b''
+        if data_generator.manifest.hasann(idx):
+            with open(annpath, 'rb') as fp:
+                ann_bytes = fp.read()
+        if shard_fp is None or shard_bytes + len(image_bytes) + len(ann_bytes) > max_shard_bytes:
+            if shard_fp is not None: shard_fp.close()
+            shard_names.append(f'shard_{len(shard_names):05d}.bin')
+            shard_fp, shard_bytes = open(os.path.join(shard_dir, shard_names[-1]), 'wb'), 0
+        index['shard_ids'][idx] = len(shard_names) - 1
+        index['image_offsets'][idx], index['image_lengths'][idx] = shard_bytes, len(image_bytes)
+        shard_fp.write(image_bytes)
+        shard_bytes += len(image_bytes)
+        if ann_bytes:
+            index['ann_offsets'][idx], index['ann_lengths'][idx] = shard_bytes, len(ann_bytes)
+            shard_fp.write(ann_bytes)
+            shard_bytes += len(ann_bytes)
+        index['widths'][idx], index['heights'][idx] = Image.open(io.BytesIO(image_bytes)).size
+        pixel_counts[idx] = countannotationpixels(annpath)
+    if shard_fp is not None: shard_fp.close()
+    # save the index last so that partially packed shards are never picked up
+    indexpath = os.path.join(shard_dir, 'index.npz')
+    with open(f'{indexpath}.tmp', 'wb') as fp:
+        np.savez(
+            fp, imageids=np.array(data_generator.imageids, dtype=str), shard_names=np.array(shard_names, dtype=str), pixel_counts=pixel_counts, **index
+        )
+    os.replace(f'{indexpath}.tmp', indexpath)
+    return indexpath
+
+
+'''_ShardDataset'''
+class _ShardDataset(_BaseDataset):
+    def __init__(self, mode, dataset_cfg):
+        super(_ShardDataset, self).__init__(mode=mode, dataset_cfg=dataset_cfg)
+        # load the offset index
+        self.shard_dir = dataset_cfg.get('shard_dir', os.path.join(dataset_cfg['rootdir'], 'shards', dataset_cfg['set']))
+        index = np.load(os.path.join(self.shard_dir, 'index.npz'))
+        self.manifest = SampleManifest(imageids=np.char.encode(index['imageids'], 'utf-8'), has_anns=index['ann_lengths'] > 0)
+        self.shard_names = index['shard_names'].tolist()
+        self.shard_ids, self.pixel_counts = index['shard_ids'], index['pixel_counts']
+        self.widths, self.heights = index['widths'], index['heights']
+        self.image_offsets, self.image_lengths = index['image_offsets'], index['image_lengths']
+        self.ann_offsets, self.ann_lengths = index['ann_offsets'], index['ann_lengths']
+        # shards are mapped lazily in each process
+        self.shard_buffers, self.shard_buffers_pid = None, None
+    '''read'''
+    def read(self, index, draft=True):
+        shard_buffer = self.getshardbuffers()[self.shard_ids[index]]
+        # decode image and seg_target from slices of the mapped shard
+        image_offset, image_length = self.image_offsets[index], self.image_lengths[index]
+        image, seg_target = self.decodeimage(io.BytesIO(shard_buffer[image_offset: image_offset + image_length]), draft), None
+        if self.mode == 'TRAIN': assert self.ann_lengths[index] > 0
+        if self.ann_lengths[index] > 0:
+            ann_offset, ann_length = self.ann_offsets[index], self.ann_lengths[index]
+            seg_target = Image.open(io.BytesIO(shard_buffer[ann_offset: ann_offset + ann_length]))
+        # return
+        return self.manifest.getimageid(index), image, seg_target
+    '''getshardbuffers'''
+    def getshardbuffers(self):
+        if self.shard_buffers is None or self.shard_buffers_pid != os.getpid():
+            self.shard_buffers, self.shard_buffers_pid = [], os.getpid()
+            for shard_name in self.shard_names:
+                with open(os.path.join(self.shard_dir, shard_name), 'rb') as fp:
+                    self.shard_buffers.append(mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ))
+        return self.shard_buffers
+    '''getimagesizes'''
+    def getimagesizes(self):
+        return self.widths, self.heights
+    '''classpresenceindex'''
+    def classpresenceindex(self):
+        return ClassPresenceIndex(imageids=self.imageids, pixel_counts=self.pixel_counts)
+    '''getstate'''
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['shard_buffers'], state['shard_buffers_pid'] = None, None
+        return state
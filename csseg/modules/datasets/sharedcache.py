@@ -0,0 +1,92 @@
+'''
+Function:
+    Implementation of SharedMemoryCache
+Author:
+    Zhenchao Jin
+'''
+import os
+import fcntl
+import numpy as np
+
+
+'''SharedMemoryCache'''
+class SharedMemoryCache():
+    HEADER_BYTES = 32
+    def __init__(self, cache_dir='/dev/shm/csseg', namespace='default', max_bytes=8 << 30):
+        # set attributes
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.namespace_dir = os.path.join(cache_dir, namespace)
+        self.lockpath = os.path.join(cache_dir, '.lock')
+        self.usagepath = os.path.join(cache_dir, '.usage')
+        os.makedirs(self.namespace_dir, exist_ok=True)
+    '''get'''
+    def get(self, key):
+        path = self.keytopath(key)
+        try:
+            data = np.fromfile(path, dtype=np.uint8)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        image_height, image_width, seg_target_height, seg_target_width = data[:self.HEADER_BYTES].view(np.int64)
+        image_end = self.HEADER_BYTES + image_height * image_width * 3
+        image = data[self.HEADER_BYTES: image_end].reshape(image_height, image_width, 3)
+        seg_target = data[image_end:].reshape(seg_target_height, seg_target_width) if seg_target_height > 0 else None
+        return image, seg_target
+    '''put'''
+    def put(self, key, image, seg_target=None):
+        seg_target_shape = seg_target.shape if seg_target is not None else (0, 0)
+        header = np.array([image.shape[0], image.shape[1], seg_target_shape[0], seg_target_shape[1]], dtype=np.int64)
+        nbytes = self.HEADER_BYTES + image.nbytes + (seg_target.nbytes if seg_target is not None else 0)
+        if nbytes > self.max_bytes: return False
+        path = self.keytopath(key)
+        tmppath = f'{path}.{os.getpid()}.tmp'
+        # all processes on the node serialize their insertions through the lock file
+        with open(self.lockpath, 'a+') as lockfp:
+            fcntl.flock(lockfp, fcntl.LOCK_EX)
+            if os.path.exists(path): return True
+            used_bytes = self.readusage()
+            if used_bytes + nbytes > self.max_bytes:
+                used_bytes = self.evict(self.max_bytes - nbytes)
+            try:
+                with open(tmppath, 'wb') as fp:
+                    fp.write(header.tobytes())
+                    fp.write(np.ascontiguousarray(image, dtype=np.uint8).tobytes())
+                    if seg_target is not None:
+                        fp.write(np.ascontiguousarray(seg_target, dtype=np.uint8).tobytes())
+                os.replace(tmppath, path)
+            except OSError:
+                if os.path.exists(tmppath): os.remove(tmppath)
+                return False
+            self.writeusage(used_bytes + nbytes)
+        return True
+    '''evict'''
+    def evict(self, target_bytes):
+        # drop the least recently used entries of all namespaces until the usage fits target_bytes
+        entries = []
+        for namespace in os.listdir(self.cache_dir):
+            namespace_dir = os.path.join(self.cache_dir, namespace)
+            if not os.path.isdir(namespace_dir): continue
+            for entry in os.scandir(namespace_dir):
+                if not entry.name.endswith('.bin'): continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        entries = sorted(entries)
+        used_bytes = sum([size for _, size, _ in entries])
+        for _, size, path in entries:
+            if used_bytes <= target_bytes: break
+            os.remove(path)
+            used_bytes -= size
+        return used_bytes
+    '''readusage'''
+    def readusage(self):
+        if not os.path.exists(self.usagepath): return self.evict(float('inf'))
+        with open(self.usagepath, 'r') as fp:
+            return int(fp.read().strip() or 0)
+    '''writeusage'''
+    def writeusage(self, used_bytes):
+        with open(self.usagepath, 'w') as fp:
+            fp.write(str(used_bytes))
+    '''keytopath'''
+    def keytopath(self, key):
+        return os.path.join(self.namespace_dir, f'{key}.bin')
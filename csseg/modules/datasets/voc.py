@@ -6,6 +6,8 @@ Author:
 '''
 import os
 import pandas as pd
+from .shards import _ShardDataset
+from .manifest import SampleManifest
 from .base import _BaseDataset, BaseDataset
 
 
@@ -27,8 +29,15 @@ class _VOCDataset(_BaseDataset):
         # obatin imageids
         set_dir = os.path.join(rootdir, 'ImageSets', 'Segmentation')
         df = pd.read_csv(os.path.join(set_dir, dataset_cfg['set']+'.txt'), names=['imageids'])
-        self.imageids = df['imageids'].values
-        self.imageids = [str(_id) for _id in self.imageids]
+        self.manifest = SampleManifest.fromdirs(df['imageids'].values, self.image_dir, self.ann_dir)
+
+
+'''_VOCShardDataset'''
+class _VOCShardDataset(_ShardDataset):
+    num_classes = _VOCDataset.num_classes
+    classnames = _VOCDataset.classnames
+    def __init__(self, mode, dataset_cfg):
+        super(_VOCShardDataset, self).__init__(mode=mode, dataset_cfg=dataset_cfg)
 
 
 '''VOCDataset'''
@@ -148,4 +157,16 @@ class VOCDataset(BaseDataset):
     '''builddatagenerator'''
     def builddatagenerator(self, mode, dataset_cfg):
         data_generator = _VOCDataset(mode, dataset_cfg)
+        return data_generator
+
+
+'''VOCShardDataset'''
+class VOCShardDataset(VOCDataset):
+    def __init__(self, mode, task_name, task_id, dataset_cfg):
+        super(VOCShardDataset, self).__init__(
+            mode=mode, task_name=task_name, task_id=task_id, dataset_cfg=dataset_cfg
+        )
+    '''builddatagenerator'''
+    def builddatagenerator(self, mode, dataset_cfg):
+        data_generator = _VOCShardDataset(mode, dataset_cfg)
         return data_generator
\ No newline at end of file
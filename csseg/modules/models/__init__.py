@@ -1,7 +1,7 @@
 '''initialize'''
-from .losses import BuildLoss, LossBuilder
+from .losses import BuildLoss, LossBuilder, LossPlan
 from .decoders import BuildDecoder, DecoderBuilder
-from .segmentors import BuildSegmentor, SegmentorBuilder
+from .segmentors import BuildSegmentor, SegmentorBuilder, FrozenTeacher, decodesegpreds, BuildInferencer, InferencerBuilder
 from .schedulers import BuildScheduler, SchedulerBuilder
 from .optimizers import BuildOptimizer, OptimizerBuilder, ParamsConstructorBuilder, BuildParamsConstructor
 from .encoders import (
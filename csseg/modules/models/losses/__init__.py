@@ -1,2 +1,3 @@
 '''initialize'''
+from .lossplan import LossPlan
 from .builder import BuildLoss, LossBuilder
\ No newline at end of file
@@ -19,7 +19,7 @@ class CrossEntropyLoss(nn.Module):
         self.ignore_index = ignore_index
         self.label_smoothing = label_smoothing
     '''forward'''
-    def forward(self, prediction, target):
+    def forward(self, prediction, target, scale_factor=None):
         # construct config
         ce_args = {
             'weight': self.weight, 'ignore_index': self.ignore_index, 'reduction': self.reduction,
@@ -32,7 +32,7 @@ class CrossEntropyLoss(nn.Module):
             loss = F.cross_entropy(prediction, target, **ce_args)
         else:
             loss = F.cross_entropy(prediction, target.long(), **ce_args)
-        loss = loss * self.scale_factor
+        loss = loss * (self.scale_factor if scale_factor is None else scale_factor)
         # return
         return loss
 
@@ -46,7 +46,7 @@ class MIBUnbiasedCrossEntropyLoss(nn.Module):
         self.ignore_index = ignore_index
         self.num_history_known_classes = num_history_known_classes
     '''forward'''
-    def forward(self, prediction, target):
+    def forward(self, prediction, target, scale_factor=None):
         # calculate loss according to config
         num_history_known_classes = self.num_history_known_classes
         outputs = torch.zeros_like(prediction)
@@ -56,6 +56,6 @@ class MIBUnbiasedCrossEntropyLoss(nn.Module):
         labels = target.clone()
         labels[target < num_history_known_classes] = 0
         loss = F.nll_loss(outputs, labels, ignore_index=self.ignore_index, reduction=self.reduction)
-        loss = loss * self.scale_factor
+        loss = loss * (self.scale_factor if scale_factor is None else scale_factor)
         # return
         return loss
\ No newline at end of file
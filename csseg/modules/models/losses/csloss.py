@@ -15,7 +15,7 @@ class CosineSimilarityLoss(nn.Module):
         self.reduction = reduction
         self.scale_factor = scale_factor
     '''forward'''
-    def forward(self, prediction, target):
+    def forward(self, prediction, target, scale_factor=None):
         # assert
         assert prediction.size() == target.size()
         # calculate loss according to config
@@ -24,6 +24,6 @@ class CosineSimilarityLoss(nn.Module):
             loss = loss.mean()
         elif self.reduction == 'sum': 
             loss = loss.sum()
-        loss = loss * self.scale_factor
+        loss = loss * (self.scale_factor if scale_factor is None else scale_factor)
         # return
         return loss
\ No newline at end of file
@@ -17,7 +17,7 @@ class KLDivLoss(nn.Module):
         self.temperature = temperature
         self.scale_factor = scale_factor
     '''forward'''
-    def forward(self, prediction, target):
+    def forward(self, prediction, target, scale_factor=None):
         # assert
         assert prediction.size() == target.size()
         # construct config
@@ -30,6 +30,6 @@ class KLDivLoss(nn.Module):
         src_distribution = nn.LogSoftmax(dim=1)(prediction / self.temperature)
         tgt_distribution = nn.Softmax(dim=1)(target / self.temperature)
         loss = (self.temperature ** 2) * nn.KLDivLoss(**kl_args)(src_distribution, tgt_distribution)
-        loss = loss * self.scale_factor
+        loss = loss * (self.scale_factor if scale_factor is None else scale_factor)
         # return
         return loss
\ No newline at end of file
@@ -0,0 +1,32 @@
+'''
+Function:
+    Implementation of LossPlan
+Author:
+    Zhenchao Jin
+'''
+import copy
+from .builder import BuildLoss
+
+
+'''LossPlan'''
+class LossPlan():
+    def __init__(self, losses_cfgs, **static_kwargs):
+        # build every loss module once, static_kwargs are merged into each loss config (e.g., num_history_known_classes)
+        self.losses = {}
+        for losses_name, losses_cfg in losses_cfgs.items():
+            self.losses[losses_name] = []
+            for loss_type, loss_cfg in losses_cfg.items():
+                loss_cfg = copy.deepcopy(loss_cfg)
+                loss_cfg.update(static_kwargs)
+                loss_cfg['type'] = loss_type
+                self.losses[losses_name].append(BuildLoss(loss_cfg))
+    '''call'''
+    def __call__(self, prediction, target, **dynamic_kwargs):
+        # dynamic_kwargs change per iteration (e.g., the adaptive scale_factor of PLOP) and are passed to forward
+        losses_log_dict = {}
+        for losses_name, losses in self.losses.items():
+            loss = 0
+            for loss_module in losses:
+                loss += loss_module(prediction=prediction, target=target, **dynamic_kwargs)
+            losses_log_dict[losses_name] = loss.mean()
+        return losses_log_dict
@@ -15,11 +15,11 @@ class MSELoss(nn.Module):
         self.reduction = reduction
         self.scale_factor = scale_factor
     '''forward'''
-    def forward(self, prediction, target):
+    def forward(self, prediction, target, scale_factor=None):
         # assert
         assert prediction.size() == target.size()
         # calculate loss according to config
         loss = F.mse_loss(prediction, target, reduction=self.reduction)
-        loss = loss * self.scale_factor
+        loss = loss * (self.scale_factor if scale_factor is None else scale_factor)
         # return
         return loss
\ No newline at end of file
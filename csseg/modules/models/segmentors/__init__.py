@@ -1,2 +1,5 @@
 '''initialize'''
-from .builder import BuildSegmentor, SegmentorBuilder
\ No newline at end of file
+from .builder import BuildSegmentor, SegmentorBuilder
+from .teacher import FrozenTeacher
+from .decoding import decodesegpreds
+from .inferencers import BuildInferencer, InferencerBuilder
\ No newline at end of file
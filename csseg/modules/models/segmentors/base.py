@@ -9,8 +9,7 @@ import numbers
 import collections
 import torch.nn as nn
 import torch.nn.functional as F
-import torch.distributed as dist
-from ..losses import BuildLoss
+from ..losses import LossPlan
 from ..encoders import BuildEncoder
 from ..decoders import BuildDecoder
 
@@ -47,32 +46,19 @@ class BaseSegmentor(nn.Module):
         outputs = {'seg_logits': seg_logits}
         # return
         return outputs
-    '''calculatesegloss'''
-    def calculatesegloss(self, seg_logits, seg_targets, losses_cfg):
-        loss = 0
-        for loss_type, loss_cfg in losses_cfg.items():
-            loss_cfg = loss_cfg.copy()
-            loss_cfg['type'] = loss_type
-            loss += BuildLoss(loss_cfg)(prediction=seg_logits, target=seg_targets)
-        return loss.mean()
     '''calculateseglosses'''
-    def calculateseglosses(self, seg_logits, seg_targets, losses_cfgs):
+    def calculateseglosses(self, seg_logits, seg_targets, losses_cfgs=None, loss_plan=None, **dynamic_kwargs):
         # interpolate seg_logits
         if seg_logits.shape[-2:] != seg_targets.shape[-2:]:
             seg_logits = F.interpolate(seg_logits, size=seg_targets.shape[-2:], mode='bilinear', align_corners=self.align_corners)
-        # iter to calculate losses
-        losses_log_dict, loss_total = {}, 0
-        for losses_name, losses_cfg in losses_cfgs.items():
-            losses_log_dict[losses_name] = self.calculatesegloss(
-                seg_logits=seg_logits, seg_targets=seg_targets, losses_cfg=losses_cfg
-            )
-            loss_total += losses_log_dict[losses_name]
+        # runners pass a LossPlan compiled once per task, a losses_cfgs dict is compiled on the fly
+        if loss_plan is None:
+            loss_plan = LossPlan(losses_cfgs)
+        losses_log_dict = loss_plan(prediction=seg_logits, target=seg_targets, **dynamic_kwargs)
+        loss_total = sum(losses_log_dict.values())
         losses_log_dict.update({'loss_total': loss_total})
-        # syn losses_log_dict
-        for key, value in losses_log_dict.items():
-            value = value.data.clone()
-            dist.all_reduce(value.div_(dist.get_world_size()))
-            losses_log_dict[key] = value.item()
+        # losses_log_dict keeps detached device tensors, they are synchronized by the runner once per log interval
+        losses_log_dict = {key: value.detach() for key, value in losses_log_dict.items()}
         # return
         return loss_total, losses_log_dict
     '''transforminputs'''
@@ -0,0 +1,66 @@
+'''
+Function:
+    Implementation of memory-bounded decoding from seg_logits to seg_preds
+Author:
+    Zhenchao Jin
+'''
+import torch
+import torch.nn.functional as F
+
+
+'''bilinearweights'''
+def bilinearweights(in_size, out_size, align_corners=False, dtype=torch.float32, device=None):
+    # dense (out_size, in_size) interpolation matrix, source indices follow F.interpolate(mode='bilinear') in float32
+    dst = torch.arange(out_size, dtype=torch.float32)
+    if align_corners:
+        src = dst * torch.tensor((in_size - 1) / (out_size - 1) if out_size > 1 else 0., dtype=torch.float32)
+    else:
+        src = ((dst + 0.5) * torch.tensor(in_size / out_size, dtype=torch.float32) - 0.5).clamp(min=0)
+    idx0 = src.floor().long().clamp(max=in_size - 1)
+    idx1 = (idx0 + 1).clamp(max=in_size - 1)
+    lambda1 = (src - idx0).clamp(0, 1).double()
+    weights = torch.zeros((out_size, in_size), dtype=torch.float64)
+    weights.scatter_add_(1, idx0.unsqueeze(1), (1 - lambda1).unsqueeze(1))
+    weights.scatter_add_(1, idx1.unsqueeze(1), lambda1.unsqueeze(1))
+    return weights.to(dtype=dtype, device=device)
+
+
+'''decodesegpreds'''
+@torch.no_grad()
+def decodesegpreds(seg_logits, size, align_corners=False, memory_budget_mb=512):
+    batch_size, num_classes, in_height, in_width = seg_logits.shape
+    height, width = int(size[0]), int(size[1])
+    if (in_height, in_width) == (height, width):
+        return seg_logits.max(dim=1)[1]
+    # number of elements the upsampled chunk may hold, the running max and argmax come on top
+    budget = int(memory_budget_mb * 1024 ** 2) // seg_logits.element_size() if memory_budget_mb is not None else None
+    if budget is None or budget >= batch_size * num_classes * height * width:
+        return F.interpolate(seg_logits, size=(height, width), mode='bilinear', align_corners=align_corners).max(dim=1)[1]
+    max_logits = torch.full((batch_size, height, width), float('-inf'), dtype=seg_logits.dtype, device=seg_logits.device)
+    seg_preds = torch.zeros((batch_size, height, width), dtype=torch.long, device=seg_logits.device)
+    # stream over class chunks at full resolution, each chunk is interpolated exactly as before
+    num_chunk_classes = budget // (batch_size * height * width)
+    if num_chunk_classes >= 1:
+        for start in range(0, num_classes, num_chunk_classes):
+            chunk = F.interpolate(seg_logits[:, start: start + num_chunk_classes], size=(height, width), mode='bilinear', align_corners=align_corners)
+            updatepreds(chunk, start, max_logits, seg_preds)
+        return seg_preds
+    # not even one class map fits, tile the output rows and apply the separable bilinear weights per tile
+    weights_y = bilinearweights(in_height, height, align_corners, dtype=seg_logits.dtype, device=seg_logits.device)
+    weights_x = bilinearweights(in_width, width, align_corners, dtype=seg_logits.dtype, device=seg_logits.device).t()
+    tile_height = max(1, budget // (batch_size * width))
+    for top in range(0, height, tile_height):
+        bottom = min(top + tile_height, height)
+        for cls_idx in range(num_classes):
+            chunk = torch.matmul(torch.matmul(weights_y[top: bottom], seg_logits[:, cls_idx]), weights_x).unsqueeze(1)
+            updatepreds(chunk, cls_idx, max_logits[:, top: bottom], seg_preds[:, top: bottom])
+    return seg_preds
+
+
+'''updatepreds'''
+def updatepreds(chunk, start, max_logits, seg_preds):
+    # strict comparison keeps the lowest class index on ties, as max(dim=1) over all classes does
+    chunk_max, chunk_preds = chunk.max(dim=1)
+    update = chunk_max > max_logits
+    max_logits.copy_(torch.where(update, chunk_max, max_logits))
+    seg_preds.copy_(torch.where(update, chunk_preds + start, seg_preds))
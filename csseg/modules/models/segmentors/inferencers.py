@@ -0,0 +1,177 @@
+'''
+Function:
+    Implementation of Inferencers, i.e., how seg_logits are produced from a segmentor at test time
+Author:
+    Zhenchao Jin
+'''
+import time
+import torch
+import collections
+import torch.nn.functional as F
+from ...utils import BaseModuleBuilder
+
+
+'''WholeInferencer'''
+class WholeInferencer():
+    def __init__(self, timing=False, **kwargs):
+        # timing synchronizes the device around every call, so it is only switched on when the windows/s are reported
+        self.timing = timing
+        self.num_windows = 0
+        self.elapsed_time = 0.
+    '''call'''
+    @torch.no_grad()
+    def __call__(self, segmentor, images, valid_sizes=None, output_size=None):
+        # the logits are returned at the resolution of the segmentor, decodesegpreds resizes them to output_size once
+        start_time = self.starttimer(images)
+        seg_logits = segmentor(images)['seg_logits']
+        self.stoptimer(images, start_time, images.shape[0])
+        return seg_logits
+    '''starttimer'''
+    def starttimer(self, images):
+        if not self.timing: return None
+        # the pending copies of the inputs are not counted as inference time
+        if images.is_cuda: torch.cuda.synchronize(images.device)
+        return time.perf_counter()
+    '''stoptimer'''
+    def stoptimer(self, images, start_time, num_windows):
+        self.num_windows += num_windows
+        if start_time is None: return
+        # the kernels run asynchronously, wait for them before reading the clock
+        if images.is_cuda: torch.cuda.synchronize(images.device)
+        self.elapsed_time += time.perf_counter() - start_time
+    '''windowspersecond'''
+    def windowspersecond(self):
+        return self.num_windows / self.elapsed_time if self.elapsed_time > 0 else 0.
+    '''resetstats'''
+    def resetstats(self):
+        self.num_windows, self.elapsed_time = 0, 0.
+
+
+'''SlidingWindowInferencer'''
+class SlidingWindowInferencer(WholeInferencer):
+    def __init__(self, window_size=512, stride=341, max_windows_per_batch=16, **kwargs):
+        super(SlidingWindowInferencer, self).__init__(**kwargs)
+        # assert
+        assert isinstance(window_size, int) or (isinstance(window_size, collections.abc.Sequence) and len(window_size) == 2)
+        assert isinstance(stride, int) or (isinstance(stride, collections.abc.Sequence) and len(stride) == 2)
+        # set attributes
+        self.window_size = (window_size, window_size) if isinstance(window_size, int) else tuple(window_size)
+        self.stride = (stride, stride) if isinstance(stride, int) else tuple(stride)
+        self.max_windows_per_batch = max_windows_per_batch
+    '''call'''
+    @torch.no_grad()
+    def __call__(self, segmentor, images, valid_sizes=None, output_size=None):
+        start_time = self.starttimer(images)
+        batch_size, num_channels, height, width = images.shape
+        align_corners = getattr(segmentor, 'module', segmentor).align_corners
+        # windows of all images are packed together, only the valid region of padded images is covered
+        valid_sizes = valid_sizes.tolist() if valid_sizes is not None else [(height, width)] * batch_size
+        windows = [(idx, ) + window for idx, (valid_height, valid_width) in enumerate(valid_sizes) for window in self.getwindows(valid_height, valid_width)]
+        seg_logits, counts = None, images.new_zeros((batch_size, 1, height, width))
+        for start in range(0, len(windows), self.max_windows_per_batch):
+            batch_windows = windows[start: start + self.max_windows_per_batch]
+            # windows larger than the image are zero padded at the bottom-right
+            crops = images.new_zeros((len(batch_windows), num_channels) + self.window_size)
+            for pos, (idx, top, left, bottom, right) in enumerate(batch_windows):
+                crops[pos, :, :bottom - top, :right - left] = images[idx, :, top: bottom, left: right]
+            crop_logits = segmentor(crops)['seg_logits']
+            crop_logits = F.interpolate(crop_logits, size=self.window_size, mode='bilinear', align_corners=align_corners)
+            if seg_logits is None:
+                seg_logits = crop_logits.new_zeros((batch_size, crop_logits.shape[1], height, width))
+            # accumulate the logits on overlaps and count how often every pixel is covered
+            for pos, (idx, top, left, bottom, right) in enumerate(batch_windows):
+                seg_logits[idx, :, top: bottom, left: right] += crop_logits[pos, :, :bottom - top, :right - left]
+                counts[idx, :, top: bottom, left: right] += 1
+        seg_logits = seg_logits / counts.clamp(min=1).to(seg_logits.dtype)
+        self.stoptimer(images, start_time, len(windows))
+        return seg_logits
+    '''getwindows'''
+    def getwindows(self, height, width):
+        (window_height, window_width), (stride_height, stride_width) = self.window_size, self.stride
+        num_rows = max(height - window_height + stride_height - 1, 0) // stride_height + 1
+        num_cols = max(width - window_width + stride_width - 1, 0) // stride_width + 1
+        windows = []
+        for row in range(num_rows):
+            for col in range(num_cols):
+                # the last window of a row or column is shifted back to end at the border
+                top, left = max(min(row * stride_height, height - window_height), 0), max(min(col * stride_width, width - window_width), 0)
+                windows.append((top, left, min(top + window_height, height), min(left + window_width, width)))
+        return windows
+
+
+'''MultiScaleFlipInferencer'''
+class MultiScaleFlipInferencer(WholeInferencer):
+    def __init__(self, scales=(1.0, ), flip=False, max_images_per_batch=8, base_inferencer_cfg=None, **kwargs):
+        super(MultiScaleFlipInferencer, self).__init__(**kwargs)
+        # assert
+        assert isinstance(scales, collections.abc.Sequence) and len(scales) > 0
+        # set attributes
+        self.scales = scales
+        self.flip = flip
+        self.max_images_per_batch = max_images_per_batch
+        # the windows are counted and timed by the base inferencer
+        base_inferencer_cfg = dict(base_inferencer_cfg) if base_inferencer_cfg is not None else {'type': 'WholeInferencer'}
+        base_inferencer_cfg.setdefault('timing', self.timing)
+        self.base_inferencer = BuildInferencer(base_inferencer_cfg)
+    '''call'''
+    @torch.no_grad()
+    def __call__(self, segmentor, images, valid_sizes=None, output_size=None):
+        batch_size, _, height, width = images.shape
+        align_corners = getattr(segmentor, 'module', segmentor).align_corners
+        variants = [(idx, flipped) for flipped in ([False, True] if self.flip else [False]) for idx in range(batch_size)]
+        # the probabilities are averaged at the output size, every variant is resized only once
+        out_height, out_width = (int(output_size[0]), int(output_size[1])) if output_size is not None else (height, width)
+        out_valid_sizes = (valid_sizes.float() * valid_sizes.new_tensor([out_height / height, out_width / width], dtype=torch.float)).round().long() if valid_sizes is not None else None
+        seg_probs = None
+        for scale in self.scales:
+            scaled_size = (int(round(height * scale)), int(round(width * scale)))
+            scaled_images = F.interpolate(images, size=scaled_size, mode='bilinear', align_corners=align_corners) if scaled_size != (height, width) else images
+            scaled_valid_sizes = (valid_sizes.float() * scale).round().long() if valid_sizes is not None else None
+            # equal scales of all images and their flips are batched together, fewer of them for the larger scales
+            num_images_per_batch = max(1, int(self.max_images_per_batch / max(scale, 1.) ** 2))
+            for start in range(0, len(variants), num_images_per_batch):
+                indices, flips = zip(*variants[start: start + num_images_per_batch])
+                indices = torch.tensor(indices, dtype=torch.long, device=images.device)
+                chunk_valid_sizes = scaled_valid_sizes[indices.cpu()] if scaled_valid_sizes is not None else None
+                chunk_images = self.flipimages(scaled_images[indices], flips, chunk_valid_sizes)
+                seg_logits = self.base_inferencer(segmentor, chunk_images, valid_sizes=chunk_valid_sizes)
+                # the variants are accumulated as they arrive, only one chunk of logits is alive
+                if seg_logits.shape[-2:] != (out_height, out_width):
+                    seg_logits = F.interpolate(seg_logits, size=(out_height, out_width), mode='bilinear', align_corners=align_corners)
+                chunk_probs = self.flipimages(seg_logits.softmax(dim=1), flips, out_valid_sizes[indices.cpu()] if out_valid_sizes is not None else None)
+                if seg_probs is None:
+                    seg_probs = chunk_probs.new_zeros((batch_size, chunk_probs.shape[1], out_height, out_width))
+                seg_probs.index_add_(0, indices, chunk_probs)
+        return seg_probs / len(self.scales) / (2 if self.flip else 1)
+    '''flipimages'''
+    @staticmethod
+    def flipimages(images, flips, valid_sizes=None):
+        if not any(flips): return images
+        flip_mask = torch.tensor(flips, dtype=torch.bool, device=images.device)
+        if valid_sizes is None:
+            images[flip_mask] = images[flip_mask].flip(-1)
+            return images
+        # padded images are flipped inside their valid region so the padding stays at the bottom-right
+        for pos, (flipped, (valid_height, valid_width)) in enumerate(zip(flips, valid_sizes.tolist())):
+            if flipped: images[pos, :, :valid_height, :valid_width] = images[pos, :, :valid_height, :valid_width].flip(-1)
+        return images
+    '''windowspersecond'''
+    def windowspersecond(self):
+        return self.base_inferencer.windowspersecond()
+    '''resetstats'''
+    def resetstats(self):
+        self.base_inferencer.resetstats()
+
+
+'''InferencerBuilder'''
+class InferencerBuilder(BaseModuleBuilder):
+    REGISTERED_MODULES = {
+        'WholeInferencer': WholeInferencer, 'SlidingWindowInferencer': SlidingWindowInferencer, 'MultiScaleFlipInferencer': MultiScaleFlipInferencer,
+    }
+    '''build'''
+    def build(self, inferencer_cfg):
+        return super().build(inferencer_cfg)
+
+
+'''BuildInferencer'''
+BuildInferencer = InferencerBuilder().build
@@ -0,0 +1,155 @@
+'''
+Function:
+    Implementation of FrozenTeacher, i.e., a fast inference-only wrapper of the history segmentor
+Author:
+    Zhenchao Jin
+'''
+import torch
+import contextlib
+import torch.nn as nn
+from inplace_abn import ABN, InPlaceABN, InPlaceABNSync
+try:
+    from apex import amp
+except:
+    amp = None
+
+
+'''DEFAULT_TOLERANCES'''
+DEFAULT_TOLERANCES = {'float32': 1e-4, 'float16': 1e-2, 'bfloat16': 5e-2}
+
+
+'''FrozenTeacher'''
+class FrozenTeacher(nn.Module):
+    def __init__(self, segmentor, example_inputs, dtype='auto', fuse_norm=True, channels_last=False, tolerance=None, **forward_kwargs):
+        super(FrozenTeacher, self).__init__()
+        # set attributes
+        device = next(segmentor.parameters()).device
+        self.dtype = self.selectdtype(dtype, device)
+        self.channels_last = channels_last
+        self.tolerance = tolerance if tolerance is not None else DEFAULT_TOLERANCES[str(self.dtype).split('.')[-1]]
+        self.align_corners = segmentor.align_corners
+        # the fp32 reference outputs are recorded in the same pass that finds the conv-norm pairs to fold
+        segmentor = segmentor.eval()
+        for param in segmentor.parameters():
+            param.requires_grad = False
+        with torch.inference_mode():
+            conv_norm_pairs, reference_outputs = self.traceconvnormpairs(segmentor, example_inputs, **forward_kwargs)
+            reference_outputs = self.castoutputs(reference_outputs)
+            if fuse_norm:
+                for conv_name, norm_name in conv_norm_pairs: self.foldnorm(segmentor, conv_name, norm_name)
+            self.num_folded_norms = len(conv_norm_pairs) if fuse_norm else 0
+            self.segmentor = segmentor.to(dtype=self.dtype, memory_format=torch.channels_last if channels_last else torch.contiguous_format)
+            # norms that could not be folded keep running in float32, e.g., the inplace_abn kernels have no bfloat16 support
+            if self.dtype != torch.float32:
+                for module in self.segmentor.modules():
+                    if self.isfoldablenorm(module): self.keepfloat32(module)
+        self.eval()
+        # the distillation targets must match the reference within the stated tolerance
+        self.max_error = self.maxrelativeerror(self(example_inputs, **forward_kwargs), reference_outputs)
+        assert self.max_error <= self.tolerance, f'outputs of FrozenTeacher deviate by {self.max_error:.2e} from the reference, larger than the tolerance {self.tolerance:.2e}'
+    '''forward'''
+    def forward(self, x, **kwargs):
+        # the surrounding autocast or apex casts of the training step are disabled, so the teacher runs exactly as it was checked
+        with torch.inference_mode(), torch.autocast(device_type=x.device.type, enabled=False), self.disableapexcasts():
+            x = x.to(dtype=self.dtype, memory_format=torch.channels_last if self.channels_last else torch.contiguous_format)
+            outputs = self.segmentor(x, **kwargs)
+        # copies outside inference_mode so that the losses may save them for backward
+        return self.castoutputs(outputs)
+    '''train'''
+    def train(self, mode=True):
+        # the teacher always runs with the running statistics
+        return super(FrozenTeacher, self).train(False)
+    '''disableapexcasts'''
+    @staticmethod
+    def disableapexcasts():
+        # apex O1 patches the torch functions globally once amp.initialize has created its handle
+        if amp is None or getattr(getattr(amp, '_amp_state', None), 'handle', None) is None: return contextlib.nullcontext()
+        return amp.disable_casts()
+    '''selectdtype'''
+    @staticmethod
+    def selectdtype(dtype, device):
+        if dtype != 'auto': return getattr(torch, dtype)
+        if device.type == 'cuda':
+            return torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+        return torch.float32
+    '''castoutputs'''
+    @staticmethod
+    def castoutputs(outputs):
+        if torch.is_tensor(outputs):
+            return outputs.to(torch.float32, memory_format=torch.contiguous_format, copy=True)
+        if isinstance(outputs, dict):
+            return {key: FrozenTeacher.castoutputs(value) for key, value in outputs.items()}
+        if isinstance(outputs, (list, tuple)):
+            return type(outputs)(FrozenTeacher.castoutputs(value) for value in outputs)
+        return outputs
+    '''traceconvnormpairs'''
+    @staticmethod
+    def traceconvnormpairs(segmentor, example_inputs, **forward_kwargs):
+        # a norm is folded only if, during a real forward, its input is the very tensor the last conv produced and both run once
+        last_conv, calls, pairs, handles = {}, {}, [], []
+        def convhook(name):
+            def hook(module, inputs, output):
+                calls[name] = calls.get(name, 0) + 1
+                last_conv.update({'name': name, 'output': output})
+            return hook
+        def normhook(name):
+            def hook(module, inputs):
+                calls[name] = calls.get(name, 0) + 1
+                if last_conv.get('output', None) is inputs[0]:
+                    pairs.append((last_conv['name'], name))
+                last_conv.clear()
+            return hook
+        for name, module in segmentor.named_modules():
+            if type(module) is nn.Conv2d:
+                handles.append(module.register_forward_hook(convhook(name)))
+            elif FrozenTeacher.isfoldablenorm(module):
+                handles.append(module.register_forward_pre_hook(normhook(name)))
+        outputs = segmentor(example_inputs, **forward_kwargs)
+        for handle in handles: handle.remove()
+        pairs = [(conv_name, norm_name) for conv_name, norm_name in pairs if calls[conv_name] == 1 and calls[norm_name] == 1]
+        return pairs, outputs
+    '''keepfloat32'''
+    @staticmethod
+    def keepfloat32(module):
+        module.float()
+        module.register_forward_pre_hook(lambda module, inputs: setattr(module, 'output_dtype', inputs[0].dtype))
+        module.register_forward_pre_hook(lambda module, inputs: (inputs[0].float(), ) + tuple(inputs[1:]))
+        module.register_forward_hook(lambda module, inputs, output: output.to(module.output_dtype))
+    '''isfoldablenorm'''
+    @staticmethod
+    def isfoldablenorm(module):
+        if isinstance(module, nn.modules.batchnorm._BatchNorm):
+            return module.track_running_stats and module.running_mean is not None
+        return isinstance(module, (ABN, InPlaceABN, InPlaceABNSync))
+    '''foldnorm'''
+    @staticmethod
+    def foldnorm(segmentor, conv_name, norm_name):
+        conv, norm = segmentor.get_submodule(conv_name), segmentor.get_submodule(norm_name)
+        # y = act(weight * (conv(x) - mean) / sqrt(var + eps) + bias), computed in float64 before casting back
+        running_mean, running_var = norm.running_mean.double(), norm.running_var.double()
+        weight = norm.weight.double() if norm.weight is not None else torch.ones_like(running_mean)
+        bias = norm.bias.double() if norm.bias is not None else torch.zeros_like(running_mean)
+        if isinstance(norm, (InPlaceABN, InPlaceABNSync)) and not isinstance(norm, nn.modules.batchnorm._BatchNorm):
+            weight = weight.abs() + norm.eps
+        scale = weight / torch.sqrt(running_var + norm.eps)
+        conv_bias = conv.bias.double() if conv.bias is not None else torch.zeros_like(running_mean)
+        conv.weight = nn.Parameter((conv.weight.double() * scale.view(-1, 1, 1, 1)).to(conv.weight.dtype), requires_grad=False)
+        conv.bias = nn.Parameter(((conv_bias - running_mean) * scale + bias).to(conv.weight.dtype), requires_grad=False)
+        # only the activation fused into the norm is left
+        activation, activation_param = getattr(norm, 'activation', 'identity'), getattr(norm, 'activation_param', 0.01)
+        activation = {
+            'leaky_relu': lambda: nn.LeakyReLU(activation_param), 'elu': lambda: nn.ELU(activation_param), 'identity': lambda: nn.Identity(),
+        }[activation]()
+        parent_name, _, child_name = norm_name.rpartition('.')
+        setattr(segmentor.get_submodule(parent_name) if parent_name else segmentor, child_name, activation)
+    '''maxrelativeerror'''
+    @staticmethod
+    def maxrelativeerror(outputs, reference_outputs):
+        # max absolute difference of every output tensor, relative to the largest magnitude of its reference
+        if torch.is_tensor(outputs):
+            return ((outputs - reference_outputs).abs().max() / reference_outputs.abs().max().clamp(min=1e-12)).item()
+        if isinstance(outputs, dict):
+            return max([FrozenTeacher.maxrelativeerror(outputs[key], reference_outputs[key]) for key in outputs] + [0.])
+        if isinstance(outputs, (list, tuple)):
+            return max([FrozenTeacher.maxrelativeerror(output, reference_output) for output, reference_output in zip(outputs, reference_outputs)] + [0.])
+        return 0.
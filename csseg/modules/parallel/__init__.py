@@ -1,3 +1,3 @@
 '''initialize'''
 from .model import BuildDistributedModel
-from .dataloader import BuildDistributedDataloader
\ No newline at end of file
+from .dataloader import BuildDistributedDataloader, RingBufferDataLoader, BalancedDistributedEvalSampler, SizeBucketedBatchSampler
\ No newline at end of file
@@ -5,7 +5,244 @@ Author:
     Zhenchao Jin
 '''
 import copy
+import math
+import heapq
+import queue
 import torch
+import random
+import functools
+import traceback
+import numpy as np
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+
+'''MultiViewDistributedSampler'''
+class MultiViewDistributedSampler(torch.utils.data.distributed.DistributedSampler):
+    def __init__(self, dataset, num_views, num_replicas=None, rank=None, shuffle=True, seed=0):
+        super(MultiViewDistributedSampler, self).__init__(dataset, num_replicas=num_replicas, rank=rank, shuffle=shuffle, seed=seed)
+        # each index yields num_views samples, so draw 1/num_views of the images to keep the epoch length
+        self.num_views = num_views
+        self.num_images = math.ceil(len(dataset) / num_views)
+        self.num_samples = math.ceil(self.num_images / self.num_replicas)
+        self.total_size = self.num_samples * self.num_replicas
+    '''iter'''
+    def __iter__(self):
+        if self.shuffle:
+            g = torch.Generator()
+            g.manual_seed(self.seed + self.epoch)
+            indices = torch.randperm(len(self.dataset), generator=g).tolist()
+        else:
+            indices = list(range(len(self.dataset)))
+        indices = indices[:self.num_images]
+        indices += (indices * math.ceil(self.total_size / len(indices)))[:self.total_size - len(indices)]
+        return iter(indices[self.rank:self.total_size:self.num_replicas])
+
+
+'''BalancedDistributedEvalSampler'''
+class BalancedDistributedEvalSampler(torch.utils.data.Sampler):
+    def __init__(self, dataset, num_replicas=None, rank=None):
+        is_distributed = dist.is_available() and dist.is_initialized()
+        self.num_replicas = num_replicas if num_replicas is not None else (dist.get_world_size() if is_distributed else 1)
+        self.rank = rank if rank is not None else (dist.get_rank() if is_distributed else 0)
+        self.dataset = dataset
+        self.epoch = 0
+        # shard every image exactly once, assigning the largest images first to the least loaded rank
+        widths, heights = dataset.getimagesizes()
+        costs, loads, heap = np.asarray(widths, dtype=np.int64) * np.asarray(heights, dtype=np.int64), [0] * self.num_replicas, [(0, r) for r in range(self.num_replicas)]
+        shards = [[] for _ in range(self.num_replicas)]
+        for index in np.argsort(-costs, kind='stable').tolist():
+            load, rank_idx = heapq.heappop(heap)
+            shards[rank_idx].append(index)
+            heapq.heappush(heap, (load + int(costs[index]), rank_idx))
+        self.indices = sorted(shards[self.rank])
+    '''iter'''
+    def __iter__(self):
+        return iter(self.indices)
+    '''len'''
+    def __len__(self):
+        return len(self.indices)
+    '''set_epoch'''
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+
+'''SizeBucketedBatchSampler'''
+class SizeBucketedBatchSampler(torch.utils.data.Sampler):
+    def __init__(self, dataset, batch_size, num_replicas=None, rank=None, num_aspect_buckets_per_octave=4):
+        is_distributed = dist.is_available() and dist.is_initialized()
+        self.num_replicas = num_replicas if num_replicas is not None else (dist.get_world_size() if is_distributed else 1)
+        self.rank = rank if rank is not None else (dist.get_rank() if is_distributed else 0)
+        self.dataset = dataset
+        self.batch_size = batch_size
+        # group images by aspect ratio, then batch neighbours in area so that little padding is needed
+        widths, heights = dataset.getimagesizes()
+        widths, heights = np.asarray(widths, dtype=np.int64), np.asarray(heights, dtype=np.int64)
+        aspect_buckets = np.round(np.log2(heights / widths) * num_aspect_buckets_per_octave).astype(np.int64)
+        batches = []
+        for aspect_bucket in np.unique(aspect_buckets):
+            indices = np.flatnonzero(aspect_buckets == aspect_bucket)
+            indices = indices[np.argsort(widths[indices] * heights[indices], kind='stable')]
+            batches.extend([indices[i: i + batch_size].tolist() for i in range(0, len(indices), batch_size)])
+        # shard the batches exactly, assigning the most expensive padded batches first to the least loaded rank
+        costs = [len(batch) * int(heights[batch].max()) * int(widths[batch].max()) for batch in batches]
+        loads, shards = [(0, r) for r in range(self.num_replicas)], [[] for _ in range(self.num_replicas)]
+        for batch_idx in sorted(range(len(batches)), key=lambda x: -costs[x]):
+            load, rank_idx = heapq.heappop(loads)
+            shards[rank_idx].append(batches[batch_idx])
+            heapq.heappush(loads, (load + costs[batch_idx], rank_idx))
+        self.batches = sorted(shards[self.rank], key=lambda x: x[0])
+    '''iter'''
+    def __iter__(self):
+        return iter(self.batches)
+    '''len'''
+    def __len__(self):
+        return len(self.batches)
+    '''set_epoch'''
+    def set_epoch(self, epoch):
+        pass
+
+
+'''collatenative'''
+def collatenative(batch, size_divisor=32):
+    # pad to the largest sample of the bucket rounded up to size_divisor, padded seg_target pixels are ignored (255) by the evaluator
+    images, seg_targets = [s['image'] for s in batch], [s['seg_target'] for s in batch]
+    max_height = int(math.ceil(max([image.shape[-2] for image in images]) / size_divisor) * size_divisor)
+    max_width = int(math.ceil(max([image.shape[-1] for image in images]) / size_divisor) * size_divisor)
+    data_meta = torch.utils.data.default_collate([{k: v for k, v in s.items() if k not in ['image', 'seg_target']} for s in batch])
+    data_meta['image'] = images[0].new_zeros((len(batch), images[0].shape[0], max_height, max_width))
+    data_meta['seg_target'] = torch.full((len(batch), max_height, max_width), 255, dtype=torch.uint8)
+    data_meta['valid_size'] = torch.tensor([[image.shape[-2], image.shape[-1]] for image in images], dtype=torch.int64)
+    for idx, (image, seg_target) in enumerate(zip(images, seg_targets)):
+        data_meta['image'][idx, :, :image.shape[-2], :image.shape[-1]] = image
+        data_meta['seg_target'][idx, :seg_target.shape[-2], :seg_target.shape[-1]] = seg_target
+    return data_meta
+
+
+'''ringbufferworkerloop'''
+def ringbufferworkerloop(dataset, slots, task_queue, done_queue):
+    torch.set_num_threads(1)
+    while True:
+        task = task_queue.get()
+        if task is None: break
+        iter_id, slot_idx, sample_indices, seed = task
+        try:
+            random.seed(seed)
+            np.random.seed(seed % (1 << 32))
+            torch.manual_seed(seed)
+            # write the samples straight into the preallocated batch slot
+            for pos, sample_idx in enumerate(sample_indices):
+                data_meta = dataset[sample_idx]
+                slots['image'][slot_idx, pos].copy_(torch.as_tensor(np.asarray(data_meta['image'])))
+                if data_meta.get('seg_target') is not None:
+                    slots['seg_target'][slot_idx, pos].copy_(torch.as_tensor(np.asarray(data_meta['seg_target'])))
+                else:
+                    slots['seg_target'][slot_idx, pos].fill_(255)
+                slots['width'][slot_idx, pos], slots['height'][slot_idx, pos] = data_meta['width'], data_meta['height']
+                slots['index'][slot_idx, pos] = sample_idx
+            done_queue.put((iter_id, slot_idx, None))
+        except Exception:
+            done_queue.put((iter_id, slot_idx, traceback.format_exc()))
+
+
+'''RingBufferDataLoader'''
+class RingBufferDataLoader():
+    def __init__(self, dataset, sampler, batch_size, num_workers, num_slots=None, drop_last=False, timeout=300, pin_memory=False, **kwargs):
+        # assert
+        assert num_workers > 0, 'RingBufferDataLoader requires num_workers > 0'
+        assert getattr(dataset, 'collate_fn', None) is None, 'RingBufferDataLoader requires fixed-size samples'
+        # set attributes
+        self.dataset = dataset
+        self.sampler = sampler
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.num_slots = num_slots if num_slots is not None else 2 * num_workers + 1
+        self.timeout = timeout
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        self.batch_sampler = torch.utils.data.BatchSampler(sampler, batch_size, drop_last)
+        self.slots, self.workers, self.iter_id = None, [], 0
+    '''len'''
+    def __len__(self):
+        return len(self.batch_sampler)
+    '''iter'''
+    def __iter__(self):
+        if self.slots is None: self.startworkers()
+        self.iter_id += 1
+        batches, base_seed = list(self.batch_sampler), int(torch.empty((), dtype=torch.int64).random_().item())
+        num_sent, inflight, copy_events = 0, set(), [None] * self.num_slots
+        try:
+            for batch_idx, batch in enumerate(batches):
+                # the consumer has queued its copies of the previous batch when it asks for the next one
+                if batch_idx > 0: copy_events[(batch_idx - 1) % self.num_slots] = self.recordcopyevent()
+                # keep every slot except the one being consumed busy, a slot is only handed back once its copies to the device are done
+                while num_sent < len(batches) and num_sent < batch_idx + self.num_slots:
+                    slot_idx, copy_event = num_sent % self.num_slots, copy_events[num_sent % self.num_slots]
+                    if copy_event is not None:
+                        if num_sent > batch_idx and not copy_event.query(): break
+                        copy_event.synchronize()
+                        copy_events[slot_idx] = None
+                    self.task_queue.put((self.iter_id, slot_idx, batches[num_sent], base_seed + num_sent))
+                    inflight.add(slot_idx)
+                    num_sent += 1
+                slot_idx = batch_idx % self.num_slots
+                while slot_idx in inflight:
+                    self.waitforslot(inflight)
+                # the views are valid until the next batch is requested
+                yield {key: value[slot_idx, :len(batch)] for key, value in self.slots.items()}
+        finally:
+            while inflight:
+                self.waitforslot(inflight)
+    '''recordcopyevent'''
+    def recordcopyevent(self):
+        # copies from pageable memory return once the data is staged, only copies from the pinned slots can still be reading them
+        if not self.pin_memory: return None
+        copy_event = torch.cuda.Event()
+        copy_event.record(torch.cuda.current_stream())
+        return copy_event
+    '''waitforslot'''
+    def waitforslot(self, inflight):
+        try:
+            iter_id, slot_idx, error = self.done_queue.get(timeout=self.timeout)
+        except queue.Empty:
+            dead_workers = [w.pid for w in self.workers if not w.is_alive()]
+            raise RuntimeError(f'RingBufferDataLoader timed out, dead workers: {dead_workers}')
+        if error is not None:
+            raise RuntimeError(f'RingBufferDataLoader worker failed:\n{error}')
+        if iter_id == self.iter_id: inflight.discard(slot_idx)
+    '''startworkers'''
+    def startworkers(self):
+        # allocate the slots from the shapes of the first sample
+        data_meta = self.dataset[0]
+        image, seg_target = torch.as_tensor(np.asarray(data_meta['image'])), data_meta.get('seg_target')
+        seg_target_shape = tuple(np.asarray(seg_target).shape) if seg_target is not None else tuple(image.shape[-2:])
+        self.slots = {
+            'image': torch.empty((self.num_slots, self.batch_size) + tuple(image.shape), dtype=image.dtype),
+            'seg_target': torch.empty((self.num_slots, self.batch_size) + seg_target_shape, dtype=torch.uint8),
+            'width': torch.empty((self.num_slots, self.batch_size), dtype=torch.int64),
+            'height': torch.empty((self.num_slots, self.batch_size), dtype=torch.int64),
+            'index': torch.empty((self.num_slots, self.batch_size), dtype=torch.int64),
+        }
+        for value in self.slots.values(): value.share_memory_()
+        # page-lock the shared slots in place, the non_blocking copies to the device only overlap from pinned memory
+        if self.pin_memory:
+            for value in self.slots.values():
+                torch.cuda.cudart().cudaHostRegister(value.data_ptr(), value.numel() * value.element_size(), 0)
+        # start persistent workers
+        self.task_queue, self.done_queue = mp.Queue(), mp.Queue()
+        for _ in range(self.num_workers):
+            worker = mp.Process(target=ringbufferworkerloop, args=(self.dataset, self.slots, self.task_queue, self.done_queue), daemon=True)
+            worker.start()
+            self.workers.append(worker)
+    '''shutdown'''
+    def shutdown(self):
+        for _ in self.workers: self.task_queue.put(None)
+        for worker in self.workers: worker.join(timeout=5)
+        self.workers = []
+        if self.pin_memory and self.slots is not None:
+            for value in self.slots.values(): torch.cuda.cudart().cudaHostUnregister(value.data_ptr())
+    '''del'''
+    def __del__(self):
+        if self.workers: self.shutdown()
 
 
 '''BuildDistributedDataloader'''
@@ -13,14 +250,43 @@ def BuildDistributedDataloader(dataset, dataloader_cfg):
     dataloader_cfg = copy.deepcopy(dataloader_cfg)
     # parse
     dataloader_cfg = dataloader_cfg[dataset.mode.lower()]
+    dataloader_type = dataloader_cfg.pop('type', 'pytorch')
+    assert dataloader_type in ['pytorch', 'ringbuffer']
     shuffle = dataloader_cfg.pop('shuffle')
     dataloader_cfg['shuffle'] = False
     dataloader_cfg['batch_size'] = dataloader_cfg.pop('batch_size_per_gpu')
     dataloader_cfg['num_workers'] = dataloader_cfg.pop('num_workers_per_gpu')
-    # sampler
-    sampler = torch.utils.data.distributed.DistributedSampler(dataset, shuffle=shuffle)
+    # batches are copied to the device with non_blocking, which only overlaps with compute from pinned memory
+    dataloader_cfg.setdefault('pin_memory', torch.cuda.is_available())
+    # sampler, evaluation shards the dataset exactly instead of padding it with duplicates
+    sampler_type = dataloader_cfg.pop('sampler', 'balanced' if dataset.mode == 'TEST' else 'distributed')
+    size_divisor = dataloader_cfg.pop('size_divisor', 32)
+    assert sampler_type in ['balanced', 'distributed', 'bucketed']
+    num_views = getattr(dataset, 'num_views', 1)
+    # native-resolution evaluation batches images of similar shape and pads each batch only to its own maximum
+    if sampler_type == 'bucketed':
+        assert not shuffle and dataloader_type == 'pytorch', 'bucketed sampler is for evaluation with the pytorch dataloader only'
+        batch_sampler = SizeBucketedBatchSampler(dataset, batch_size=dataloader_cfg.pop('batch_size'))
+        dataloader_cfg.pop('shuffle'), dataloader_cfg.pop('drop_last', None), dataloader_cfg.pop('num_slots', None)
+        return torch.utils.data.DataLoader(dataset, batch_sampler=batch_sampler, collate_fn=functools.partial(collatenative, size_divisor=size_divisor), **dataloader_cfg)
+    if sampler_type == 'balanced':
+        assert not shuffle, 'balanced sampler is for evaluation only'
+        sampler = BalancedDistributedEvalSampler(dataset)
+    elif num_views > 1:
+        assert dataloader_cfg['batch_size'] % num_views == 0, 'batch_size_per_gpu should be divisible by num_views'
+        dataloader_cfg['batch_size'] = dataloader_cfg['batch_size'] // num_views
+        sampler = MultiViewDistributedSampler(dataset, num_views=num_views, shuffle=shuffle)
+    else:
+        sampler = torch.utils.data.distributed.DistributedSampler(dataset, shuffle=shuffle)
     dataloader_cfg['sampler'] = sampler
+    # workers write fixed-size samples into shared-memory batch slots and only pass back the slot index
+    if dataloader_type == 'ringbuffer':
+        return RingBufferDataLoader(dataset, **dataloader_cfg)
+    dataloader_cfg.pop('num_slots', None)
+    # datasets with batch_transforms collate the decoded samples by themselves
+    if getattr(dataset, 'collate_fn', None) is not None:
+        dataloader_cfg['collate_fn'] = dataset.collate_fn
     # dataloader
     dataloader = torch.utils.data.DataLoader(dataset, **dataloader_cfg)
     # return
-    return dataloader
\ No newline at end of file
+    return dataloader
@@ -0,0 +1,130 @@
+'''
+Function:
+    Implementation of AsyncCheckpointEvaluator
+Author:
+    Zhenchao Jin
+'''
+import os
+import copy
+import json
+import torch
+import hashlib
+import torch.multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from ..models import BuildSegmentor, BuildInferencer, decodesegpreds
+from ..parallel import BuildDistributedDataloader
+from ..datasets import BuildDataset, SegmentationEvaluator
+from ..utils import touchdir, loadckpts, saveaspickle, loadpicklefile
+
+
+'''hashcheckpoint'''
+def hashcheckpoint(state_dict, eval_key=''):
+    # hash the weights rather than the file, so the epoch counter, optimizer state and best_score do not matter
+    sha = hashlib.sha256(eval_key.encode('utf-8'))
+    for key in sorted(state_dict.keys()):
+        tensor = state_dict[key].detach().cpu().contiguous()
+        sha.update(f'{key}|{tensor.dtype}|{tuple(tensor.shape)}'.encode('utf-8'))
+        sha.update(tensor.view(-1).view(torch.uint8).numpy())
+    return sha.hexdigest()
+
+
+'''evaluatecheckpoint'''
+@torch.no_grad()
+def evaluatecheckpoint(ckpt_path, eval_cfg, device, cache_dir):
+    # load the weights and look them up in the cache before building anything
+    ckpts = loadckpts(ckpt_path)
+    state_dict = {k[len('module.'):] if k.startswith('module.') else k: v for k, v in ckpts['segmentor'].items()}
+    ckpt_hash = hashcheckpoint(state_dict, eval_key=json.dumps(eval_cfg, sort_keys=True, default=str))
+    cache_path = os.path.join(cache_dir, f'{ckpt_hash}.pkl')
+    if os.path.exists(cache_path):
+        return loadpicklefile(cache_path), True
+    # build the test set and the segmentor on the evaluation device
+    device = torch.device(device)
+    test_set = BuildDataset(mode='TEST', task_name=eval_cfg['task_name'], task_id=eval_cfg['task_id'], dataset_cfg=copy.deepcopy(eval_cfg['dataset_cfg']))
+    test_loader = BuildDistributedDataloader(dataset=test_set, dataloader_cfg={'test': copy.deepcopy(eval_cfg['dataloader_cfg'])})
+    segmentor = BuildSegmentor(segmentor_cfg=copy.deepcopy(eval_cfg['segmentor_cfg']))
+    segmentor.load_state_dict(state_dict, strict=True)
+    segmentor = segmentor.to(device).eval()
+    inferencer = BuildInferencer(eval_cfg['inference_cfg'])
+    # evaluate on the whole test set, the same way as BaseRunner.test
+    seg_evaluator = SegmentationEvaluator(num_classes=eval_cfg['num_total_classes'], device=device if device.type == 'cuda' else None)
+    for data_meta in test_loader:
+        if test_set.batch_transforms is not None:
+            data_meta['image'], data_meta['seg_target'] = data_meta['image'].to(device), data_meta['seg_target'].to(device)
+            data_meta = test_set.applybatchtransforms(data_meta)
+        images = test_set.normalizeimages(data_meta['image'].to(device))
+        seg_targets = test_set.remapsegtargets(data_meta['seg_target'].to(device)).long()
+        seg_logits = inferencer(segmentor, images, valid_sizes=data_meta.get('valid_size', None), output_size=seg_targets.shape[-2:])
+        seg_preds = decodesegpreds(seg_logits, size=seg_targets.shape[-2:], align_corners=segmentor.align_corners, memory_budget_mb=eval_cfg['decode_memory_budget_mb'])
+        seg_evaluator.update(seg_targets=seg_targets, seg_preds=seg_preds)
+    results = seg_evaluator.evaluate()
+    saveaspickle(results, cache_path)
+    return results, False
+
+
+'''AsyncCheckpointEvaluator'''
+class AsyncCheckpointEvaluator():
+    def __init__(self, runner_cfg, logger_handle, device='cpu', num_workers=1, cache_dir=None, dataloader_num_workers=2):
+        # everything the background workers need to rebuild the test set and the segmentor
+        segmentor_cfg = copy.deepcopy(runner_cfg['segmentor_cfg'])
+        segmentor_cfg.pop('losses_cfgs')
+        # the workers run outside the process group, so they use a plain dataloader over the whole test set
+        dataloader_cfg = copy.deepcopy(runner_cfg['dataloader_cfg']['test'])
+        dataloader_cfg.update({'type': 'pytorch', 'num_workers_per_gpu': dataloader_num_workers})
+        if dataloader_cfg.get('sampler', 'balanced') == 'distributed': dataloader_cfg['sampler'] = 'balanced'
+        self.eval_cfg = {
+            'task_name': runner_cfg['task_name'], 'task_id': runner_cfg['task_id'], 'num_total_classes': runner_cfg['num_total_classes'],
+            'dataset_cfg': copy.deepcopy(runner_cfg['dataset_cfg']), 'segmentor_cfg': segmentor_cfg,
+            'dataloader_cfg': dataloader_cfg,
+            'decode_memory_budget_mb': runner_cfg.get('decode_memory_budget_mb', 512), 'inference_cfg': runner_cfg.get('inference_cfg', {'type': 'WholeInferencer'}),
+        }
+        self.device = device
+        self.num_workers = num_workers
+        self.logger_handle = logger_handle
+        self.cache_dir = cache_dir if cache_dir is not None else os.path.join(runner_cfg['work_dir'], 'eval_cache')
+        touchdir(dirname=self.cache_dir)
+        self.executor = self.buildexecutor()
+        self.pending = {}
+        # the evaluation runs on the cpu unless a device is given, the gpus of the training processes are kept for training
+        self.logger_handle.info(f'Evaluate the saved checkpoints in {num_workers} background processes on {device}')
+    '''buildexecutor'''
+    def buildexecutor(self):
+        # spawn so the workers do not inherit the cuda context of the training process
+        return ProcessPoolExecutor(max_workers=self.num_workers, mp_context=mp.get_context('spawn'))
+    '''submit'''
+    def submit(self, ckpt_path, cur_epoch):
+        try:
+            future = self.executor.submit(evaluatecheckpoint, ckpt_path, self.eval_cfg, self.device, self.cache_dir)
+        except BrokenProcessPool:
+            # a worker died since the last poll, restart the pool
+            self.executor.shutdown(wait=False)
+            self.executor = self.buildexecutor()
+            future = self.executor.submit(evaluatecheckpoint, ckpt_path, self.eval_cfg, self.device, self.cache_dir)
+        self.pending[future] = (cur_epoch, ckpt_path)
+    '''poll'''
+    def poll(self, block=False):
+        if not self.pending: return []
+        done = wait(list(self.pending.keys()), timeout=None if block else 0)[0]
+        finished, is_broken = [], False
+        for future in done:
+            cur_epoch, ckpt_path = self.pending.pop(future)
+            # a failed evaluation (e.g., out of memory or a killed worker) only drops the results of its epoch, training goes on
+            try:
+                results, cache_hit = future.result()
+            except Exception as err:
+                self.logger_handle.warning(f'Async evaluation of {ckpt_path} (epoch {cur_epoch}) failed and is skipped: {repr(err)}')
+                is_broken = is_broken or isinstance(err, BrokenProcessPool)
+                continue
+            finished.append((cur_epoch, ckpt_path, results, cache_hit))
+        # a killed worker breaks the whole pool, the checkpoints still pending on it are lost as well
+        if is_broken:
+            for cur_epoch, ckpt_path in self.pending.values(): self.logger_handle.warning(f'Async evaluation of {ckpt_path} (epoch {cur_epoch}) failed and is skipped: broken process pool')
+            self.executor.shutdown(wait=False)
+            self.executor, self.pending = self.buildexecutor(), {}
+        # fold the results in epoch order whatever order the workers finished in
+        return sorted(finished, key=lambda x: x[0])
+    '''shutdown'''
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+        self.pending = {}
@@ -15,11 +15,13 @@ except:
     amp = None
 from torch.cuda.amp import autocast
 from torch.cuda.amp import GradScaler
-from ..datasets import BuildDataset, SegmentationEvaluator
-from ..models import BuildSegmentor, BuildOptimizer, BuildScheduler
+from ..datasets import BuildDataset, SegmentationEvaluator, ConfusionStore
+from ..models import BuildSegmentor, BuildOptimizer, BuildScheduler, BuildInferencer, LossPlan, FrozenTeacher, decodesegpreds
 from ..parallel import BuildDistributedDataloader, BuildDistributedModel
+from .asynceval import AsyncCheckpointEvaluator
+from .teacherstore import TeacherOutputStore
 from torch.distributed.algorithms.ddp_comm_hooks import default as comm_hooks
-from ..utils import BuildLoggerHandle, touchdir, loadckpts, saveckpts, saveaspickle, symlink, loadpicklefile
+from ..utils import MetricsAccumulator, BuildLoggerHandle, touchdir, loadckpts, saveckpts, saveaspickle, symlink, loadpicklefile
 
 
 '''BaseRunner'''
@@ -39,8 +41,12 @@ class BaseRunner():
         self.save_interval_epochs = runner_cfg['save_interval_epochs']
         self.eval_interval_epochs = runner_cfg['eval_interval_epochs']
         self.log_interval_iterations = runner_cfg['log_interval_iterations']
+        self.losses_log_accumulator = MetricsAccumulator()
         self.choose_best_segmentor_by_metric = runner_cfg['choose_best_segmentor_by_metric']
         self.eps = runner_cfg.get('eps', 1e-6)
+        self.decode_memory_budget_mb = runner_cfg.get('decode_memory_budget_mb', 512)
+        self.inferencer = BuildInferencer(runner_cfg.get('inference_cfg', {'type': 'WholeInferencer'}))
+        self.teacher_store = None
         # build workdir
         touchdir(dirname=self.root_work_dir)
         touchdir(dirname=self.task_work_dir)
@@ -48,11 +54,24 @@ class BaseRunner():
         self.logger_handle = BuildLoggerHandle(logger_handle_cfg=runner_cfg['logger_handle_cfg'])
         # build datasets
         dataset_cfg = runner_cfg['dataset_cfg']
-        train_set = BuildDataset(mode='TRAIN', task_name=runner_cfg['task_name'], task_id=runner_cfg['task_id'], dataset_cfg=dataset_cfg) if mode == 'TRAIN' else None
+        teacher_store_cfg = runner_cfg.get('teacher_store_cfg', None) if (runner_cfg['task_id'] > 0 and mode == 'TRAIN') else None
+        train_dataset_cfg = dataset_cfg
+        if teacher_store_cfg is not None:
+            # the training samples carry the source index of every pixel to replay the stored teacher outputs
+            train_dataset_cfg = copy.deepcopy(dataset_cfg)
+            train_dataset_cfg['with_source_index'] = True
+        train_set = BuildDataset(mode='TRAIN', task_name=runner_cfg['task_name'], task_id=runner_cfg['task_id'], dataset_cfg=train_dataset_cfg) if mode == 'TRAIN' else None
+        if teacher_store_cfg is not None:
+            # the store replaces the teacher forward, so it is only accepted if the distillation needs nothing but the teacher logits or pseudo labels
+            assert not self.requiresteacherfeatures(), f'teacher_store_cfg is not supported by {type(self).__name__} whose distillation needs the teacher features, disable the features distillation or drop teacher_store_cfg'
+            assert train_set.batch_transforms is None, 'teacher_store_cfg can not be combined with batch_transforms'
+            assert runner_cfg['dataloader_cfg']['train'].get('type', 'pytorch') != 'ringbuffer', 'teacher_store_cfg can not be combined with RingBufferDataLoader which drops imageid and source_index'
         test_set = BuildDataset(mode='TEST', task_name=runner_cfg['task_name'], task_id=runner_cfg['task_id'], dataset_cfg=dataset_cfg)
         assert (runner_cfg['num_total_classes'] == train_set.num_classes if mode == 'TRAIN' else True)
         assert runner_cfg['num_total_classes'] == test_set.num_classes
-        # build dataloaders
+        # build dataloaders, native-resolution evaluation pads every bucket to a multiple of the encoder outstride
+        if runner_cfg['dataloader_cfg']['test'].get('sampler', None) == 'bucketed':
+            runner_cfg['dataloader_cfg']['test'].setdefault('size_divisor', runner_cfg['segmentor_cfg']['encoder_cfg'].get('outstride', 32))
         dataloader_cfg = copy.deepcopy(runner_cfg['dataloader_cfg'])
         total_train_bs_for_auto_check = dataloader_cfg.pop('total_train_bs_for_auto_check')
         auto_align_train_bs = dataloader_cfg.pop('auto_align_train_bs')
@@ -97,16 +116,19 @@ class BaseRunner():
         elif self.fp16_type in ['apex']:
             self.grad_scaler = None
             assert amp is not None, 'apex should be installed when set fp16_type as `apex`'
-        # parallel segmentor
+        # parallel segmentor, a frozen teacher never receives gradients so it is kept out of DDP and apex
         parallel_cfg = runner_cfg['parallel_cfg']
+        frozen_teacher_cfg = runner_cfg.get('frozen_teacher_cfg', None) if self.history_segmentor is not None else None
+        if frozen_teacher_cfg is not None:
+            self.history_segmentor = self.history_segmentor.to(self.device)
         if self.fp16_type in ['pytorch']:
             self.segmentor = BuildDistributedModel(model=self.segmentor.to(self.device), model_cfg=parallel_cfg['model_cfg'])
             self.segmentor.register_comm_hook(state=None, hook=comm_hooks.fp16_compress_hook)
-            if self.history_segmentor is not None and mode == 'TRAIN':
+            if self.history_segmentor is not None and mode == 'TRAIN' and frozen_teacher_cfg is None:
                 self.history_segmentor = BuildDistributedModel(model=self.history_segmentor.to(self.device), model_cfg=parallel_cfg['model_cfg'])
                 self.history_segmentor.register_comm_hook(state=None, hook=comm_hooks.fp16_compress_hook)
         elif self.fp16_type in ['apex']:
-            if self.history_segmentor is None and mode == 'TRAIN':
+            if (self.history_segmentor is None or frozen_teacher_cfg is not None) and mode == 'TRAIN':
                 self.segmentor, self.optimizer = amp.initialize(
                     self.segmentor.to(self.device), self.optimizer, **fp16_cfg['initialize']
                 )
@@ -127,10 +149,17 @@ class BaseRunner():
                 self.segmentor.module.initaddedclassifier(device=self.device)
             if hasattr(self, 'convertsegmentors'):
                 self.convertsegmentors()
-            self.history_segmentor.load_state_dict(ckpts['segmentor'], strict=True)
+            if frozen_teacher_cfg is not None:
+                self.history_segmentor.load_state_dict({k[len('module.'):] if k.startswith('module.') else k: v for k, v in ckpts['segmentor'].items()}, strict=True)
+            else:
+                self.history_segmentor.load_state_dict(ckpts['segmentor'], strict=True)
             for param in self.history_segmentor.parameters():
                 param.requires_grad = False
             self.history_segmentor.eval()
+            if frozen_teacher_cfg is not None:
+                self.history_segmentor = self.buildfrozenteacher(frozen_teacher_cfg)
+            if teacher_store_cfg is not None:
+                self.teacher_store = self.buildteacherstore(teacher_store_cfg, ckpts['segmentor'])
         # load current checkpoints
         if os.path.islink(os.path.join(self.task_work_dir, 'latest.pth')) and mode == 'TRAIN':
             ckpts = loadckpts(os.path.join(self.task_work_dir, 'latest.pth'))
@@ -142,34 +171,93 @@ class BaseRunner():
                 amp.load_state_dict(ckpts['amp'])
             self.scheduler.setstate(state_dict=ckpts)
             self.best_score = ckpts['best_score']
+        # compile the segmentation losses of this task once, the train step only feeds tensors to them
+        self.seg_loss_plan = self.buildseglossplan() if mode == 'TRAIN' else None
     '''start'''
     def start(self):
         if self.cmd_args.local_rank == 0:
             self.logger_handle.info(f'Load Config From: {self.cmd_args.cfgfilepath}')
             self.logger_handle.info(f'Config Details: \n{self.runner_cfg}')
+        # evaluate the saved checkpoints in background processes of rank 0 while training goes on
+        async_eval_cfg = self.runner_cfg.get('async_eval_cfg', None)
+        async_evaluator = AsyncCheckpointEvaluator(runner_cfg=self.runner_cfg, logger_handle=self.logger_handle, **async_eval_cfg) if (async_eval_cfg is not None) and (self.cmd_args.local_rank == 0) else None
         self.actionsbeforetask()
         for cur_epoch in range(self.scheduler.cur_epoch+1, self.scheduler.max_epochs+1):
             if self.cmd_args.local_rank == 0:
                 self.logger_handle.info(f'Start to train {self.runner_cfg["algorithm"]} at Task {self.runner_cfg["task_id"]}, Epoch {cur_epoch}')
             self.scheduler.cur_epoch = cur_epoch
             self.train(cur_epoch=cur_epoch)
-            if ((cur_epoch % self.save_interval_epochs == 0) or (cur_epoch == self.scheduler.max_epochs)) and (self.cmd_args.local_rank == 0):
+            is_save_epoch = (cur_epoch % self.save_interval_epochs == 0) or (cur_epoch == self.scheduler.max_epochs)
+            is_eval_epoch = (cur_epoch % self.eval_interval_epochs == 0) or (cur_epoch == self.scheduler.max_epochs)
+            if (is_save_epoch or (is_eval_epoch and async_eval_cfg is not None)) and (self.cmd_args.local_rank == 0):
                 ckpt_path = os.path.join(self.task_work_dir, f'epoch_{cur_epoch}.pth')
                 saveckpts(ckpts=self.state(), savepath=ckpt_path)
                 symlink(ckpt_path, os.path.join(self.task_work_dir, 'latest.pth'))
-            if (cur_epoch % self.eval_interval_epochs == 0) or (cur_epoch == self.scheduler.max_epochs):
+            if is_eval_epoch and async_eval_cfg is None:
                 results = self.test(cur_epoch=cur_epoch)
                 if self.cmd_args.local_rank == 0:
-                    ckpt_path = os.path.join(self.task_work_dir, f'epoch_{cur_epoch}.pth')
-                    if self.best_score <= results[self.choose_best_segmentor_by_metric]:
-                        self.best_score = results[self.choose_best_segmentor_by_metric]
-                        symlink(ckpt_path, os.path.join(self.task_work_dir, 'best.pth'))
-                        saveaspickle(results, os.path.join(self.task_work_dir, 'best.pkl'))
-                    self.logger_handle.info(results)
+                    self.updatebestsegmentor(cur_epoch, os.path.join(self.task_work_dir, f'epoch_{cur_epoch}.pth'), results)
+            elif is_eval_epoch and async_evaluator is not None:
+                async_evaluator.submit(os.path.join(self.task_work_dir, f'epoch_{cur_epoch}.pth'), cur_epoch)
+            if async_evaluator is not None:
+                for finished in async_evaluator.poll(block=False): self.updatebestsegmentor(*finished)
+        if async_evaluator is not None:
+            for finished in async_evaluator.poll(block=True): self.updatebestsegmentor(*finished)
+            async_evaluator.shutdown()
         self.actionsaftertask()
         if self.cmd_args.local_rank == 0:
+            # with every asynchronous evaluation failed, there is no best result, the next task starts from latest.pth anyway
+            if not os.path.exists(os.path.join(self.task_work_dir, 'best.pkl')):
+                self.logger_handle.warning(f'No evaluation succeeded at Task {self.runner_cfg["task_id"]}, best.pth and best.pkl are not written')
+                return
             best_results = loadpicklefile(os.path.join(self.task_work_dir, 'best.pkl'))
             self.logger_handle.info(f'Best Result at Task {self.runner_cfg["task_id"]}: \n{best_results}')
+    '''updatebestsegmentor'''
+    def updatebestsegmentor(self, cur_epoch, ckpt_path, results, cache_hit=False):
+        if self.best_score <= results[self.choose_best_segmentor_by_metric]:
+            self.best_score = results[self.choose_best_segmentor_by_metric]
+            symlink(ckpt_path, os.path.join(self.task_work_dir, 'best.pth'))
+            saveaspickle(results, os.path.join(self.task_work_dir, 'best.pkl'))
+        if cache_hit:
+            self.logger_handle.info(f'Results of Epoch {cur_epoch} are loaded from the evaluation cache')
+        self.logger_handle.info(results)
+    '''buildfrozenteacher'''
+    def buildfrozenteacher(self, frozen_teacher_cfg, **forward_kwargs):
+        # the first training sample is used to find the foldable norms and to check the teacher against its fp32 outputs
+        # it is collated directly, a loader pass would be started and the sampler and RNG states would be consumed otherwise
+        train_set = self.train_loader.dataset
+        collate_fn = train_set.collate_fn if train_set.collate_fn is not None else torch.utils.data.default_collate
+        images, _ = self.fetchdata(collate_fn([train_set[0]]), self.train_loader)
+        history_segmentor = FrozenTeacher(self.history_segmentor, example_inputs=images, **frozen_teacher_cfg, **forward_kwargs)
+        if self.cmd_args.local_rank == 0:
+            self.logger_handle.info(
+                f'Build FrozenTeacher with dtype {history_segmentor.dtype}, {history_segmentor.num_folded_norms} folded norms, '
+                f'max relative error {history_segmentor.max_error:.2e} (tolerance {history_segmentor.tolerance:.2e})'
+            )
+        return history_segmentor
+    '''buildteacherstore'''
+    def buildteacherstore(self, teacher_store_cfg, state_dict, **forward_kwargs):
+        teacher_store_cfg = copy.deepcopy(teacher_store_cfg)
+        train_set = self.train_loader.dataset
+        teacher_store = TeacherOutputStore.fromsegmentor(
+            segmentor=self.history_segmentor, data_generator=train_set.data_generator, normalize=train_set.normalizerawimages,
+            state_dict={k[len('module.'):] if k.startswith('module.') else k: v for k, v in state_dict.items()},
+            store_dir=teacher_store_cfg.pop('store_dir', os.path.join(self.root_work_dir, 'teacher_store')), device=self.device,
+            align_corners=self.segmentor.module.align_corners, **teacher_store_cfg, **forward_kwargs,
+        )
+        # the teacher forward is skipped, the stored outputs are replayed instead
+        self.history_segmentor = teacher_store
+        if self.cmd_args.local_rank == 0:
+            stored_outputs = 'pseudo labels and entropy' if teacher_store.outputs == 'pseudolabels' else f'top-{teacher_store.topk} of {teacher_store.num_classes} logits'
+            self.logger_handle.info(f'Build TeacherOutputStore with {stored_outputs} at {teacher_store.canonical_size}px from {teacher_store.store_prefix}')
+        return teacher_store
+    '''requiresteacherfeatures'''
+    def requiresteacherfeatures(self):
+        return True
+    '''buildseglossplan'''
+    def buildseglossplan(self):
+        losses_cfgs = self.losses_cfgs['segmentation_cl'] if self.history_segmentor is not None else self.losses_cfgs['segmentation_init']
+        return LossPlan(losses_cfgs)
     '''actionsbeforetask'''
     def actionsbeforetask(self):
         pass
@@ -178,17 +266,28 @@ class BaseRunner():
         pass
     '''call'''
     def __call__(self, images, seg_targets):
-        # initialize
-        losses_cfgs = copy.deepcopy(self.losses_cfgs)
         # feed to segmentor
         outputs = self.segmentor(images)
         # calculate segmentation losses
-        seg_losses_cfgs = copy.deepcopy(losses_cfgs['segmentation_cl']) if self.history_segmentor is not None else copy.deepcopy(losses_cfgs['segmentation_init'])
         seg_total_loss, seg_losses_log_dict = self.segmentor.module.calculateseglosses(
-            seg_logits=outputs['seg_logits'], seg_targets=seg_targets, losses_cfgs=seg_losses_cfgs,
+            seg_logits=outputs['seg_logits'], seg_targets=seg_targets, loss_plan=self.seg_loss_plan,
         )
         # return
         return seg_total_loss, seg_losses_log_dict
+    '''fetchdata'''
+    def fetchdata(self, data_meta, dataloader):
+        if dataloader.dataset.batch_transforms is not None:
+            data_meta['image'], data_meta['seg_target'] = data_meta['image'].to(self.device, non_blocking=True), data_meta['seg_target'].to(self.device, non_blocking=True)
+            data_meta = dataloader.dataset.applybatchtransforms(data_meta)
+        images = dataloader.dataset.normalizeimages(data_meta['image'].to(self.device, non_blocking=True))
+        seg_targets = data_meta['seg_target'].to(self.device, non_blocking=True)
+        seg_targets = dataloader.dataset.remapsegtargets(seg_targets).long()
+        # ring-buffer batches carry the sample indices, the consumers downstream always see the imageids
+        if 'imageid' not in data_meta and 'index' in data_meta:
+            data_meta['imageid'] = dataloader.dataset.getimageids(data_meta['index'].tolist())
+        if self.teacher_store is not None and 'source_index' in data_meta:
+            self.teacher_store.setbatch(data_meta, self.device)
+        return images, seg_targets
     '''train'''
     def train(self, cur_epoch):
         # initialize
@@ -198,14 +297,12 @@ class BaseRunner():
             'cur_epoch': self.scheduler.cur_epoch, 'max_epochs': self.scheduler.max_epochs, 'cur_iter': self.scheduler.cur_iter, 'max_iters': self.scheduler.max_iters,
             'lr': self.scheduler.lr,
         }
-        losses_log_dict = copy.deepcopy(init_losses_log_dict)
         self.segmentor.train()
         self.train_loader.sampler.set_epoch(cur_epoch)
         # start to iter
         for batch_idx, data_meta in enumerate(self.train_loader):
             # --fetch data
-            images = data_meta['image'].to(self.device, dtype=torch.float32)
-            seg_targets = data_meta['seg_target'].to(self.device, dtype=torch.long)
+            images, seg_targets = self.fetchdata(data_meta, self.train_loader)
             # --set zero gradient
             self.scheduler.zerograd()
             # --forward
@@ -220,32 +317,87 @@ class BaseRunner():
             # --perform back propagation
             self.scheduler.step(self.grad_scaler)
             # --logging training loss info
-            losses_log_dict = self.loggingtraininginfo(seg_losses_log_dict, losses_log_dict, init_losses_log_dict)
+            self.loggingtraininginfo(seg_losses_log_dict, init_losses_log_dict, {'cur_epoch': self.scheduler.cur_epoch, 'cur_iter': self.scheduler.cur_iter, 'lr': self.scheduler.lr})
     '''test'''
     @torch.no_grad()
     def test(self, cur_epoch):
         if self.cmd_args.local_rank == 0:
             self.logger_handle.info(f'Start to test {self.runner_cfg["algorithm"]} at Task {self.runner_cfg["task_id"]}, Epoch {cur_epoch}')
         self.segmentor.eval()
-        seg_evaluator = SegmentationEvaluator(num_classes=self.runner_cfg['num_total_classes'])
+        save_confusion_store = self.runner_cfg.get('save_confusion_store', False)
+        seg_evaluator = SegmentationEvaluator(
+            num_classes=self.runner_cfg['num_total_classes'], device=self.device if self.device.type == 'cuda' else None, per_image=save_confusion_store,
+        )
         with torch.no_grad():
             test_loader = self.test_loader
             if self.cmd_args.local_rank == 0:
                 test_loader = tqdm(self.test_loader)
                 test_loader.set_description('Evaluating')
             for batch_idx, data_meta in enumerate(test_loader):
-                images = data_meta['image'].to(self.device, dtype=torch.float32)
-                seg_targets = data_meta['seg_target'].to(self.device, dtype=torch.long)
-                seg_logits = self.segmentor(images)['seg_logits']
-                seg_logits = F.interpolate(seg_logits, size=seg_targets.shape[-2:], mode='bilinear', align_corners=self.segmentor.module.align_corners)
-                seg_preds = seg_logits.max(dim=1)[-1]
-                seg_targets = seg_targets.cpu().numpy()
-                seg_preds = seg_preds.cpu().numpy()
-                seg_evaluator.update(seg_targets=seg_targets, seg_preds=seg_preds)
+                images, seg_targets = self.fetchdata(data_meta, self.test_loader)
+                seg_logits = self.inferencer(self.segmentor, images, valid_sizes=data_meta.get('valid_size', None), output_size=seg_targets.shape[-2:])
+                seg_preds = decodesegpreds(seg_logits, size=seg_targets.shape[-2:], align_corners=self.segmentor.module.align_corners, memory_budget_mb=self.decode_memory_budget_mb)
+                seg_evaluator.update(seg_targets=seg_targets, seg_preds=seg_preds, imageids=data_meta['imageid'])
         seg_evaluator.synchronize(device=self.device)
         results = seg_evaluator.evaluate()
+        if self.cmd_args.local_rank == 0 and self.inferencer.timing:
+            self.logger_handle.info(f'Inference Speed of {type(self.inferencer).__name__}: {self.inferencer.windowspersecond():.2f} windows/s')
+        self.inferencer.resetstats()
+        # keep the per-image confusion entries to re-slice the metrics later without inference
+        if save_confusion_store and self.cmd_args.local_rank == 0:
+            ConfusionStore.fromevaluator(seg_evaluator).save(os.path.join(self.task_work_dir, f'confusion_store_epoch_{cur_epoch}.npz'))
         self.segmentor.train()
         return results
+    '''testcheckpoints'''
+    @torch.no_grad()
+    def testcheckpoints(self, ckpts_list):
+        test_set = self.test_loader.dataset
+        # the raw labels are remapped per checkpoint, as the test set of its own task would do
+        test_set.keeprawsegtargets(True)
+        # build one segmentor per checkpoint with the classes known at its task
+        segmentors, seg_evaluators, seg_target_luts, selected_imageids = [], [], [], []
+        for ckpts in ckpts_list:
+            assert ckpts['task_id'] <= self.runner_cfg['task_id'], 'checkpoints should not be newer than the task of the test set'
+            segmentor_cfg = copy.deepcopy(self.runner_cfg['segmentor_cfg'])
+            segmentor_cfg.pop('losses_cfgs')
+            segmentor_cfg['num_known_classes_list'] = test_set.getnumclassespertask(self.runner_cfg['task_name'], test_set.tasks, ckpts['task_id'])
+            segmentor = BuildSegmentor(segmentor_cfg=segmentor_cfg)
+            segmentor.load_state_dict({k[len('module.'):] if k.startswith('module.') else k: v for k, v in ckpts['segmentor'].items()}, strict=True)
+            segmentors.append(segmentor.to(self.device).eval())
+            seg_evaluators.append(SegmentationEvaluator(num_classes=self.runner_cfg['num_total_classes'], device=self.device if self.device.type == 'cuda' else None))
+            seg_target_luts.append(test_set.buildsegtargetlut(ckpts['task_id']))
+            selected_imageids.append(set(test_set.selectimageids(ckpts['task_id'])))
+        # stream the test set once and feed every batch to all segmentors
+        test_loader = self.test_loader
+        if self.cmd_args.local_rank == 0:
+            test_loader = tqdm(self.test_loader)
+            test_loader.set_description(f'Evaluating {len(segmentors)} Checkpoints')
+        for batch_idx, data_meta in enumerate(test_loader):
+            images, seg_targets = self.fetchdata(data_meta, self.test_loader)
+            imageids, valid_sizes = data_meta['imageid'], data_meta.get('valid_size', None)
+            for segmentor, seg_evaluator, seg_target_lut, selected in zip(segmentors, seg_evaluators, seg_target_luts, selected_imageids):
+                # only the images in the test set of the task of the checkpoint are evaluated
+                keep = [imageid in selected for imageid in imageids]
+                if not any(keep): continue
+                if all(keep):
+                    kept_images, kept_seg_targets, kept_valid_sizes, kept_imageids = images, seg_targets, valid_sizes, imageids
+                else:
+                    keep_mask = torch.tensor(keep, dtype=torch.bool)
+                    kept_images, kept_seg_targets = images[keep_mask.to(images.device)], seg_targets[keep_mask.to(seg_targets.device)]
+                    kept_valid_sizes = valid_sizes[keep_mask] if valid_sizes is not None else None
+                    kept_imageids = [imageid for imageid, k in zip(imageids, keep) if k]
+                seg_logits = self.inferencer(segmentor, kept_images, valid_sizes=kept_valid_sizes, output_size=kept_seg_targets.shape[-2:])
+                seg_preds = decodesegpreds(seg_logits, size=kept_seg_targets.shape[-2:], align_corners=segmentor.align_corners, memory_budget_mb=self.decode_memory_budget_mb)
+                seg_evaluator.update(seg_targets=seg_target_lut(kept_seg_targets).long(), seg_preds=seg_preds, imageids=kept_imageids)
+        test_set.keeprawsegtargets(False)
+        results_list = []
+        for seg_evaluator in seg_evaluators:
+            seg_evaluator.synchronize(device=self.device)
+            results_list.append(seg_evaluator.evaluate())
+        if self.cmd_args.local_rank == 0 and self.inferencer.timing:
+            self.logger_handle.info(f'Inference Speed of {type(self.inferencer).__name__}: {self.inferencer.windowspersecond():.2f} windows/s')
+        self.inferencer.resetstats()
+        return results_list
     '''state'''
     def state(self):
         state_dict = self.scheduler.state()
@@ -258,22 +410,16 @@ class BaseRunner():
             state_dict.update({'amp': amp.state_dict()})
         return state_dict
     '''loggingtraininginfo'''
-    def loggingtraininginfo(self, seg_losses_log_dict, losses_log_dict, init_losses_log_dict):
-        for key, value in seg_losses_log_dict.items():
-            if key in losses_log_dict:
-                losses_log_dict[key].append(value)
-            else:
-                losses_log_dict[key] = [value]
-        losses_log_dict.update({
-            'algorithm': self.runner_cfg['algorithm'], 'work_tag': self.cmd_args.cfgfilepath.split('/')[-1][:-3], 'task_name': self.runner_cfg['task_name'], 'task_id': self.runner_cfg['task_id'], 
-            'encoder': self.runner_cfg['segmentor_cfg']['encoder_cfg']['type'], 'decoder': self.runner_cfg['segmentor_cfg']['decoder_cfg']['type'],
-            'cur_epoch': self.scheduler.cur_epoch, 'max_epochs': self.scheduler.max_epochs, 'cur_iter': self.scheduler.cur_iter, 'max_iters': self.scheduler.max_iters,
-            'lr': self.scheduler.lr,
-        })
-        if (self.scheduler.cur_iter % self.log_interval_iterations == 0) and (self.cmd_args.local_rank == 0):
-            for key, value in losses_log_dict.copy().items():
-                if isinstance(value, list):
-                    losses_log_dict[key] = sum(value) / len(value)
-            self.logger_handle.info(losses_log_dict)
-            losses_log_dict = copy.deepcopy(init_losses_log_dict)
-        return losses_log_dict
\ No newline at end of file
+    def loggingtraininginfo(self, seg_losses_log_dict, init_losses_log_dict, progress_log_dict):
+        # losses stay on device between log steps, all ranks join the single packed all-reduce at the log step
+        self.losses_log_accumulator.update(seg_losses_log_dict)
+        if self.scheduler.cur_iter % self.log_interval_iterations != 0:
+            return
+        averaged_losses_log_dict = self.losses_log_accumulator.reduce(device=self.device)
+        if self.cmd_args.local_rank == 0:
+            # the header of the caller is built once per epoch, its progress entries are refreshed in place
+            assert set(progress_log_dict).issubset(init_losses_log_dict)
+            losses_log_dict = dict(init_losses_log_dict)
+            losses_log_dict.update(progress_log_dict)
+            losses_log_dict.update(averaged_losses_log_dict)
+            self.logger_handle.info(losses_log_dict)
\ No newline at end of file
@@ -7,7 +7,6 @@ Author:
 import copy
 import torch
 import torch.nn.functional as F
-import torch.distributed as dist
 from .base import BaseRunner
 from ..models import BuildLoss
 
@@ -18,10 +17,15 @@ class ILTRunner(BaseRunner):
         super(ILTRunner, self).__init__(
             mode=mode, cmd_args=cmd_args, runner_cfg=runner_cfg
         )
+        # the feature distillation loss is built once per task as well
+        self.distillation_features_loss = BuildLoss(self.losses_cfgs['distillation_features'])
+    '''requiresteacherfeatures'''
+    def requiresteacherfeatures(self):
+        return self.losses_cfgs['distillation_features'].get('scale_factor', 1.0) > 0
     '''call'''
     def __call__(self, images, seg_targets):
         # initialize
-        losses_cfgs = copy.deepcopy(self.losses_cfgs)
+        losses_cfgs = self.losses_cfgs
         # feed to history_segmentor
         if self.history_segmentor is not None:
             with torch.no_grad():
@@ -29,9 +33,8 @@ class ILTRunner(BaseRunner):
         # feed to segmentor
         outputs = self.segmentor(images)
         # calculate segmentation losses
-        seg_losses_cfgs = copy.deepcopy(losses_cfgs['segmentation_cl']) if self.history_segmentor is not None else copy.deepcopy(losses_cfgs['segmentation_init'])
         seg_total_loss, seg_losses_log_dict = self.segmentor.module.calculateseglosses(
-            seg_logits=outputs['seg_logits'], seg_targets=seg_targets, losses_cfgs=seg_losses_cfgs,
+            seg_logits=outputs['seg_logits'], seg_targets=seg_targets, loss_plan=self.seg_loss_plan,
         )
         # calculate distillation losses
         kd_total_loss, kd_losses_log_dict = 0, {}
@@ -41,16 +44,17 @@ class ILTRunner(BaseRunner):
                 distillation_feats=F.interpolate(outputs['seg_logits'], size=images.shape[2:], mode="bilinear", align_corners=self.segmentor.module.align_corners),
                 **losses_cfgs['distillation_logits']
             )
-            kd_loss_feats = BuildLoss(losses_cfgs['distillation_features'])(prediction=outputs['distillation_feats'], target=history_outputs['distillation_feats'])
-            value = kd_loss_feats.data.clone()
-            dist.all_reduce(value.div_(dist.get_world_size()))
-            kd_losses_log_dict['kd_loss_feats'] = value.item()
-            kd_total_loss = kd_loss_logits + kd_loss_feats
+            kd_total_loss = kd_loss_logits
+            # stored teacher outputs have no features, the features loss is then disabled by its scale_factor
+            if 'distillation_feats' in history_outputs:
+                kd_loss_feats = self.distillation_features_loss(prediction=outputs['distillation_feats'], target=history_outputs['distillation_feats'])
+                kd_losses_log_dict['kd_loss_feats'] = kd_loss_feats.detach()
+                kd_total_loss = kd_total_loss + kd_loss_feats
         # deal with losses
         loss_total = kd_total_loss + seg_total_loss
         seg_losses_log_dict.update(kd_losses_log_dict)
         seg_losses_log_dict.pop('loss_total')
-        seg_losses_log_dict['loss_total'] = loss_total.item()
+        seg_losses_log_dict['loss_total'] = loss_total.detach()
         # return
         return loss_total, seg_losses_log_dict
     '''featuresdistillation'''
@@ -67,7 +71,5 @@ class ILTRunner(BaseRunner):
         else:
             loss = -loss
         loss = loss * scale_factor
-        value = loss.data.clone()
-        dist.all_reduce(value.div_(dist.get_world_size()))
-        kd_losses_log_dict = {'kd_loss_logits': value.item()}
+        kd_losses_log_dict = {'kd_loss_logits': loss.detach()}
         return loss, kd_losses_log_dict
\ No newline at end of file
@@ -8,8 +8,8 @@ import copy
 import torch
 import functools
 import torch.nn.functional as F
-import torch.distributed as dist
 from .base import BaseRunner
+from ..models import LossPlan
 
 
 '''MIBRunner'''
@@ -18,10 +18,19 @@ class MIBRunner(BaseRunner):
         super(MIBRunner, self).__init__(
             mode=mode, cmd_args=cmd_args, runner_cfg=runner_cfg
         )
+    '''requiresteacherfeatures'''
+    def requiresteacherfeatures(self):
+        # only the teacher logits are distilled
+        return False
+    '''buildseglossplan'''
+    def buildseglossplan(self):
+        if self.history_segmentor is None: return super(MIBRunner, self).buildseglossplan()
+        num_history_known_classes = functools.reduce(lambda a, b: a + b, self.runner_cfg['segmentor_cfg']['num_known_classes_list'][:-1])
+        return LossPlan(self.losses_cfgs['segmentation_cl'], num_history_known_classes=num_history_known_classes)
     '''call'''
     def __call__(self, images, seg_targets):
         # initialize
-        losses_cfgs = copy.deepcopy(self.losses_cfgs)
+        losses_cfgs = self.losses_cfgs
         # feed to history_segmentor
         if self.history_segmentor is not None:
             with torch.no_grad():
@@ -29,14 +38,8 @@ class MIBRunner(BaseRunner):
         # feed to segmentor
         outputs = self.segmentor(images)
         # calculate segmentation losses
-        seg_losses_cfgs = copy.deepcopy(losses_cfgs['segmentation_cl']) if self.history_segmentor is not None else copy.deepcopy(losses_cfgs['segmentation_init'])
-        if self.history_segmentor is not None:
-            num_history_known_classes = functools.reduce(lambda a, b: a + b, self.runner_cfg['segmentor_cfg']['num_known_classes_list'][:-1])
-            for _, seg_losses_cfg in seg_losses_cfgs.items():
-                for loss_type, loss_cfg in seg_losses_cfg.items():
-                    loss_cfg.update({'num_history_known_classes': num_history_known_classes})
         seg_total_loss, seg_losses_log_dict = self.segmentor.module.calculateseglosses(
-            seg_logits=outputs['seg_logits'], seg_targets=seg_targets, losses_cfgs=seg_losses_cfgs,
+            seg_logits=outputs['seg_logits'], seg_targets=seg_targets, loss_plan=self.seg_loss_plan,
         )
         # calculate distillation losses
         kd_total_loss, kd_losses_log_dict = 0, {}
@@ -50,7 +53,7 @@ class MIBRunner(BaseRunner):
         loss_total = kd_total_loss + seg_total_loss
         seg_losses_log_dict.update(kd_losses_log_dict)
         seg_losses_log_dict.pop('loss_total')
-        seg_losses_log_dict['loss_total'] = loss_total.item()
+        seg_losses_log_dict['loss_total'] = loss_total.detach()
         # return
         return loss_total, seg_losses_log_dict
     '''featuresdistillation'''
@@ -71,7 +74,5 @@ class MIBRunner(BaseRunner):
         else:
             loss = -loss
         loss = loss * scale_factor
-        value = loss.data.clone()
-        dist.all_reduce(value.div_(dist.get_world_size()))
-        kd_losses_log_dict = {'loss_kd': value.item()}
+        kd_losses_log_dict = {'loss_kd': loss.detach()}
         return loss, kd_losses_log_dict
\ No newline at end of file
@@ -9,9 +9,9 @@ import math
 import torch
 import functools
 import torch.nn.functional as F
-import torch.distributed as dist
 from tqdm import tqdm
 from .base import BaseRunner
+from ..models import LossPlan
 
 
 '''PLOPRunner'''
@@ -20,10 +20,22 @@ class PLOPRunner(BaseRunner):
         super(PLOPRunner, self).__init__(
             mode=mode, cmd_args=cmd_args, runner_cfg=runner_cfg
         )
+    '''requiresteacherfeatures'''
+    def requiresteacherfeatures(self):
+        # the pseudo labeling only needs the teacher logits, the pod distillation needs the teacher features
+        return self.losses_cfgs['distillation'].get('scale_factor', 1.0) > 0
+    '''buildteacherstore'''
+    def buildteacherstore(self, teacher_store_cfg, state_dict, **kwargs):
+        return super(PLOPRunner, self).buildteacherstore(teacher_store_cfg, state_dict, entropy_fn=self.entropy, **kwargs)
+    '''buildseglossplan'''
+    def buildseglossplan(self):
+        # the classifier adaptive factor is passed as scale_factor at every iteration
+        losses_cfgs = self.losses_cfgs['segmentation_cl'] if self.history_segmentor is not None else self.losses_cfgs['segmentation_init']
+        return LossPlan(losses_cfgs, scale_factor=1.0, reduction='none')
     '''call'''
     def __call__(self, images, seg_targets):
         # initialize
-        losses_cfgs = copy.deepcopy(self.losses_cfgs)
+        losses_cfgs = self.losses_cfgs
         if self.history_segmentor is not None:
             thresholds, max_entropy = self.thresholds, self.max_entropy
         seg_targets_mergepseudolabels = seg_targets.clone()
@@ -33,13 +45,12 @@ class PLOPRunner(BaseRunner):
             num_history_known_classes = functools.reduce(lambda a, b: a + b, self.runner_cfg['segmentor_cfg']['num_known_classes_list'][:-1])
             with torch.no_grad():
                 history_outputs = self.history_segmentor(images)
-                history_distillation_feats = history_outputs['distillation_feats']
-                history_distillation_feats.append(history_outputs['seg_logits'])
-                history_seg_logits = F.interpolate(history_outputs['seg_logits'], size=images.shape[2:], mode="bilinear", align_corners=self.segmentor.module.align_corners)
+                if self.teacher_store is None:
+                    history_distillation_feats = history_outputs['distillation_feats']
+                    history_distillation_feats.append(history_outputs['seg_logits'])
             background_mask = (seg_targets < num_history_known_classes)
-            history_seg_probs = torch.softmax(history_seg_logits, dim=1)
-            max_history_seg_probs, pseudo_labels = history_seg_probs.max(dim=1)
-            valid_pseudo_mask = (self.entropy(history_seg_probs) / max_entropy) < thresholds[pseudo_labels]
+            pseudo_labels, history_seg_entropy = self.pseudolabeling(history_outputs, images.shape[2:])
+            valid_pseudo_mask = (history_seg_entropy / max_entropy) < thresholds[pseudo_labels]
             seg_targets_mergepseudolabels[~valid_pseudo_mask & background_mask] = 255
             seg_targets_mergepseudolabels[valid_pseudo_mask & background_mask] = pseudo_labels[valid_pseudo_mask & background_mask]
             classifier_adaptive_factor = (valid_pseudo_mask & background_mask).float().sum(dim=(1, 2)) / (background_mask.float().sum(dim=(1, 2)) + self.eps)
@@ -47,16 +58,12 @@ class PLOPRunner(BaseRunner):
         # feed to segmentor
         outputs = self.segmentor(images)
         # calculate segmentation losses
-        seg_losses_cfgs = copy.deepcopy(losses_cfgs['segmentation_cl']) if self.history_segmentor is not None else copy.deepcopy(losses_cfgs['segmentation_init'])
-        for _, seg_losses_cfg in seg_losses_cfgs.items():
-            for loss_type, loss_cfg in seg_losses_cfg.items():
-                loss_cfg.update({'scale_factor': classifier_adaptive_factor, 'reduction': 'none'})
         seg_total_loss, seg_losses_log_dict = self.segmentor.module.calculateseglosses(
-            seg_logits=outputs['seg_logits'], seg_targets=seg_targets_mergepseudolabels, losses_cfgs=seg_losses_cfgs,
+            seg_logits=outputs['seg_logits'], seg_targets=seg_targets_mergepseudolabels, loss_plan=self.seg_loss_plan, scale_factor=classifier_adaptive_factor,
         )
         # calculate distillation losses
         pod_total_loss, pod_losses_log_dict = 0, {}
-        if self.history_segmentor is not None:
+        if self.history_segmentor is not None and self.teacher_store is None:
             distillation_feats = outputs['distillation_feats']
             distillation_feats.append(outputs['seg_logits'])
             pod_total_loss, pod_losses_log_dict = self.featuresdistillation(
@@ -67,7 +74,7 @@ class PLOPRunner(BaseRunner):
         loss_total = pod_total_loss + seg_total_loss
         seg_losses_log_dict.update(pod_losses_log_dict)
         seg_losses_log_dict.pop('loss_total')
-        seg_losses_log_dict['loss_total'] = loss_total.item()
+        seg_losses_log_dict['loss_total'] = loss_total.detach()
         # return
         return loss_total, seg_losses_log_dict
     '''actionsbeforetask'''
@@ -87,14 +94,10 @@ class PLOPRunner(BaseRunner):
             train_loader = tqdm(train_loader)
             train_loader.set_description('Find Pseudo Labeling Median')
         for batch_idx, data_meta in enumerate(train_loader):
-            images = data_meta['image'].to(self.device, dtype=torch.float32)
-            seg_targets = data_meta['seg_target'].to(self.device, dtype=torch.long)
-            seg_logits = self.history_segmentor(images)['seg_logits']
-            seg_logits = F.interpolate(seg_logits, size=images.shape[2:], mode="bilinear", align_corners=self.segmentor.module.align_corners)
+            images, seg_targets = self.fetchdata(data_meta, self.train_loader)
+            pseudo_labels, seg_entropy = self.pseudolabeling(self.history_segmentor(images), images.shape[2:])
             background_mask = (seg_targets == 0)
-            seg_probs = torch.softmax(seg_logits, dim=1)
-            max_seg_probs, pseudo_labels = seg_probs.max(dim=1)
-            values_to_bins = self.entropy(seg_probs)[background_mask].view(-1) / max_value
+            values_to_bins = seg_entropy[background_mask].view(-1) / max_value
             x_coords = pseudo_labels[background_mask].view(-1)
             y_coords = torch.clamp((values_to_bins * num_bins).long(), max=num_bins - 1)
             histograms.index_put_((x_coords, y_coords), torch.LongTensor([1]).expand_as(x_coords).to(histograms.device), accumulate=True)
@@ -119,6 +122,15 @@ class PLOPRunner(BaseRunner):
             thresholds[cls_id] = max(thresholds[cls_id], pseudolabeling_minimal_threshold)
         # return
         return thresholds.to(self.device), max_value
+    '''pseudolabeling'''
+    def pseudolabeling(self, history_outputs, size):
+        # a teacher store with pseudo labels has computed them once per training image
+        if 'pseudo_labels' in history_outputs:
+            return history_outputs['pseudo_labels'], history_outputs['entropy']
+        history_seg_logits = F.interpolate(history_outputs['seg_logits'], size=size, mode="bilinear", align_corners=self.segmentor.module.align_corners)
+        history_seg_probs = torch.softmax(history_seg_logits, dim=1)
+        max_history_seg_probs, pseudo_labels = history_seg_probs.max(dim=1)
+        return pseudo_labels, self.entropy(history_seg_probs)
     '''entropy'''
     @staticmethod
     def entropy(probabilities, eps=1e-8):
@@ -157,9 +169,7 @@ class PLOPRunner(BaseRunner):
             loss += layer_loss
         # summarize and return
         pod_total_loss = loss / len(history_distillation_feats) * scale_factor
-        value = pod_total_loss.data.clone()
-        dist.all_reduce(value.div_(dist.get_world_size()))
-        pod_losses_log_dict = {'loss_pod': value.item()}
+        pod_losses_log_dict = {'loss_pod': pod_total_loss.detach()}
         return pod_total_loss, pod_losses_log_dict
     '''localpod'''
     @staticmethod
@@ -4,15 +4,14 @@ Function:
 Author:
     Zhenchao Jin
 '''
-import copy
 import math
 import torch
 import functools
 import torch.nn as nn
 import torch.nn.functional as F
-import torch.distributed as dist
 from .mib import MIBRunner
 from .base import BaseRunner
+from ..models import LossPlan
 
 
 '''RCILRunner'''
@@ -21,6 +20,15 @@ class RCILRunner(BaseRunner):
         super(RCILRunner, self).__init__(
             mode=mode, cmd_args=cmd_args, runner_cfg=runner_cfg
         )
+    '''requiresteacherfeatures'''
+    def requiresteacherfeatures(self):
+        # the mib distillation only needs the teacher logits, the pod distillation needs the teacher features
+        return self.losses_cfgs['distillation_rcil'].get('scale_factor', 1.0) > 0
+    '''buildseglossplan'''
+    def buildseglossplan(self):
+        if self.history_segmentor is None: return super(RCILRunner, self).buildseglossplan()
+        num_history_known_classes = functools.reduce(lambda a, b: a + b, self.runner_cfg['segmentor_cfg']['num_known_classes_list'][:-1])
+        return LossPlan(self.losses_cfgs['segmentation_cl'], num_history_known_classes=num_history_known_classes)
     '''convertsegmentors'''
     def convertsegmentors(self):
         # merge
@@ -106,12 +114,11 @@ class RCILRunner(BaseRunner):
     '''train'''
     def train(self, cur_epoch):
         # initialize
-        losses_cfgs = copy.deepcopy(self.losses_cfgs)
+        losses_cfgs = self.losses_cfgs
         init_losses_log_dict = {
             'algorithm': self.runner_cfg['algorithm'], 'task_id': self.runner_cfg['task_id'],
-            'epoch': self.scheduler.cur_epoch, 'iteration': self.scheduler.cur_iter, 'lr': self.scheduler.cur_lr
+            'epoch': self.scheduler.cur_epoch, 'iteration': self.scheduler.cur_iter, 'lr': self.scheduler.lr
         }
-        losses_log_dict = copy.deepcopy(init_losses_log_dict)
         self.segmentor.train()
         self.train_loader.sampler.set_epoch(cur_epoch)
         if self.runner_cfg['task_id'] > 0:
@@ -131,31 +138,25 @@ class RCILRunner(BaseRunner):
         # start to iter
         for batch_idx, data_meta in enumerate(self.train_loader):
             # --fetch data
-            images = data_meta['image'].to(self.device, dtype=torch.float32)
-            seg_targets = data_meta['seg_target'].to(self.device, dtype=torch.long)
+            images, seg_targets = self.fetchdata(data_meta, self.train_loader)
             # --feed to history_segmentor
             if self.history_segmentor is not None:
                 with torch.no_grad():
                     history_outputs = self.history_segmentor(images)
-                    history_distillation_feats = history_outputs['distillation_feats']
-                    history_distillation_feats.append(history_outputs['seg_logits'])
+                    if self.teacher_store is None:
+                        history_distillation_feats = history_outputs['distillation_feats']
+                        history_distillation_feats.append(history_outputs['seg_logits'])
             # --forward to segmentor
             outputs = self.segmentor(images)
             # --calculate segmentation losses
-            seg_losses_cfgs = copy.deepcopy(losses_cfgs['segmentation_cl']) if self.history_segmentor is not None else copy.deepcopy(losses_cfgs['segmentation_init'])
-            if self.history_segmentor is not None:
-                num_history_known_classes = functools.reduce(lambda a, b: a + b, self.runner_cfg['segmentor_cfg']['num_known_classes_list'][:-1])
-                for _, seg_losses_cfg in seg_losses_cfgs.items():
-                    for loss_type, loss_cfg in seg_losses_cfg.items():
-                        loss_cfg.update({'num_history_known_classes': num_history_known_classes})
             seg_total_loss, seg_losses_log_dict = self.segmentor.module.calculateseglosses(
                 seg_logits=outputs['seg_logits'], 
                 seg_targets=seg_targets, 
-                losses_cfgs=seg_losses_cfgs,
+                loss_plan=self.seg_loss_plan,
             )
             # --calculate pod distillation losses
             pod_total_loss, pod_losses_log_dict = 0, {}
-            if self.history_segmentor is not None:
+            if self.history_segmentor is not None and self.teacher_store is None:
                 distillation_feats = outputs['distillation_feats']
                 distillation_feats.append(outputs['seg_logits'])
                 pod_total_loss, pod_losses_log_dict = self.featuresdistillation(
@@ -185,16 +186,14 @@ class RCILRunner(BaseRunner):
             seg_losses_log_dict.update(pod_losses_log_dict)
             seg_losses_log_dict.update(kd_losses_log_dict)
             seg_losses_log_dict.pop('loss_total')
-            seg_losses_log_dict['loss_total'] = loss_total.item()
-            losses_log_dict = self.loggingtraininginfo(seg_losses_log_dict, losses_log_dict, init_losses_log_dict)
+            seg_losses_log_dict['loss_total'] = loss_total.detach()
+            self.loggingtraininginfo(seg_losses_log_dict, init_losses_log_dict, {'epoch': self.scheduler.cur_epoch, 'iteration': self.scheduler.cur_iter, 'lr': self.scheduler.lr})
     '''featuresdistillation'''
     def featuresdistillation(self, history_distillation_feats, distillation_feats, num_known_classes_list=None, dataset_type='VOCDataset', scale_factor=1.0, spp_scales=[4, 8, 12, 16, 20, 24]):
         pod_total_loss = self.featuresdistillationchannel(history_distillation_feats, distillation_feats, num_known_classes_list, dataset_type) + \
             self.featuresdistillationspatial(history_distillation_feats, distillation_feats, num_known_classes_list, dataset_type, spp_scales)
         pod_total_loss = pod_total_loss * scale_factor
-        value = pod_total_loss.data.clone()
-        dist.all_reduce(value.div_(dist.get_world_size()))
-        pod_losses_log_dict = {'loss_pod': value.item()}
+        pod_losses_log_dict = {'loss_pod': pod_total_loss.detach()}
         return pod_total_loss, pod_losses_log_dict
     '''featuresdistillationchannel'''
     @staticmethod
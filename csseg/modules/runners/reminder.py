@@ -4,7 +4,6 @@ Function:
 Author:
     Zhenchao Jin
 '''
-import copy
 import torch
 import functools
 import torch.nn.functional as F
@@ -18,15 +17,18 @@ class REMINDERRunner(PLOPRunner):
         super(REMINDERRunner, self).__init__(
             mode=mode, cmd_args=cmd_args, runner_cfg=runner_cfg
         )
+    '''requiresteacherfeatures'''
+    def requiresteacherfeatures(self):
+        # the training loop distills the teacher features whatever the pod scale_factor is
+        return True
     '''train'''
     def train(self, cur_epoch):
         # initialize
-        losses_cfgs = copy.deepcopy(self.losses_cfgs)
+        losses_cfgs = self.losses_cfgs
         init_losses_log_dict = {
             'algorithm': self.runner_cfg['algorithm'], 'task_id': self.runner_cfg['task_id'],
-            'epoch': self.scheduler.cur_epoch, 'iteration': self.scheduler.cur_iter, 'lr': self.scheduler.cur_lr
+            'epoch': self.scheduler.cur_epoch, 'iteration': self.scheduler.cur_iter, 'lr': self.scheduler.lr
         }
-        losses_log_dict = copy.deepcopy(init_losses_log_dict)
         self.segmentor.train()
         self.train_loader.sampler.set_epoch(cur_epoch)
         if self.history_segmentor is not None:
@@ -34,8 +36,7 @@ class REMINDERRunner(PLOPRunner):
         # start to iter
         for batch_idx, data_meta in enumerate(self.train_loader):
             # --fetch data
-            images = data_meta['image'].to(self.device, dtype=torch.float32)
-            seg_targets = data_meta['seg_target'].to(self.device, dtype=torch.long)
+            images, seg_targets = self.fetchdata(data_meta, self.train_loader)
             seg_targets_mergepseudolabels = seg_targets.clone()
             # --pseudo labeling
             classifier_adaptive_factor = 1.0
@@ -57,14 +58,10 @@ class REMINDERRunner(PLOPRunner):
             # --forward to segmentor
             outputs = self.segmentor(images)
             # --calculate segmentation losses
-            seg_losses_cfgs = copy.deepcopy(losses_cfgs['segmentation_cl']) if self.history_segmentor is not None else copy.deepcopy(losses_cfgs['segmentation_init'])
-            for _, seg_losses_cfg in seg_losses_cfgs.items():
-                for loss_type, loss_cfg in seg_losses_cfg.items():
-                    loss_cfg.update({'scale_factor': classifier_adaptive_factor, 'reduction': 'none'})
             seg_total_loss, seg_losses_log_dict = self.segmentor.module.calculateseglosses(
                 seg_logits=outputs['seg_logits'], 
                 seg_targets=seg_targets_mergepseudolabels, 
-                losses_cfgs=seg_losses_cfgs,
+                loss_plan=self.seg_loss_plan, scale_factor=classifier_adaptive_factor,
             )
             # --calculate distillation losses
             pod_total_loss, pod_losses_log_dict = 0, {}
@@ -94,8 +91,8 @@ class REMINDERRunner(PLOPRunner):
             # --logging training loss info
             seg_losses_log_dict.update(pod_losses_log_dict)
             seg_losses_log_dict.pop('loss_total')
-            seg_losses_log_dict['loss_total'] = loss_total.item()
-            losses_log_dict = self.loggingtraininginfo(seg_losses_log_dict, losses_log_dict, init_losses_log_dict)
+            seg_losses_log_dict['loss_total'] = loss_total.detach()
+            self.loggingtraininginfo(seg_losses_log_dict, init_losses_log_dict, {'epoch': self.scheduler.cur_epoch, 'iteration': self.scheduler.cur_iter, 'lr': self.scheduler.lr})
     '''cswfeaturesdistillation'''
     @staticmethod
     def cswfeaturesdistillation(logits_source, logits_target, seg_targets_mergepseudolabels, prototypes, temperature=3, delta=0.0, history_prototypes=None):
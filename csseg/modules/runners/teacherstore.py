@@ -0,0 +1,195 @@
+'''
+Function:
+    Implementation of TeacherOutputStore, i.e., teacher outputs computed once per training image and replayed through the augmentations
+Author:
+    Zhenchao Jin
+'''
+import os
+import json
+import torch
+import hashlib
+import numpy as np
+import torch.nn.functional as F
+import torch.distributed as dist
+from PIL import Image
+from tqdm import tqdm
+from .asynceval import hashcheckpoint
+
+
+'''TeacherStoreDataset'''
+class TeacherStoreDataset(torch.utils.data.Dataset):
+    def __init__(self, data_generator, records, canonical_size):
+        # set attributes
+        self.data_generator = data_generator
+        self.records = records
+        self.canonical_size = canonical_size
+    '''getitem'''
+    def __getitem__(self, index):
+        record = self.records[index]
+        _, image, seg_target = self.data_generator.dataset.read(self.data_generator.indices[record], draft=False)
+        # the source indices refer to seg_target, so its size is the reference and the long side is resized to canonical_size
+        reference_width, reference_height = seg_target.size
+        scale = self.canonical_size / max(reference_width, reference_height)
+        resized_width, resized_height = max(int(round(reference_width * scale)), 1), max(int(round(reference_height * scale)), 1)
+        canvas = np.zeros((self.canonical_size, self.canonical_size, 3), dtype=np.uint8)
+        canvas[:resized_height, :resized_width] = np.array(image.resize((resized_width, resized_height), Image.BILINEAR), dtype=np.uint8)
+        return {
+            'image': torch.from_numpy(canvas).permute(2, 0, 1).contiguous(), 'record': record,
+            'size': torch.tensor([reference_height, reference_width, resized_height, resized_width], dtype=torch.int64),
+        }
+    '''len'''
+    def __len__(self):
+        return len(self.records)
+
+
+'''TeacherOutputStore'''
+class TeacherOutputStore():
+    def __init__(self, store_prefix, imageids, align_corners=False):
+        meta = np.load(f'{store_prefix}_meta.npz')
+        # set attributes
+        self.store_prefix = store_prefix
+        self.align_corners = align_corners
+        self.num_classes, self.canonical_size, self.topk, self.outputs = int(meta['num_classes']), int(meta['canonical_size']), int(meta['topk']), str(meta['outputs'])
+        if self.outputs == 'logits':
+            self.values = np.load(f'{store_prefix}_values.npy', mmap_mode='r')
+            # the class indices are only stored if some classes are dropped
+            self.indices = np.load(f'{store_prefix}_indices.npy', mmap_mode='r') if self.topk < self.num_classes else None
+        else:
+            self.labels = np.load(f'{store_prefix}_labels.npy', mmap_mode='r')
+            self.entropy = np.load(f'{store_prefix}_entropy.npy', mmap_mode='r')
+        self.sizes = np.load(f'{store_prefix}_sizes.npy', mmap_mode='r')
+        self.records = {imageid: record for record, imageid in enumerate(imageids)}
+        self.batch_records, self.batch_source_index = None, None
+    '''setbatch'''
+    def setbatch(self, data_meta, device):
+        self.batch_records = np.array([self.records[imageid] for imageid in data_meta['imageid']], dtype=np.int64)
+        self.batch_source_index = data_meta['source_index'].to(device, non_blocking=True)
+    '''call'''
+    def __call__(self, images, **kwargs):
+        assert self.batch_source_index is not None and self.batch_source_index.shape[-2:] == images.shape[-2:], 'setbatch should be called with the batch of images'
+        if self.outputs == 'pseudolabels':
+            pseudo_labels, entropy = self.replaypseudolabels(self.batch_records, self.batch_source_index)
+            return {'pseudo_labels': pseudo_labels, 'entropy': entropy}
+        return {'seg_logits': self.replay(self.batch_records, self.batch_source_index)}
+    '''replay'''
+    @torch.no_grad()
+    def replay(self, records, source_index):
+        device = source_index.device
+        seg_logits = torch.from_numpy(np.ascontiguousarray(self.values[records])).to(device).float()
+        # classes outside the top-k take the smallest stored logit of their pixel
+        if self.indices is not None:
+            indices = torch.from_numpy(self.indices[records].astype(np.int64)).to(device)
+            values, seg_logits = seg_logits, seg_logits.amin(dim=1, keepdim=True).expand(-1, self.num_classes, -1, -1).contiguous()
+            seg_logits.scatter_(1, indices, values)
+        grid, valid_mask = self.buildgrid(records, source_index)
+        seg_logits = F.grid_sample(seg_logits, grid, mode='bilinear', padding_mode='border', align_corners=self.align_corners)
+        # padded pixels have no source, they get uniform logits
+        return seg_logits.masked_fill(~valid_mask.unsqueeze(1), 0.)
+    '''replaypseudolabels'''
+    @torch.no_grad()
+    def replaypseudolabels(self, records, source_index):
+        device = source_index.device
+        pseudo_labels = torch.from_numpy(np.ascontiguousarray(self.labels[records])).to(device).float().unsqueeze(1)
+        entropy = torch.from_numpy(np.ascontiguousarray(self.entropy[records])).to(device).float().unsqueeze(1)
+        grid, valid_mask = self.buildgrid(records, source_index)
+        # the labels are taken from the nearest output pixel, the entropy is interpolated like the logits
+        pseudo_labels = F.grid_sample(pseudo_labels, grid, mode='nearest', padding_mode='border', align_corners=self.align_corners).squeeze(1).long()
+        entropy = F.grid_sample(entropy, grid, mode='bilinear', padding_mode='border', align_corners=self.align_corners).squeeze(1)
+        # padded pixels have no source, their infinite entropy rejects the pseudo label
+        return pseudo_labels.masked_fill(~valid_mask, 0), entropy.masked_fill(~valid_mask, float('inf'))
+    '''buildgrid'''
+    def buildgrid(self, records, source_index):
+        sizes = torch.from_numpy(np.ascontiguousarray(self.sizes[records])).to(source_index.device)
+        # source indices -> pixels of seg_target -> pixels of the canonical canvas the teacher has seen
+        source_index = source_index.long() - 1
+        valid_mask = (source_index >= 0)
+        source_index = source_index.clamp(min=0)
+        reference_height, reference_width, resized_height, resized_width = [s.view(-1, 1, 1) for s in sizes.unbind(dim=1)]
+        ys, xs = (source_index // reference_width).float(), (source_index % reference_width).float()
+        ys = (ys + 0.5) * resized_height / reference_height - 0.5
+        xs = (xs + 0.5) * resized_width / reference_width - 0.5
+        # same sampling positions as the bilinear upsampling of the teacher logits to the canvas
+        if self.align_corners:
+            grid = torch.stack([2 * xs / (self.canonical_size - 1) - 1, 2 * ys / (self.canonical_size - 1) - 1], dim=-1)
+        else:
+            grid = torch.stack([2 * (xs + 0.5) / self.canonical_size - 1, 2 * (ys + 0.5) / self.canonical_size - 1], dim=-1)
+        return grid, valid_mask
+    '''fromsegmentor'''
+    @classmethod
+    def fromsegmentor(cls, segmentor, data_generator, normalize, state_dict, store_dir, canonical_size=512, topk=16, outputs='logits', entropy_fn=None, batch_size=8, num_workers=4, device=None, align_corners=False, **forward_kwargs):
+        assert outputs in ['logits', 'pseudolabels']
+        assert outputs == 'logits' or entropy_fn is not None, 'pseudolabels are only stored for runners with entropy-based pseudo labeling, i.e., PLOP'
+        # decoded once, the manifest decodes all the imageids on every access
+        imageids = data_generator.dataset.imageids
+        imageids = [str(imageids[index]) for index in data_generator.indices]
+        # key the store by the teacher weights, the training images and how the outputs are produced
+        key = hashlib.sha1(json.dumps({
+            'teacher': hashcheckpoint(state_dict), 'imageids': imageids, 'canonical_size': canonical_size, 'topk': topk, 'outputs': outputs, 'forward_kwargs': forward_kwargs,
+        }, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        store_prefix = os.path.join(store_dir, f'teacherstore_{key}')
+        if not os.path.exists(f'{store_prefix}_meta.npz'):
+            os.makedirs(store_dir, exist_ok=True)
+            cls.materialize(segmentor, data_generator, normalize, store_prefix, canonical_size, topk, outputs, entropy_fn, batch_size, num_workers, device, **forward_kwargs)
+        return cls(store_prefix, imageids, align_corners=align_corners)
+    '''materialize'''
+    @staticmethod
+    @torch.no_grad()
+    def materialize(segmentor, data_generator, normalize, store_prefix, canonical_size, topk, outputs, entropy_fn, batch_size, num_workers, device, **forward_kwargs):
+        is_distributed = dist.is_available() and dist.is_initialized()
+        rank, world_size = (dist.get_rank(), dist.get_world_size()) if is_distributed else (0, 1)
+        num_samples = len(data_generator.indices)
+        # ranks run their slices without DDP, they would issue unequal numbers of collectives otherwise
+        segmentor = getattr(segmentor, 'module', segmentor)
+        # the output size is probed on an empty canvas, so that rank 0 can create the memory maps before any rank writes
+        seg_logits = segmentor(normalize(torch.zeros((1, 3, canonical_size, canonical_size), dtype=torch.uint8, device=device)), **forward_kwargs)['seg_logits']
+        num_classes, output_size = seg_logits.shape[1], tuple(seg_logits.shape[2:])
+        assert num_classes <= 256, 'class indices are stored as uint8'
+        topk = num_classes if topk is None else min(topk, num_classes)
+        # with all the classes kept, the logits are stored in class order and the indices are not needed
+        shapes = {'values': ((num_samples, topk) + output_size, np.float16), 'indices': ((num_samples, topk) + output_size, np.uint8)}
+        if outputs == 'pseudolabels':
+            shapes = {'labels': ((num_samples,) + output_size, np.uint8), 'entropy': ((num_samples,) + output_size, np.float16)}
+        elif topk == num_classes:
+            shapes.pop('indices')
+        shapes['sizes'] = ((num_samples, 4), np.int64)
+        names = list(shapes.keys())
+        if rank == 0:
+            for name, (shape, dtype) in shapes.items():
+                np.lib.format.open_memmap(f'{store_prefix}_{name}.npy.tmp', mode='w+', dtype=dtype, shape=shape).flush()
+        if is_distributed:
+            dist.barrier()
+        arrays = {name: np.lib.format.open_memmap(f'{store_prefix}_{name}.npy.tmp', mode='r+') for name in names}
+        # run the teacher once per training image, each rank writes its own rows
+        dataloader = torch.utils.data.DataLoader(
+            TeacherStoreDataset(data_generator, list(range(num_samples))[rank::world_size], canonical_size), batch_size=batch_size, num_workers=num_workers, shuffle=False,
+        )
+        if rank == 0:
+            dataloader = tqdm(dataloader)
+            dataloader.set_description('Materializing Teacher Outputs')
+        for data_meta in dataloader:
+            seg_logits = segmentor(normalize(data_meta['image'].to(device, non_blocking=True)), **forward_kwargs)['seg_logits'].float()
+            records = data_meta['record'].numpy()
+            if outputs == 'pseudolabels':
+                seg_probs = torch.softmax(seg_logits, dim=1)
+                arrays['labels'][records] = seg_probs.argmax(dim=1).to(torch.uint8).cpu().numpy()
+                arrays['entropy'][records] = entropy_fn(seg_probs).half().cpu().numpy()
+            elif 'indices' in arrays:
+                topk_values, topk_indices = seg_logits.topk(topk, dim=1)
+                arrays['values'][records] = topk_values.half().cpu().numpy()
+                arrays['indices'][records] = topk_indices.to(torch.uint8).cpu().numpy()
+            else:
+                arrays['values'][records] = seg_logits.half().cpu().numpy()
+            arrays['sizes'][records] = data_meta['size'].numpy()
+        for array in arrays.values(): array.flush()
+        del arrays
+        if is_distributed:
+            dist.barrier()
+        if rank == 0:
+            for name in names:
+                os.replace(f'{store_prefix}_{name}.npy.tmp', f'{store_prefix}_{name}.npy')
+            with open(f'{store_prefix}_meta.npz.tmp', 'wb') as fp:
+                np.savez(fp, num_classes=num_classes, canonical_size=canonical_size, topk=topk, outputs=outputs)
+            os.replace(f'{store_prefix}_meta.npz.tmp', f'{store_prefix}_meta.npz')
+        if is_distributed:
+            dist.barrier()
+        return True
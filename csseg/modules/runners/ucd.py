@@ -4,11 +4,9 @@ Function:
 Author:
     Zhenchao Jin
 '''
-import copy
 import torch
 import functools
 import torch.nn.functional as F
-import torch.distributed as dist
 from .mib import MIBRunner
 
 
@@ -18,22 +16,28 @@ class UCDMIBRunner(MIBRunner):
         super(UCDMIBRunner, self).__init__(
             mode=mode, cmd_args=cmd_args, runner_cfg=runner_cfg
         )
+    '''buildfrozenteacher'''
+    def buildfrozenteacher(self, frozen_teacher_cfg, **forward_kwargs):
+        # the history segmentor is called with task_id, so the decoder outputs are checked as well
+        return super(UCDMIBRunner, self).buildfrozenteacher(frozen_teacher_cfg, task_id=self.runner_cfg['task_id'], **forward_kwargs)
+    '''requiresteacherfeatures'''
+    def requiresteacherfeatures(self):
+        # the contrastive learning needs the decoder outputs of the teacher
+        return True
     '''train'''
     def train(self, cur_epoch):
         # initialize
-        losses_cfgs = copy.deepcopy(self.losses_cfgs)
+        losses_cfgs = self.losses_cfgs
         init_losses_log_dict = {
             'algorithm': self.runner_cfg['algorithm'], 'task_id': self.runner_cfg['task_id'],
-            'epoch': self.scheduler.cur_epoch, 'iteration': self.scheduler.cur_iter, 'lr': self.scheduler.cur_lr
+            'epoch': self.scheduler.cur_epoch, 'iteration': self.scheduler.cur_iter, 'lr': self.scheduler.lr
         }
-        losses_log_dict = copy.deepcopy(init_losses_log_dict)
         self.segmentor.train()
         self.train_loader.sampler.set_epoch(cur_epoch)
         # start to iter
         for batch_idx, data_meta in enumerate(self.train_loader):
             # --fetch data
-            images = data_meta['image'].to(self.device, dtype=torch.float32)
-            seg_targets = data_meta['seg_target'].to(self.device, dtype=torch.long)
+            images, seg_targets = self.fetchdata(data_meta, self.train_loader)
             # --feed to history_segmentor
             if self.history_segmentor is not None:
                 with torch.no_grad():
@@ -41,16 +45,10 @@ class UCDMIBRunner(MIBRunner):
             # --forward to segmentor
             outputs = self.segmentor(images, task_id=self.runner_cfg['task_id'])
             # --calculate segmentation losses
-            seg_losses_cfgs = copy.deepcopy(losses_cfgs['segmentation_cl']) if self.history_segmentor is not None else copy.deepcopy(losses_cfgs['segmentation_init'])
-            if self.history_segmentor is not None:
-                num_history_known_classes = functools.reduce(lambda a, b: a + b, self.runner_cfg['segmentor_cfg']['num_known_classes_list'][:-1])
-                for _, seg_losses_cfg in seg_losses_cfgs.items():
-                    for loss_type, loss_cfg in seg_losses_cfg.items():
-                        loss_cfg.update({'num_history_known_classes': num_history_known_classes})
             seg_total_loss, seg_losses_log_dict = self.segmentor.module.calculateseglosses(
                 seg_logits=outputs['seg_logits'], 
                 seg_targets=seg_targets, 
-                losses_cfgs=seg_losses_cfgs,
+                loss_plan=self.seg_loss_plan,
             )
             # --calculate distillation losses
             kd_total_loss, kd_losses_log_dict = 0, {}
@@ -81,8 +79,8 @@ class UCDMIBRunner(MIBRunner):
             seg_losses_log_dict.update(kd_losses_log_dict)
             seg_losses_log_dict.update(cl_losses_log_dict)
             seg_losses_log_dict.pop('loss_total')
-            seg_losses_log_dict['loss_total'] = loss_total.item()
-            losses_log_dict = self.loggingtraininginfo(seg_losses_log_dict, losses_log_dict, init_losses_log_dict)
+            seg_losses_log_dict['loss_total'] = loss_total.detach()
+            self.loggingtraininginfo(seg_losses_log_dict, init_losses_log_dict, {'epoch': self.scheduler.cur_epoch, 'iteration': self.scheduler.cur_iter, 'lr': self.scheduler.lr})
             # del outputs and perform empty_cache to save memory
             del outputs
             torch.cuda.empty_cache()
@@ -114,9 +112,7 @@ class UCDMIBRunner(MIBRunner):
         elif reduction == 'sum':
             loss = loss.sum()
         loss = loss * scale_factor
-        value = loss.data.clone()
-        dist.all_reduce(value.div_(dist.get_world_size()))
-        cl_losses_log_dict = {'loss_cl': value.item()}
+        cl_losses_log_dict = {'loss_cl': loss.detach()}
         return loss, cl_losses_log_dict
     '''preprocessforcontrastivelearning'''
     @staticmethod
@@ -1,5 +1,6 @@
 '''initialize'''
 from .misc import setrandomseed
+from .metrics import MetricsAccumulator
 from .env import EnvironmentCollector
 from .configparser import ConfigParser
 from .modulebuilder import BaseModuleBuilder
@@ -0,0 +1,39 @@
+'''
+Function:
+    Implementation of MetricsAccumulator
+Author:
+    Zhenchao Jin
+'''
+import torch
+import torch.distributed as dist
+
+
+'''MetricsAccumulator'''
+class MetricsAccumulator():
+    def __init__(self):
+        self.reset()
+    '''reset'''
+    def reset(self):
+        self.sums, self.counts = {}, {}
+    '''update'''
+    def update(self, metrics_dict):
+        # values stay on their device, nothing here forces a host sync
+        for key, value in metrics_dict.items():
+            value = value.detach() if torch.is_tensor(value) else value
+            self.sums[key] = self.sums[key] + value if key in self.sums else value
+            self.counts[key] = self.counts.get(key, 0) + 1
+    '''reduce'''
+    def reduce(self, device=None):
+        # every rank must call this with the same keys, the sums and counts are packed into one buffer for a single all-reduce
+        keys = sorted(self.sums.keys())
+        if not keys: return {}
+        if device is None:
+            device = next((value.device for value in self.sums.values() if torch.is_tensor(value)), torch.device('cpu'))
+        packed = torch.stack(
+            [torch.as_tensor(self.sums[key], device=device).to(torch.float64).reshape(()) for key in keys] +
+            [torch.tensor(float(self.counts[key]), dtype=torch.float64, device=device) for key in keys]
+        )
+        if dist.is_available() and dist.is_initialized(): dist.all_reduce(packed)
+        packed = packed.tolist()
+        self.reset()
+        return {key: packed[idx] / packed[idx + len(keys)] for idx, key in enumerate(keys)}
@@ -0,0 +1,83 @@
+'''
+Function:
+    Implementation of Predictor
+Author:
+    Zhenchao Jin
+'''
+import os
+import copy
+import torch
+import warnings
+import argparse
+import numpy as np
+from PIL import Image
+from modules import BuildSegmentor, BuildInferencer, BuildDataTransform, ConfigParser, loadckpts, touchdir
+warnings.filterwarnings('ignore')
+
+
+'''parsecmdargs'''
+def parsecmdargs():
+    parser = argparse.ArgumentParser(description='CSSegmentation: An Open Source Continual Semantic Segmentation Toolbox Based on PyTorch.')
+    parser.add_argument('--cfgfilepath', dest='cfgfilepath', help='config file path you want to load.', type=str, required=True)
+    parser.add_argument('--ckptspath', dest='ckptspath', help='checkpoints path you want to load.', type=str, required=True)
+    parser.add_argument('--imagepath', dest='imagepath', help='image path or directory of images you want to predict.', type=str, required=True)
+    parser.add_argument('--outputdir', dest='outputdir', help='directory to save the predictions.', type=str, default='predictions')
+    parser.add_argument('--device', dest='device', help='device used to predict.', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--windowsize', dest='windowsize', help='window size of the sliding-window inference.', type=int, default=512)
+    parser.add_argument('--stride', dest='stride', help='stride of the sliding-window inference.', type=int, default=341)
+    parser.add_argument('--maxwindowsperbatch', dest='maxwindowsperbatch', help='maximum number of windows fed to the segmentor at once.', type=int, default=16)
+    cmd_args = parser.parse_args()
+    return cmd_args
+
+
+'''Predictor'''
+class Predictor():
+    def __init__(self, cmd_args):
+        self.cmd_args = cmd_args
+        config_parser = ConfigParser()
+        self.cfg, _ = config_parser(cmd_args.cfgfilepath)
+    '''start'''
+    def start(self):
+        cmd_args, runner_cfg = self.cmd_args, self.cfg.RUNNER_CFG
+        device = torch.device(cmd_args.device)
+        # build segmentor, the known classes of the checkpoint are read from its classifiers
+        ckpts = loadckpts(cmd_args.ckptspath)
+        state_dict = {k[len('module.'):] if k.startswith('module.') else k: v for k, v in ckpts['segmentor'].items()}
+        segmentor_cfg = runner_cfg['segmentor_cfg'][ckpts['task_id']] if isinstance(runner_cfg['segmentor_cfg'], list) else runner_cfg['segmentor_cfg']
+        segmentor_cfg = copy.deepcopy(segmentor_cfg)
+        segmentor_cfg.pop('losses_cfgs')
+        segmentor_cfg['num_known_classes_list'] = [state_dict[f'convs_cls.{idx}.weight'].shape[0] for idx in range(ckpts['task_id'] + 1)]
+        segmentor = BuildSegmentor(segmentor_cfg=segmentor_cfg)
+        segmentor.load_state_dict(state_dict, strict=True)
+        segmentor = segmentor.to(device).eval()
+        # images keep their resolution, only ToTensor and Normalize of the test transforms are applied
+        dataset_cfg = runner_cfg['dataset_cfg'][ckpts['task_id']] if isinstance(runner_cfg['dataset_cfg'], list) else runner_cfg['dataset_cfg']
+        transforms = [BuildDataTransform({'type': 'ToTensor'})]
+        for transform_type, transform_cfg in dataset_cfg['test']['transforms']:
+            if transform_type == 'Normalize':
+                transforms.append(BuildDataTransform({'type': 'Normalize', **{k: v for k, v in transform_cfg.items() if k != 'on_device'}}))
+        inferencer = BuildInferencer({
+            'type': 'SlidingWindowInferencer', 'window_size': cmd_args.windowsize, 'stride': cmd_args.stride, 'max_windows_per_batch': cmd_args.maxwindowsperbatch, 'timing': True,
+        })
+        # predict
+        if os.path.isdir(cmd_args.imagepath):
+            imagepaths = [os.path.join(cmd_args.imagepath, name) for name in sorted(os.listdir(cmd_args.imagepath)) if os.path.splitext(name)[-1].lower() in ['.jpg', '.jpeg', '.png', '.bmp']]
+        else:
+            imagepaths = [cmd_args.imagepath]
+        touchdir(cmd_args.outputdir)
+        for imagepath in imagepaths:
+            data_meta = {'image': Image.open(imagepath).convert('RGB')}
+            for transform in transforms: data_meta = transform(data_meta)
+            seg_logits = inferencer(segmentor, data_meta['image'].unsqueeze(0).to(device))
+            seg_pred = seg_logits.max(dim=1)[1][0].cpu().numpy().astype(np.uint8)
+            savepath = os.path.join(cmd_args.outputdir, os.path.splitext(os.path.basename(imagepath))[0] + '.png')
+            Image.fromarray(seg_pred).save(savepath)
+            print(f'Prediction of {imagepath} is saved in {savepath}')
+        print(f'Predict {len(imagepaths)} images with {inferencer.num_windows} windows at {inferencer.windowspersecond():.2f} windows/s')
+
+
+'''main'''
+if __name__ == '__main__':
+    cmd_args = parsecmdargs()
+    predictor_client = Predictor(cmd_args=cmd_args)
+    predictor_client.start()
@@ -4,6 +4,7 @@ Function:
 Author:
     Zhenchao Jin
 '''
+import os
 import torch
 import warnings
 import argparse
@@ -18,7 +19,7 @@ def parsecmdargs():
     parser.add_argument('--local_rank', '--local-rank', dest='local_rank', help='node rank for distributed training.', default=0, type=int)
     parser.add_argument('--nproc_per_node', dest='nproc_per_node', help='number of processes per node.', default=4, type=int)
     parser.add_argument('--cfgfilepath', dest='cfgfilepath', help='config file path you want to load.', type=str, required=True)
-    parser.add_argument('--ckptspath', dest='ckptspath', help='checkpoints path you want to load.', type=str, required=True)
+    parser.add_argument('--ckptspath', dest='ckptspath', help='checkpoints path you want to load, several paths are evaluated in a single pass over the test set.', type=str, nargs='+', required=True)
     cmd_args = parser.parse_args()
     if torch.__version__.startswith('2.'):
         cmd_args.local_rank = int(os.environ['LOCAL_RANK'])
@@ -41,8 +42,11 @@ class Tester():
         torch.backends.cudnn.allow_tf32 = False
         torch.backends.cuda.matmul.allow_tf32 = False
         torch.backends.cudnn.benchmark = runner_cfg['benchmark']
+        # evaluate several checkpoints with a single pass over the test set
+        if len(cmd_args.ckptspath) > 1:
+            return self.startmulti()
         # load ckpts
-        ckpts = loadckpts(cmd_args.ckptspath)
+        ckpts = loadckpts(cmd_args.ckptspath[0])
         runner_cfg['task_id'] = ckpts['task_id']
         runner_client = BuildRunner(mode='TEST', cmd_args=cmd_args, runner_cfg=runner_cfg)
         runner_client.segmentor.load_state_dict(ckpts['segmentor'], strict=True)
@@ -50,6 +54,27 @@ class Tester():
         results = runner_client.test(cur_epoch=ckpts['cur_epoch'])
         if cmd_args.local_rank == 0:
             runner_client.logger_handle.info(results)
+    '''startmulti'''
+    def startmulti(self):
+        cmd_args, runner_cfg = self.cmd_args, self.cfg.RUNNER_CFG
+        # the test set of the latest task covers the label space of every checkpoint
+        ckpts_list = [loadckpts(ckptspath) for ckptspath in cmd_args.ckptspath]
+        runner_cfg['task_id'] = max([ckpts['task_id'] for ckpts in ckpts_list])
+        runner_client = BuildRunner(mode='TEST', cmd_args=cmd_args, runner_cfg=runner_cfg)
+        results_list = runner_client.testcheckpoints(ckpts_list)
+        if cmd_args.local_rank != 0: return
+        # write all results as one table
+        num_classes = runner_cfg['num_total_classes']
+        header = ['ckptspath', 'task_id', 'cur_epoch', 'all_accuracy', 'mean_accuracy', 'mean_iou'] + [f'iou_{c}' for c in range(num_classes)]
+        rows = []
+        for ckptspath, ckpts, results in zip(cmd_args.ckptspath, ckpts_list, results_list):
+            rows.append([ckptspath, ckpts['task_id'], ckpts.get('cur_epoch', -1), results['all_accuracy'], results['mean_accuracy'], results['mean_iou']] + [results['class_iou'][c] for c in range(num_classes)])
+            runner_client.logger_handle.info(f'Results of {ckptspath}: \n{results}')
+        tablepath = os.path.join(runner_cfg['work_dir'], 'multi_checkpoint_results.csv')
+        with open(tablepath, 'w') as fp:
+            fp.write(','.join(header) + '\n')
+            for row in rows: fp.write(','.join([str(v) for v in row]) + '\n')
+        runner_client.logger_handle.info(f'Results of {len(rows)} checkpoints are saved in {tablepath}')
 
 
 '''main'''
@@ -0,0 +1,56 @@
+'''
+Function:
+    Micro-benchmark of the PIL and cv2 data transform backends
+Author:
+    Zhenchao Jin
+'''
+import time
+import random
+import argparse
+import numpy as np
+from PIL import Image
+from csseg.modules.datasets.pipelines import BuildDataTransform
+
+
+'''TRANSFORM_SETTINGS'''
+TRANSFORM_SETTINGS = [
+    ('Resize', {'output_size': 512}),
+    ('CenterCrop', {'output_size': 512}),
+    ('Pad', {'padding': (16, 16)}),
+    ('RandomRotation', {'degrees': 10}),
+    ('RandomHorizontalFlip', {'prob': 1.0}),
+    ('RandomCrop', {'output_size': 256}),
+    ('RandomResizedCrop', {'output_size': 512, 'scale': (0.5, 1.0)}),
+    ('ColorJitter', {'brightness': 0.4, 'contrast': 0.4, 'saturation': 0.4, 'hue': 0.1}),
+]
+
+
+'''parsecmdargs'''
+def parsecmdargs():
+    parser = argparse.ArgumentParser(description='Compare the throughput of the PIL and cv2 data transform backends.')
+    parser.add_argument('--width', dest='width', help='width of the synthetic image.', type=int, default=500)
+    parser.add_argument('--height', dest='height', help='height of the synthetic image.', type=int, default=375)
+    parser.add_argument('--iters', dest='iters', help='number of calls for each transform.', type=int, default=200)
+    cmd_args = parser.parse_args()
+    return cmd_args
+
+
+'''benchmark'''
+def benchmark(transform, image, seg_target, iters):
+    start_time = time.perf_counter()
+    for _ in range(iters):
+        transform({'image': image, 'seg_target': seg_target})
+    return iters / (time.perf_counter() - start_time)
+
+
+'''run'''
+if __name__ == '__main__':
+    cmd_args = parsecmdargs()
+    random.seed(0)
+    image = np.random.randint(0, 256, size=(cmd_args.height, cmd_args.width, 3), dtype=np.uint8)
+    seg_target = np.random.randint(0, 21, size=(cmd_args.height, cmd_args.width), dtype=np.uint8)
+    print(f'{"transform":<24}{"pil (it/s)":>14}{"cv2 (it/s)":>14}{"speedup":>10}')
+    for transform_type, transform_cfg in TRANSFORM_SETTINGS:
+        pil_fps = benchmark(BuildDataTransform({'type': transform_type, **transform_cfg}), Image.fromarray(image), Image.fromarray(seg_target), cmd_args.iters)
+        cv2_fps = benchmark(BuildDataTransform({'type': f'CV{transform_type}', **transform_cfg}), image, seg_target, cmd_args.iters)
+        print(f'{transform_type:<24}{pil_fps:>14.1f}{cv2_fps:>14.1f}{cv2_fps / pil_fps:>9.2f}x')
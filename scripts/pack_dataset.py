@@ -0,0 +1,32 @@
+'''
+Function:
+    Scripts for packing a dataset split into memory-mapped shards
+Author:
+    Zhenchao Jin
+'''
+import os
+import argparse
+from csseg.modules.datasets.shards import packshards
+from csseg.modules.datasets.voc import _VOCDataset
+from csseg.modules.datasets.ade20k import _ADE20kDataset
+
+
+'''parsecmdargs'''
+def parsecmdargs():
+    parser = argparse.ArgumentParser(description='Pack a dataset split into shards for VOCShardDataset and ADE20kShardDataset.')
+    parser.add_argument('--dataset', dest='dataset', help='dataset type, support VOCDataset and ADE20kDataset.', type=str, required=True, choices=['VOCDataset', 'ADE20kDataset'])
+    parser.add_argument('--rootdir', dest='rootdir', help='root directory of the dataset.', type=str, required=True)
+    parser.add_argument('--set', dest='set', help='split to pack, e.g., trainaug and val for VOCDataset.', type=str, required=True)
+    parser.add_argument('--shard_dir', dest='shard_dir', help='output directory, default is ${rootdir}/shards/${set}.', type=str, default=None)
+    parser.add_argument('--max_shard_bytes', dest='max_shard_bytes', help='maximum size of each shard file.', type=int, default=1 << 30)
+    cmd_args = parser.parse_args()
+    return cmd_args
+
+
+'''run'''
+if __name__ == '__main__':
+    cmd_args = parsecmdargs()
+    data_generator_type = {'VOCDataset': _VOCDataset, 'ADE20kDataset': _ADE20kDataset}[cmd_args.dataset]
+    data_generator = data_generator_type('TEST', {'rootdir': cmd_args.rootdir, 'set': cmd_args.set})
+    shard_dir = cmd_args.shard_dir if cmd_args.shard_dir is not None else os.path.join(cmd_args.rootdir, 'shards', cmd_args.set)
+    print(f'Packed {len(data_generator)} samples into {packshards(data_generator, shard_dir, max_shard_bytes=cmd_args.max_shard_bytes)}')
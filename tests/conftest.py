@@ -0,0 +1,23 @@
+'''
+Function:
+    Pytest configuration, the tested modules are imported without the package roots that pull in the whole toolbox
+Author:
+    Zhenchao Jin
+'''
+import os
+import sys
+import types
+
+
+'''registerpackage'''
+def registerpackage(name):
+    # a bare package keeps the relative imports of its modules working without running its __init__.py
+    if name in sys.modules: return
+    package = types.ModuleType(name)
+    package.__path__ = [os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), *name.split('.'))]
+    sys.modules[name] = package
+
+
+'''register the package roots importing inplace_abn'''
+for name in ['csseg.modules', 'csseg.modules.models', 'csseg.modules.models.segmentors']:
+    registerpackage(name)
@@ -0,0 +1,124 @@
+'''
+Function:
+    Tests of the dataloaders
+Author:
+    Zhenchao Jin
+'''
+import time
+import torch
+import numpy as np
+from csseg.modules.parallel.dataloader import RingBufferDataLoader, BalancedDistributedEvalSampler, SizeBucketedBatchSampler
+
+
+'''IndexDataset'''
+class IndexDataset(torch.utils.data.Dataset):
+    def __init__(self, num_samples=10, size=8):
+        self.num_samples = num_samples
+        self.size = size
+    '''getitem'''
+    def __getitem__(self, index):
+        return {
+            'image': np.full((3, self.size, self.size), index, dtype=np.uint8), 'seg_target': np.full((self.size, self.size), index, dtype=np.uint8),
+            'width': self.size, 'height': self.size,
+        }
+    '''len'''
+    def __len__(self):
+        return self.num_samples
+
+
+'''SizedDataset'''
+class SizedDataset(torch.utils.data.Dataset):
+    def __init__(self, widths, heights):
+        self.widths, self.heights = np.asarray(widths), np.asarray(heights)
+    '''getimagesizes'''
+    def getimagesizes(self):
+        return self.widths, self.heights
+    '''len'''
+    def __len__(self):
+        return len(self.widths)
+
+
+'''PendingCopyEvent'''
+class PendingCopyEvent():
+    def __init__(self):
+        self.synchronized = False
+    '''query'''
+    def query(self):
+        return False
+    '''synchronize'''
+    def synchronize(self):
+        self.synchronized = True
+
+
+'''PendingCopyRingBufferDataLoader'''
+class PendingCopyRingBufferDataLoader(RingBufferDataLoader):
+    '''recordcopyevent'''
+    def recordcopyevent(self):
+        # the copies of the consumer never finish on their own, the slots may only be reused after a synchronize
+        return PendingCopyEvent()
+
+
+'''checkbatch'''
+def checkbatch(data_meta, indices):
+    for pos, index in enumerate(indices):
+        assert data_meta['index'][pos].item() == index
+        assert (data_meta['image'][pos] == index).all() and (data_meta['seg_target'][pos] == index).all()
+
+
+'''test_ringbuffer_wraparound'''
+def test_ringbuffer_wraparound():
+    dataset = IndexDataset(num_samples=10)
+    dataloader = RingBufferDataLoader(dataset, torch.utils.data.SequentialSampler(dataset), batch_size=2, num_workers=2, num_slots=2)
+    try:
+        # 5 batches over 2 slots wrap around the ring several times per epoch
+        for _ in range(3):
+            batches = [{key: value.clone() for key, value in data_meta.items()} for data_meta in dataloader]
+            assert len(batches) == 5
+            for batch_idx, data_meta in enumerate(batches):
+                checkbatch(data_meta, [2 * batch_idx, 2 * batch_idx + 1])
+    finally:
+        dataloader.shutdown()
+
+
+'''test_ringbuffer_slot_reuse'''
+def test_ringbuffer_slot_reuse():
+    dataset = IndexDataset(num_samples=12)
+    dataloader = PendingCopyRingBufferDataLoader(dataset, torch.utils.data.SequentialSampler(dataset), batch_size=2, num_workers=2, num_slots=3)
+    try:
+        prev_data_meta = None
+        for batch_idx, data_meta in enumerate(dataloader):
+            checkbatch(data_meta, [2 * batch_idx, 2 * batch_idx + 1])
+            # the views of the previous batch are still being copied to the device, the workers must not have written into them
+            if prev_data_meta is not None:
+                time.sleep(0.1)
+                checkbatch(prev_data_meta, [2 * batch_idx - 2, 2 * batch_idx - 1])
+            prev_data_meta = data_meta
+    finally:
+        dataloader.shutdown()
+
+
+'''test_balanced_sampler_partition'''
+def test_balanced_sampler_partition():
+    rng = np.random.RandomState(0)
+    dataset = SizedDataset(rng.randint(100, 1000, size=103), rng.randint(100, 1000, size=103))
+    costs = dataset.widths * dataset.heights
+    samplers = [BalancedDistributedEvalSampler(dataset, num_replicas=4, rank=rank) for rank in range(4)]
+    # every image is evaluated exactly once, without padding duplicates
+    indices = [index for sampler in samplers for index in sampler]
+    assert sorted(indices) == list(range(len(dataset)))
+    assert sum(len(sampler) for sampler in samplers) == len(dataset)
+    # the largest image bounds the imbalance of the greedy assignment
+    loads = [int(costs[list(sampler)].sum()) for sampler in samplers]
+    assert max(loads) - min(loads) <= costs.max()
+
+
+'''test_bucketed_sampler_partition'''
+def test_bucketed_sampler_partition():
+    rng = np.random.RandomState(0)
+    dataset = SizedDataset(rng.choice([300, 500], size=50), rng.choice([300, 500], size=50))
+    batch_samplers = [SizeBucketedBatchSampler(dataset, batch_size=4, num_replicas=3, rank=rank) for rank in range(3)]
+    batches = [batch for batch_sampler in batch_samplers for batch in batch_sampler]
+    assert sorted([index for batch in batches for index in batch]) == list(range(len(dataset)))
+    # a batch only holds images of one aspect ratio bucket
+    for batch in batches:
+        assert len(batch) <= 4 and len(set((dataset.heights[batch] / dataset.widths[batch]).tolist())) == 1
@@ -0,0 +1,73 @@
+'''
+Function:
+    Tests of the datasets
+Author:
+    Zhenchao Jin
+'''
+import os
+import torch
+import numpy as np
+from PIL import Image
+from csseg.modules.datasets.base import _BaseDataset, LabelLookupTable
+from csseg.modules.datasets.manifest import SampleManifest
+from csseg.modules.datasets.classindex import ClassPresenceIndex
+
+
+'''test_classindex_fingerprint'''
+def test_classindex_fingerprint(tmp_path):
+    dataset_cfg = {'rootdir': str(tmp_path), 'set': 'train'}
+    for imageid in ['a', 'b']:
+        Image.fromarray(np.zeros((4, 4), dtype=np.uint8)).save(os.path.join(tmp_path, f'{imageid}.png'))
+    fingerprint = ClassPresenceIndex.fingerprint(str(tmp_path), ['a', 'b'], dataset_cfg)
+    assert fingerprint == ClassPresenceIndex.fingerprint(str(tmp_path), ['a', 'b'], dataset_cfg)
+    assert fingerprint != ClassPresenceIndex.fingerprint(str(tmp_path), ['a'], dataset_cfg)
+    # adding an annotation touches the directory
+    stat = os.stat(tmp_path)
+    Image.fromarray(np.zeros((4, 4), dtype=np.uint8)).save(os.path.join(tmp_path, 'c.png'))
+    os.utime(tmp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert fingerprint != ClassPresenceIndex.fingerprint(str(tmp_path), ['a', 'b'], dataset_cfg)
+
+
+'''test_classindex_query'''
+def test_classindex_query():
+    pixel_counts = np.zeros((3, ClassPresenceIndex.NUM_BINS), dtype=np.int64)
+    pixel_counts[0, [0, 1]], pixel_counts[1, [0, 2]], pixel_counts[2, [1, 3]] = 1, 1, 1
+    index = ClassPresenceIndex(imageids=['a', 'b', 'c'], pixel_counts=pixel_counts)
+    assert index.query([1]) == [0, 2]
+    # the disjoint setting drops the images containing future classes
+    assert index.query([1], overlap=False) == [0]
+    assert index.query([2], history_labels=[1], overlap=False) == [1]
+
+
+'''test_imagesizes_cache'''
+def test_imagesizes_cache(tmp_path, monkeypatch):
+    image_dir = os.path.join(tmp_path, 'images')
+    os.makedirs(image_dir)
+    for imageid, (width, height) in zip(['a', 'b', 'c'], [(8, 6), (5, 9), (7, 7)]):
+        Image.fromarray(np.zeros((height, width, 3), dtype=np.uint8)).save(os.path.join(image_dir, f'{imageid}.jpg'))
+    '''builddataset'''
+    def builddataset():
+        dataset = _BaseDataset(mode='TEST', dataset_cfg={'rootdir': str(tmp_path), 'set': 'val'})
+        dataset.image_dir, dataset.manifest = image_dir, SampleManifest.fromdirs(['a', 'b', 'c'], image_dir, os.path.join(tmp_path, 'annotations'))
+        return dataset
+    widths, heights = builddataset().getimagesizes()
+    assert widths.tolist() == [8, 5, 7] and heights.tolist() == [6, 9, 7]
+    # a new build of the dataset loads the cached sizes without opening any image
+    monkeypatch.setattr(Image, 'open', lambda *args, **kwargs: (_ for _ in ()).throw(AssertionError('image opened')))
+    widths, heights = builddataset().getimagesizes()
+    assert widths.tolist() == [8, 5, 7] and heights.tolist() == [6, 9, 7]
+
+
+'''test_labellookuptable'''
+def test_labellookuptable():
+    all_labels, labels, masking_value = list(range(21)), [0, 3, 4, 5], 0
+    labels_to_trainlabels_map = {label: all_labels.index(label) for label in all_labels}
+    labels_to_trainlabels_map[255] = 255
+    lut = LabelLookupTable(labels_to_trainlabels_map, labels + [255], masking_value)
+    seg_target = torch.from_numpy(np.random.RandomState(0).choice(all_labels + [255], size=(2, 16, 16)).astype(np.uint8))
+    # the table gives the same targets as the per-pixel remapping it replaces
+    expected = seg_target.clone().apply_(lambda x: labels_to_trainlabels_map[x] if x in labels + [255] else masking_value)
+    remapped = lut(seg_target)
+    assert remapped.dtype == torch.uint8 and torch.equal(remapped, expected)
+    # the targets of a batch collated as int64 are remapped as well
+    assert torch.equal(lut(seg_target.long()), expected)
@@ -0,0 +1,32 @@
+'''
+Function:
+    Tests of the memory-bounded decoding
+Author:
+    Zhenchao Jin
+'''
+import torch
+import torch.nn.functional as F
+from csseg.modules.models.segmentors.decoding import decodesegpreds
+
+
+'''test_decodesegpreds_chunked'''
+def test_decodesegpreds_chunked():
+    torch.manual_seed(0)
+    seg_logits = torch.randn(2, 21, 17, 23)
+    for align_corners in [False, True]:
+        expected = F.interpolate(seg_logits, size=(67, 91), mode='bilinear', align_corners=align_corners).max(dim=1)[1]
+        assert torch.equal(decodesegpreds(seg_logits, size=(67, 91), align_corners=align_corners, memory_budget_mb=None), expected)
+        # a budget of 4 class maps streams over the classes, the chunks are interpolated exactly as the full tensor
+        memory_budget_mb = 4 * 2 * 67 * 91 * seg_logits.element_size() / 1024 ** 2
+        assert torch.equal(decodesegpreds(seg_logits, size=(67, 91), align_corners=align_corners, memory_budget_mb=memory_budget_mb), expected)
+
+
+'''test_decodesegpreds_tiled'''
+def test_decodesegpreds_tiled():
+    torch.manual_seed(0)
+    seg_logits = torch.randn(2, 5, 9, 13, dtype=torch.float64)
+    for align_corners in [False, True]:
+        expected = F.interpolate(seg_logits, size=(40, 52), mode='bilinear', align_corners=align_corners).max(dim=1)[1]
+        # not even one class map fits, the output rows are tiled with the separable bilinear weights
+        memory_budget_mb = 2 * 52 * 7 * seg_logits.element_size() / 1024 ** 2
+        assert torch.equal(decodesegpreds(seg_logits, size=(40, 52), align_corners=align_corners, memory_budget_mb=memory_budget_mb), expected)
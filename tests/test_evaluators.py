@@ -0,0 +1,71 @@
+'''
+Function:
+    Tests of the evaluators
+Author:
+    Zhenchao Jin
+'''
+import torch
+import numpy as np
+import torch.distributed as dist
+from csseg.modules.datasets.pipelines.evaluators import SegmentationEvaluator, ConfusionStore
+
+
+'''buildshards'''
+def buildshards(num_classes=4, num_images=6, size=8):
+    rng = np.random.RandomState(0)
+    seg_targets = rng.randint(0, num_classes, size=(num_images, size, size))
+    # the ignored pixels are not counted in the confusion entries
+    seg_targets[:, 0, :] = 255
+    seg_preds = rng.randint(0, num_classes, size=(num_images, size, size))
+    imageids = [f'image_{idx}' for idx in range(num_images)]
+    return seg_targets, seg_preds, imageids
+
+
+'''test_confusionstore_query'''
+def test_confusionstore_query(tmp_path):
+    seg_targets, seg_preds, imageids = buildshards()
+    for device in [None, 'cpu']:
+        evaluator = SegmentationEvaluator(num_classes=4, device=device, per_image=True)
+        evaluator.update(torch.from_numpy(seg_targets[:4]), torch.from_numpy(seg_preds[:4]), imageids[:4])
+        evaluator.update(torch.from_numpy(seg_targets[4:]), torch.from_numpy(seg_preds[4:]), imageids[4:])
+        store = ConfusionStore.fromevaluator(evaluator)
+        assert len(store) == 6 and (store.confusionmatrix() == np.asarray(evaluator.confusion_matrix)).all()
+        # the entries of a subset of images give the confusion matrix of an evaluation on those images only
+        subset_evaluator = SegmentationEvaluator(num_classes=4)
+        subset_evaluator.update(seg_targets[[1, 4]], seg_preds[[1, 4]])
+        assert (store.confusionmatrix(imageids=['image_1', 'image_4']) == subset_evaluator.confusion_matrix).all()
+        # classes mapped to a negative id are dropped, the others are merged
+        class_map = np.array([0, 1, 1, -1])
+        merged_evaluator = SegmentationEvaluator(num_classes=2)
+        mapped_targets, mapped_preds = np.where(seg_targets < 4, class_map[seg_targets % 4], 255), class_map[seg_preds]
+        mapped_targets[mapped_preds < 0] = 255
+        merged_evaluator.update(mapped_targets, np.maximum(mapped_preds, 0))
+        assert (store.confusionmatrix(class_map=class_map) == merged_evaluator.confusion_matrix).all()
+        store.save(str(tmp_path / 'confusion.npz'))
+        assert (ConfusionStore.load(str(tmp_path / 'confusion.npz')).confusionmatrix(imageids=['image_0']) == store.confusionmatrix(imageids=['image_0'])).all()
+
+
+'''test_confusionstore_synchronize'''
+def test_confusionstore_synchronize(monkeypatch):
+    seg_targets, seg_preds, imageids = buildshards()
+    evaluators = [SegmentationEvaluator(num_classes=4, per_image=True) for _ in range(2)]
+    for rank, evaluator in enumerate(evaluators):
+        evaluator.update(seg_targets[rank::2], seg_preds[rank::2], imageids[rank::2])
+    # the collectives of two ranks are replayed in a single process
+    packed_list = [torch.cat([torch.as_tensor(e.confusion_matrix).flatten(), torch.tensor([e.total_samples])]) for e in evaluators]
+    entries_list = [e.per_image_entries for e in evaluators]
+    monkeypatch.setattr(dist, 'is_initialized', lambda: True)
+    monkeypatch.setattr(dist, 'get_world_size', lambda: 2)
+    monkeypatch.setattr(dist, 'all_reduce', lambda packed: packed.copy_(sum(packed_list)))
+    monkeypatch.setattr(dist, 'all_gather_object', lambda gathered, obj: gathered.__setitem__(slice(None), entries_list))
+    evaluators[0].synchronize(device='cpu')
+    full_evaluator = SegmentationEvaluator(num_classes=4)
+    full_evaluator.update(seg_targets, seg_preds)
+    assert evaluators[0].total_samples == 6 and (evaluators[0].confusion_matrix == full_evaluator.confusion_matrix).all()
+    # the merged store answers the queries of every image, whichever rank evaluated it
+    store = ConfusionStore.fromevaluator(evaluators[0])
+    assert sorted(store.imageids.tolist()) == sorted(imageids) and (store.confusionmatrix() == full_evaluator.confusion_matrix).all()
+    for imageid, seg_target, seg_pred in zip(imageids, seg_targets, seg_preds):
+        image_evaluator = SegmentationEvaluator(num_classes=4)
+        image_evaluator.update(seg_target[None], seg_pred[None])
+        assert (store.confusionmatrix(imageids=[imageid]) == image_evaluator.confusion_matrix).all()
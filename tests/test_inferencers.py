@@ -0,0 +1,56 @@
+'''
+Function:
+    Tests of the inferencers
+Author:
+    Zhenchao Jin
+'''
+import torch
+import torch.nn.functional as F
+from csseg.modules.models.segmentors.inferencers import BuildInferencer
+
+
+'''PoolingSegmentor'''
+class PoolingSegmentor(torch.nn.Module):
+    def __init__(self, num_classes=3, align_corners=False):
+        super(PoolingSegmentor, self).__init__()
+        self.align_corners = align_corners
+        self.classifier = torch.nn.Conv2d(3, num_classes, kernel_size=1)
+    '''forward'''
+    def forward(self, images):
+        # the logits come at a quarter of the input resolution like a real decoder head
+        return {'seg_logits': self.classifier(F.avg_pool2d(images, kernel_size=4))}
+
+
+'''test_inferencer_timing'''
+def test_inferencer_timing():
+    segmentor, images = PoolingSegmentor().eval(), torch.randn(2, 3, 32, 32)
+    for inferencer_cfg in [{'type': 'WholeInferencer'}, {'type': 'SlidingWindowInferencer', 'window_size': 16, 'stride': 16}]:
+        # the windows are always counted, the clock is only read when timing is switched on
+        inferencer = BuildInferencer(inferencer_cfg)
+        inferencer(segmentor, images)
+        assert inferencer.num_windows > 0 and inferencer.elapsed_time == 0. and inferencer.windowspersecond() == 0.
+        inferencer = BuildInferencer({**inferencer_cfg, 'timing': True})
+        inferencer(segmentor, images)
+        assert inferencer.num_windows > 0 and inferencer.elapsed_time > 0.
+    inferencer = BuildInferencer({'type': 'MultiScaleFlipInferencer', 'scales': [1.0], 'timing': True})
+    inferencer(segmentor, images)
+    assert inferencer.base_inferencer.timing and inferencer.windowspersecond() > 0.
+
+
+'''test_multiscaleflip_output_size'''
+def test_multiscaleflip_output_size():
+    torch.manual_seed(0)
+    segmentor, images = PoolingSegmentor().eval(), torch.randn(2, 3, 32, 48)
+    # a single variant is resized once from the segmentor output straight to the output size
+    inferencer = BuildInferencer({'type': 'MultiScaleFlipInferencer', 'scales': [1.0], 'flip': False})
+    seg_probs = inferencer(segmentor, images, output_size=(40, 60))
+    expected = F.interpolate(segmentor(images)['seg_logits'], size=(40, 60), mode='bilinear', align_corners=False).softmax(dim=1)
+    assert seg_probs.shape == (2, 3, 40, 60) and torch.allclose(seg_probs, expected, atol=1e-6)
+    # the flipped variants are flipped back at the output size, a flip invariant segmentor gives the same average
+    segmentor.forward = lambda images: {'seg_logits': segmentor.classifier(images)}
+    inferencer = BuildInferencer({'type': 'MultiScaleFlipInferencer', 'scales': [1.0], 'flip': True})
+    seg_probs = inferencer(segmentor, images, output_size=(64, 96))
+    expected = F.interpolate(segmentor(images)['seg_logits'], size=(64, 96), mode='bilinear', align_corners=False).softmax(dim=1)
+    assert torch.allclose(seg_probs, expected, atol=1e-5)
+    # without an output size the probabilities stay at the input resolution
+    assert inferencer(segmentor, images).shape == (2, 3, 32, 48)
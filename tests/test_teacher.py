@@ -0,0 +1,83 @@
+'''
+Function:
+    Tests of FrozenTeacher
+Author:
+    Zhenchao Jin
+'''
+import copy
+import torch
+import pytest
+import torch.nn as nn
+pytest.importorskip('inplace_abn')
+from inplace_abn import ABN
+from csseg.modules.models.segmentors.teacher import FrozenTeacher
+
+
+'''TinySegmentor'''
+class TinySegmentor(nn.Module):
+    def __init__(self, norm_type='BatchNorm2d'):
+        super(TinySegmentor, self).__init__()
+        self.align_corners = False
+        self.conv1 = nn.Conv2d(3, 16, kernel_size=3, padding=1, bias=False)
+        self.norm1 = nn.BatchNorm2d(16) if norm_type == 'BatchNorm2d' else ABN(16, activation='leaky_relu', activation_param=0.01)
+        self.conv2 = nn.Conv2d(16, 5, kernel_size=1)
+        # non-trivial running statistics and affine parameters, so that a wrong fold would show up
+        with torch.no_grad():
+            self.norm1.running_mean.uniform_(-1, 1)
+            self.norm1.running_var.uniform_(0.5, 2)
+            self.norm1.weight.uniform_(0.5, 1.5)
+            self.norm1.bias.uniform_(-0.5, 0.5)
+    '''forward'''
+    def forward(self, x):
+        return {'seg_logits': self.conv2(self.norm1(self.conv1(x)))}
+
+
+'''buildteacher'''
+def buildteacher(norm_type, **kwargs):
+    torch.manual_seed(0)
+    segmentor = TinySegmentor(norm_type).eval()
+    reference = copy.deepcopy(segmentor)
+    teacher = FrozenTeacher(segmentor, example_inputs=torch.randn(2, 3, 32, 32), **kwargs)
+    return teacher, reference
+
+
+'''test_fold'''
+@pytest.mark.parametrize('norm_type', ['BatchNorm2d', 'ABN'])
+def test_fold(norm_type):
+    teacher, reference = buildteacher(norm_type, dtype='float32')
+    assert teacher.num_folded_norms == 1
+    assert not any(FrozenTeacher.isfoldablenorm(module) for module in teacher.modules())
+    # fresh batches, not only the one checked at construction
+    for _ in range(4):
+        images = torch.randn(2, 3, 32, 32) * 3
+        with torch.no_grad():
+            error = FrozenTeacher.maxrelativeerror(teacher(images), reference(images))
+        assert error <= teacher.tolerance
+
+
+'''test_tolerance_under_autocast'''
+@pytest.mark.parametrize('norm_type', ['BatchNorm2d', 'ABN'])
+def test_tolerance_under_autocast(norm_type):
+    teacher, reference = buildteacher(norm_type, dtype='float32')
+    images = torch.randn(2, 3, 32, 32) * 3
+    with torch.no_grad():
+        reference_outputs = reference(images)
+    # the training step runs the teacher inside autocast, its outputs must still meet the float32 tolerance
+    with torch.autocast(device_type='cpu', dtype=torch.bfloat16):
+        outputs = teacher(images)
+    assert outputs['seg_logits'].dtype == torch.float32
+    assert FrozenTeacher.maxrelativeerror(outputs, reference_outputs) <= teacher.tolerance
+
+
+'''test_tolerance_violation'''
+def test_tolerance_violation():
+    with pytest.raises(AssertionError):
+        buildteacher('BatchNorm2d', dtype='bfloat16', tolerance=1e-9)
+
+
+'''test_frozen'''
+def test_frozen():
+    teacher, _ = buildteacher('BatchNorm2d', dtype='float32')
+    teacher.train()
+    assert not teacher.training and not teacher.segmentor.training
+    assert not any(param.requires_grad for param in teacher.parameters())